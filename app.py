@@ -1,23 +1,75 @@
 import base64
 import copy
 import json
+import mimetypes
 import os
 import shutil
-import tempfile
+import time
 import uuid
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from io import BytesIO
 from pathlib import Path
-from threading import Lock
 
 import requests
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request, send_from_directory
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    render_template,
+    request,
+    send_file,
+    send_from_directory,
+    stream_with_context,
+)
 from PIL import Image
-
-from plugins import get_face_swap_plugin
-from test_gen_api import generate_via_image_fallback
-from uploader import UploadError, upload_file
+from werkzeug.security import safe_join
+
+from coordination import file_lock
+from history_index import HistoryIndex
+from history_layout import (
+    actual_path,
+    record_candidates,
+    record_path,
+    resolve,
+    shard_path,
+)
+from image_normalize import normalize_upload
+from jobs import JobManager, sse_stream
+from metrics import (
+    REQUEST_BYTES_IN,
+    REQUEST_LATENCY,
+    RESPONSE_BYTES_OUT,
+    STAGE_BYTES_IN,
+    STAGE_BYTES_OUT,
+    UPLOAD_NORMALIZE,
+    CallbackGauge,
+    timed,
+)
+from metrics import render as render_metrics
+from plugin_health import FALLBACK_POLICY, plugin_health
+from plugins import (
+    call_plugin_in_slot,
+    get_face_swap_plugin,
+    get_face_swap_plugin_name,
+    list_plugins,
+)
+from result_cache import result_cache, result_cache_key
+from storage_gc import StorageGC
+from storyboard_catalog import StoryboardCatalog
+from storyboard_export import EXPORTERS, sheet_pages
+from test_gen_api import generate_via_image_fallback, get_fallback_stats
+from thumbnails import (
+    backfill_status,
+    make_thumbnails_safe,
+    remove_thumbnails,
+    resolve_thumbnail,
+    start_backfill,
+    thumbnail_urls,
+)
+from uploader import get_upload_cache_stats, upload_file
 
 load_dotenv()
 
@@ -29,9 +81,22 @@ SESSION_KEY = os.getenv("SESSION_KEY")
 HISTORY_DIR = Path("history")
 HISTORY_DIR.mkdir(exist_ok=True)
 
-# 避免重复提交（简单任务锁）
-current_task_lock = Lock()
-is_generating = False
+# 生成任务队列（替代原先的全局任务锁）
+job_manager = JobManager()
+
+# /upload-images 的转码 + 上传线程池
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "10"))
+upload_executor = ThreadPoolExecutor(
+    max_workers=UPLOAD_WORKERS, thread_name_prefix="upload"
+)
+
+# 结果图下载：并发数、单张大小上限（字节）、单张总超时（秒）
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "60"))
+download_executor = ThreadPoolExecutor(
+    max_workers=DOWNLOAD_WORKERS, thread_name_prefix="download"
+)
 
 # 保存输入图片
 INPUT_IMAGES_DIR = HISTORY_DIR / "inputs"
@@ -42,70 +107,151 @@ INPUT_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
 RESULTS_DIR = HISTORY_DIR / "results"
 RESULTS_DIR.mkdir(exist_ok=True)
 
+# 这些子目录下的图片一经写入不再修改，可以让浏览器长期缓存
+IMMUTABLE_SUBDIRS = ("inputs/", "results/", "thumbs/")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# 可选由前置 Web 服务器发送图片："x-accel"（nginx）或 "x-sendfile"（Apache/lighttpd）
+HISTORY_SENDFILE = os.getenv("HISTORY_SENDFILE", "").lower()
+# x-accel 模式下 nginx 中映射到 history/ 的 internal location
+HISTORY_ACCEL_PREFIX = os.getenv("HISTORY_ACCEL_PREFIX", "/_protected_history")
+
+# 历史记录索引（SQLite），/history 分页直接查询索引
+history_index = HistoryIndex(HISTORY_DIR)
+# /history 每页最多返回的记录数
+HISTORY_MAX_LIMIT = 100
+
 
 app = Flask(__name__)
 app.secret_key = SESSION_KEY  # 用于 session 安全
 
+CallbackGauge("jobs_queue_depth", "Jobs waiting for a worker", job_manager.queue_depth)
 
-def save_image_from_url(url: str, folder: Path) -> str:
-    """从 URL 下载图片，保存到 folder，返回本地相对路径（如 'results/abc.jpg'）"""
-    try:
-        resp = requests.get(url, stream=True, timeout=30)
-        if resp.status_code != 200:
-            raise Exception(f"HTTP {resp.status_code}")
 
-        # 推测文件扩展名
-        ext = ".jpg"  # 默认用 jpg
-        content_type = resp.headers.get("content-type", "")
-        if "png" in content_type:
-            ext = ".png"
-        elif "webp" in content_type:
-            ext = ".webp"
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
 
-        filename = str(uuid.uuid4()) + ext
-        filepath = folder / filename
 
-        with open(filepath, "wb") as f:
-            resp.raw.decode_content = True
-            shutil.copyfileobj(resp.raw, f)
+@app.after_request
+def _record_request_metrics(response):
+    # 流式响应（SSE、send_file）只统计到响应头返回为止
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            route,
+            request.method,
+            str(response.status_code),
+        )
+        if request.content_length:
+            REQUEST_BYTES_IN.inc(route, amount=request.content_length)
+        if response.content_length:
+            RESPONSE_BYTES_OUT.inc(route, amount=response.content_length)
+    return response
 
-        # 强制转为 JPG（统一格式）
-        if ext != ".jpg":
-            from PIL import Image
 
-            img = Image.open(filepath).convert("RGB")
-            jpg_path = filepath.with_suffix(".jpg")
-            img.save(jpg_path, "JPEG", quality=92)
-            filepath.unlink()  # 删除原文件
-            filepath = jpg_path
+def save_image_from_url(url: str, folder: Path) -> str:
+    """
+    从 URL 流式下载图片，保存到 folder 下（按分片目录）的 JPG，
+    返回本地相对路径（如 'history/results/3f/abc.jpg'）
 
-        return str(filepath.relative_to(Path(".")))  # 如 "history/inputs/xxx.jpg"
+    - 按文件头判断格式：JPEG 边下载边写盘，不做转码
+    - 其他格式（PNG/WebP 等）在内存中一次解码后直接写出 JPG，不落原始文件
+    - 超过 DOWNLOAD_MAX_BYTES 或总耗时超过 DOWNLOAD_TIMEOUT 时放弃
+    """
+    filepath = shard_path(folder, str(uuid.uuid4()) + ".jpg")
+    part_path = filepath.with_suffix(".part")
+    try:
+        with timed("save_image_from_url"):
+            _download_image(url, filepath, part_path)
+        make_thumbnails_safe(str(filepath))
+        return str(filepath.relative_to(Path(".")))  # 如 "history/results/3f/xxx.jpg"
     except Exception as e:
         print(f"[Save Image Error] {url} -> {e}")
+        part_path.unlink(missing_ok=True)
+        filepath.unlink(missing_ok=True)
         return None
 
 
-def save_uploaded_file_as_jpg(file_storage, folder: Path) -> str:
-    """将 Flask 上传的 file 保存为 JPG（PNG 自动转）"""
-    try:
-        filename = str(uuid.uuid4()) + ".jpg"
-        temp_path = folder / filename
+def _download_image(url: str, filepath: Path, part_path: Path):
+    deadline = time.time() + DOWNLOAD_TIMEOUT
+    with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as resp:
+        if resp.status_code != 200:
+            raise Exception(f"HTTP {resp.status_code}")
+        if int(resp.headers.get("content-length") or 0) > DOWNLOAD_MAX_BYTES:
+            raise Exception("image too large")
+
+        def chunks():
+            received = 0
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                received += len(chunk)
+                if received > DOWNLOAD_MAX_BYTES:
+                    raise Exception("image too large")
+                if time.time() > deadline:
+                    raise Exception("download timeout")
+                yield chunk
+
+        stream = chunks()
+        head = next(stream, b"")
+        if head.startswith(b"\xff\xd8\xff"):
+            # 已经是 JPG：直接写入（先写 .part，完成后改名，避免留下残缺文件）
+            with open(part_path, "wb") as f:
+                f.write(head)
+                for chunk in stream:
+                    f.write(chunk)
+            part_path.replace(filepath)
+        else:
+            # 强制转为 JPG（统一格式）
+            buf = BytesIO(head)
+            for chunk in stream:
+                buf.write(chunk)
+            buf.seek(0)
+            img = Image.open(buf).convert("RGB")
+            img.save(filepath, "JPEG", quality=92)
+
+    STAGE_BYTES_OUT.inc("save_image_from_url", amount=filepath.stat().st_size)
+
+
+def save_images_from_urls(urls, folder: Path) -> list:
+    """并发下载多张结果图，返回与 urls 顺序一致的本地路径列表（失败项为 None）"""
+    if len(urls) <= 1:
+        return [save_image_from_url(url, folder) for url in urls]
+    return list(
+        download_executor.map(lambda url: save_image_from_url(url, folder), urls)
+    )
 
-        # 若是 PNG，用 PIL 转 JPG（带白底）
-        if file_storage.filename.lower().endswith(".png"):
-            from PIL import Image
 
-            img = Image.open(file_storage.stream).convert("RGBA")
-            background = Image.new("RGB", img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
-            background.save(temp_path, "JPEG", quality=92)
-        else:
-            # 直接保存为 JPG（即使原为 JPG/JPEG）
-            from PIL import Image
+def _stream_size(stream) -> int:
+    """可 seek 的上传流的总字节数（不移动读取位置）"""
+    try:
+        pos = stream.tell()
+        size = stream.seek(0, os.SEEK_END)
+        stream.seek(pos)
+        return size
+    except (AttributeError, OSError):
+        return 0
 
-            img = Image.open(file_storage.stream).convert("RGB")
-            img.save(temp_path, "JPEG", quality=92)
 
+def save_uploaded_file_as_jpg(file_storage, folder: Path) -> str:
+    """
+    保存上传的图片（见 image_normalize）：符合要求的 JPEG 原样复制，
+    其他格式（或需要按 EXIF 旋转的 JPEG）按 UPLOAD_OUTPUT_FORMAT 重新编码，默认 JPG
+    """
+    try:
+        with timed("save_uploaded_file_as_jpg"):
+            STAGE_BYTES_IN.inc(
+                "save_uploaded_file_as_jpg", amount=_stream_size(file_storage.stream)
+            )
+            temp_path, source_format, action = normalize_upload(
+                file_storage.stream, shard_path(folder, str(uuid.uuid4()))
+            )
+            UPLOAD_NORMALIZE.inc(source_format, action)
+            STAGE_BYTES_OUT.inc(
+                "save_uploaded_file_as_jpg", amount=temp_path.stat().st_size
+            )
+
+        make_thumbnails_safe(str(temp_path))
         return str(temp_path.relative_to(Path(".")))
     except Exception as e:
         print(f"[Save Uploaded File Error] {e}")
@@ -114,7 +260,45 @@ def save_uploaded_file_as_jpg(file_storage, folder: Path) -> str:
 
 @app.route("/history/<path:filename>")
 def history_files(filename):
-    return send_from_directory(HISTORY_DIR, filename)
+    # 缩略图不存在时按需从原图生成
+    if filename.startswith("thumbs/") and not resolve_thumbnail(filename[7:]):
+        return jsonify({"error": "Not found"}), 404
+
+    # 记录 JSON、索引等可变文件：普通方式返回
+    if not filename.startswith(IMMUTABLE_SUBDIRS):
+        return send_from_directory(HISTORY_DIR, filename)
+
+    # 平铺布局的旧 URL 和分片布局的新 URL 都解析到文件的实际位置（见 history_layout）
+    filename = resolve(filename) or filename
+
+    # 图片按 UUID 命名且从不改写：长期缓存 + 强 ETag + 304 + Range
+    path = safe_join(str(HISTORY_DIR.resolve()), filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "Not found"}), 404
+
+    if HISTORY_SENDFILE == "x-accel":
+        # 交给 nginx 等前置服务器发送文件内容
+        resp = Response(mimetype=mimetypes.guess_type(filename)[0])
+        resp.headers["X-Accel-Redirect"] = f"{HISTORY_ACCEL_PREFIX}/{filename}"
+    elif HISTORY_SENDFILE == "x-sendfile":
+        resp = Response(mimetype=mimetypes.guess_type(filename)[0])
+        resp.headers["X-Sendfile"] = path
+    else:
+        resp = send_file(path, conditional=True, etag=True, max_age=IMMUTABLE_MAX_AGE)
+
+    resp.cache_control.public = True
+    resp.cache_control.max_age = IMMUTABLE_MAX_AGE
+    resp.cache_control.immutable = True
+    return resp
+
+
+@app.route("/thumbnails/backfill", methods=["GET", "POST"])
+def thumbnails_backfill():
+    """POST 启动后台缩略图回填，GET 查看进度"""
+    if request.method == "POST":
+        started = start_backfill()
+        return jsonify({"started": started, **backfill_status()}), 202
+    return jsonify(backfill_status())
 
 
 @app.route("/")
@@ -122,47 +306,49 @@ def index():
     return render_template("index.html")
 
 
+def _save_and_upload(file, size=None, aspect_ratio=None):
+    """
+    保存本地 JPG 副本（完整分辨率）并上传到外部服务，返回 (external_url, local_path)。
+    提供 size / aspect_ratio 时上传按生成目标缩小的副本（见 upload_resize）
+    """
+    # 1. 保存本地 JPG 副本（用于历史记录）
+    file.stream.seek(0)
+    local_path = save_uploaded_file_as_jpg(file, INPUT_IMAGES_DIR)
+    if not local_path:
+        return None, None
+
+    # 2. 上传到外部服务（ImgBB 或 GitHub+jsDelivr）
+    try:
+        external_url = upload_file(local_path, file.filename, size, aspect_ratio)
+    except Exception as e:
+        print(f"[Upload External Error] {e}")
+        external_url = None
+    return external_url, "/" + local_path.replace("\\", "/")
+
+
 @app.route("/upload-images", methods=["POST"])
 def upload_images():
     files = request.files.getlist("images")
     if not files:
         return jsonify({"error": "No images provided"}), 400
 
-    external_urls = []
-    local_paths = []
-
-    for file in files[:10]:
-        if not file.filename.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
-            continue
+    files = [
+        file
+        for file in files[:10]
+        if file.filename.lower().endswith((".png", ".jpg", ".jpeg", ".webp"))
+    ]
 
-        # 1. 保存本地 JPG 副本（用于历史记录）
-        file.stream.seek(0)
-        local_path = save_uploaded_file_as_jpg(file, INPUT_IMAGES_DIR)
-        if not local_path:
-            continue
-        local_paths.append("/" + local_path.replace("\\", "/"))
+    # 转码和上传在线程池中并行执行，map 保证结果顺序与上传顺序一致
+    size = request.form.get("size")
+    aspect_ratio = request.form.get("aspect_ratio")
+    results = list(
+        upload_executor.map(
+            lambda file: _save_and_upload(file, size, aspect_ratio), files
+        )
+    )
 
-        # 2. 上传到外部服务（ImgBB 或 GitHub+jsDelivr）
-        try:
-            # 临时保存文件用于上传
-            with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-                tmp_path = tmp.name
-                with open(local_path, "rb") as src:
-                    tmp.write(src.read())
-            # 上传
-            external_url = upload_file(tmp_path, file.filename)
-            external_urls.append(external_url)
-        except Exception as e:
-            print(f"[Upload External Error] {e}")
-            external_urls.append(None)
-        finally:
-            if "tmp_path" in locals():
-                Path(tmp_path).unlink(missing_ok=True)
-
-    # 过滤掉上传失败的
-    valid_records = [
-        (url, local) for url, local in zip(external_urls, local_paths) if url
-    ]
+    # 过滤掉保存或上传失败的
+    valid_records = [(url, local) for url, local in results if url and local]
     if not valid_records:
         return jsonify({"error": "All uploads failed"}), 500
 
@@ -170,126 +356,180 @@ def upload_images():
     return jsonify({"urls": list(external_urls), "local_paths": list(local_paths)})
 
 
+def run_generate_job(job, data):
+    """任务线程中执行：（查结果缓存）→ 调用插件生成 → 下载结果 → 写入历史记录"""
+    if result_cache is None:
+        return _generate_and_record(job, data)
+
+    key = result_cache_key(
+        data.get("prompt", ""),
+        data.get("image_urls", []),
+        data.get("local_input_paths", []),
+        data.get("size", "2K"),
+        data.get("aspect_ratio", "auto"),
+    )
+    result, source = result_cache.get_or_compute(
+        key,
+        lambda: _generate_and_record(job, data),
+        force_refresh=bool(data.get("force_refresh")),
+    )
+    if source != "miss":
+        job.emit("stage", stage=source)  # hit / coalesced
+    return dict(result, cached=source != "miss")
+
+
+def _generate_and_record(job, data):
+    image_urls = data.get("image_urls", [])  # ← 这是 ImgBB URLs，正确！
+    prompt = data.get("prompt", "").strip()
+    size = data.get("size", "2K")
+    aspect_ratio = data.get("aspect_ratio", "auto")
+
+    job.emit("stage", stage="generating")
+    try:
+        result_urls = generate_via_image_fallback(
+            image_urls=image_urls,
+            prompt=prompt,
+            size=size,
+            ar=aspect_ratio,
+            fallback_order=["nano_banana", "rh_official"],
+        )
+    except Exception as e:
+        raise Exception(f"Generation failed: {str(e)}")
+
+    if not result_urls:
+        raise Exception("All APIs failed to generate image")
+
+    # ✅ 保存结果图到本地（从 result_urls 下载）
+    job.emit("stage", stage="saving")
+    local_result_paths = [
+        "/" + local_path.replace("\\", "/")
+        for local_path in save_images_from_urls(result_urls, RESULTS_DIR)
+        if local_path
+    ]
+
+    if not local_result_paths:
+        raise Exception("Failed to save result images locally")
+
+    # ✅ 获取对应的本地输入图路径（用于历史记录展示）
+    # 前端在 /generate 时额外传 `local_input_paths`
+    local_input_paths = [path for path in data.get("local_input_paths", []) if path]
+
+    record_id = str(uuid.uuid4())
+    record = {
+        "id": record_id,
+        "timestamp": datetime.now().isoformat(),
+        "image_urls": image_urls,  # 外部 URL（用于调试）
+        "local_input_paths": local_input_paths,
+        "result_urls": result_urls,  # 外部 URL
+        "local_result_paths": local_result_paths,  # 本地路径
+        "prompt": prompt,
+        "size": size,
+        "aspect_ratio": aspect_ratio,
+    }
+
+    json_path = record_path(record_id)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    history_index.add(json_path, record)
+
+    # 返回本地路径给前端展示
+    return {
+        "success": True,
+        "result_urls": local_result_paths,  # 前端用本地路径显示
+        "record_id": record_id,
+    }
+
+
+job_manager.register("generate", run_generate_job)
+
+
 @app.route("/generate", methods=["POST"])
 def generate():
-    global is_generating
-    if current_task_lock.locked():
-        return jsonify({"error": "Another task is running. Please wait."}), 429
+    """提交生成任务，立即返回 job id；结果通过 /jobs/<id> 或 /jobs/<id>/events 获取"""
+    data = request.get_json()
+    if not data.get("prompt", "").strip():
+        return jsonify({"error": "Prompt is required"}), 400
+
+    job = job_manager.submit("generate", run_generate_job, data)
+    return jsonify({"success": True, "job_id": job.id, "status": job.status}), 202
+
+
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """SSE：推送任务的排队/运行/完成事件，支持 Last-Event-ID 断线续传"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    last_event_id = request.headers.get("Last-Event-ID", "-1")
+    last_event_id = int(last_event_id) if last_event_id.lstrip("-").isdigit() else -1
+    return Response(
+        stream_with_context(sse_stream(job, last_event_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    with current_task_lock:
-        data = request.get_json()
-        image_urls = data.get("image_urls", [])  # ← 这是 ImgBB URLs，正确！
-        prompt = data.get("prompt", "").strip()
-        size = data.get("size", "2K")
-        aspect_ratio = data.get("aspect_ratio", "auto")
 
-        if not prompt:
-            return jsonify({"error": "Prompt is required"}), 400
+@app.route("/plugins")
+def plugins_list():
+    """已发现的插件及其 manifest 元数据（能力、尺寸、长宽比、并发上限）"""
+    return jsonify(list_plugins())
 
-        try:
-            result_urls = generate_via_image_fallback(
-                image_urls=image_urls,
-                prompt=prompt,
-                size=size,
-                ar=aspect_ratio,
-                fallback_order=["nano_banana", "rh_official"],
-            )
-        except Exception as e:
-            return jsonify({"error": f"Generation failed: {str(e)}"}), 500
-
-        if not result_urls:
-            return jsonify({"error": "All APIs failed to generate image"}), 500
-
-        # ✅ 保存结果图到本地（从 result_urls 下载）
-        local_result_paths = []
-        for url in result_urls:
-            local_path = save_image_from_url(url, RESULTS_DIR)
-            if local_path:
-                local_result_paths.append("/" + local_path.replace("\\", "/"))
-
-        if not local_result_paths:
-            return jsonify({"error": "Failed to save result images locally"}), 500
-
-        # ✅ 获取对应的本地输入图路径（用于历史记录展示）
-        # 假设前端传的 image_urls 顺序和本地保存一致 —— 但更可靠的方式是前端传 local_paths？
-        # 简化方案：我们从历史中匹配（不完美），或让前端同时传 local_input_paths
-        # → 更好的做法：前端在 generate 时同时传 local_input_paths
-
-        # 为简化，我们暂不保存输入图本地路径到 record（或从已有文件推断）
-        # 实际上，你可以通过 image_urls 的文件名反推，但略复杂
-        # 建议：前端在 /generate 时额外传 `local_input_paths`
-
-        local_input_paths = data.get("local_input_paths", [])
-
-        record_id = str(uuid.uuid4())
-        record = {
-            "id": record_id,
-            "timestamp": datetime.now().isoformat(),
-            "image_urls": image_urls,  # 外部 URL（用于调试）
-            "local_input_paths": local_input_paths,
-            "result_urls": result_urls,  # 外部 URL
-            "local_result_paths": local_result_paths,  # 本地路径
-            "prompt": prompt,
-            "size": size,
-            "aspect_ratio": aspect_ratio,
-        }
 
-        record_path = HISTORY_DIR / f"{record_id}.json"
-        with open(record_path, "w", encoding="utf-8") as f:
-            json.dump(record, f, ensure_ascii=False, indent=2)
+@app.route("/plugins/health")
+def plugins_health():
+    """各插件的成功率、p50/p95 耗时与熔断状态"""
+    return jsonify({"policy": FALLBACK_POLICY, "plugins": plugin_health.snapshot()})
 
-        # 返回本地路径给前端展示
-        return jsonify(
-            {
-                "success": True,
-                "result_urls": local_result_paths,  # 前端用本地路径显示
-                "record_id": record_id,
-            }
-        )
 
+@app.route("/plugins/fallback-stats")
+def fallback_stats():
+    """插件调度统计（胜出次数、耗时分位数、对冲浪费的调用数），用于调整 HEDGE_DELAY"""
+    return jsonify(get_fallback_stats())
 
-@app.route("/history")
-def get_history():
-    """分页获取历史记录（JSON 文件列表）"""
-    page = int(request.args.get("page", 1))
-    limit = int(request.args.get("limit", 12))
-    if page < 1:
-        page = 1
-
-    # 获取所有 JSON 文件，按时间倒序
-    history_files = sorted(
-        HISTORY_DIR.glob("*.json"), key=os.path.getmtime, reverse=True
-    )
 
-    total = len(history_files)
-    start = (page - 1) * limit
-    end = start + limit
-    page_files = history_files[start:end]
+@app.route("/upload-cache/stats")
+def upload_cache_stats():
+    """上传缓存命中率"""
+    return jsonify(get_upload_cache_stats())
 
-    records = []
-    for f in page_files:
-        try:
-            with open(f, "r", encoding="utf-8") as fp:
-                record = json.load(fp)
-                # 只返回必要字段给前端
-                records.append(
-                    {
-                        "id": record["id"],
-                        "timestamp": record["timestamp"],
-                        "result_paths": record.get("local_result_paths", []),
-                        "result_urls": record.get("result_urls", []),
-                        "input_paths": record.get("local_input_paths", []),
-                        "input_urls": record.get("image_urls", []),
-                        "params": {
-                            "size": record["size"],
-                            "aspect_ratio": record["aspect_ratio"],
-                            "prompt": record["prompt"],
-                        },
-                    }
-                )
-        except Exception as e:
-            print(f"[History] Load error: {f} - {e}")
-            continue
+
+@app.route("/result-cache/stats")
+def result_cache_stats():
+    """生成结果缓存命中率"""
+    if result_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(result_cache.stats())
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/history")
+def get_history():
+    """分页获取历史记录（JSON 文件列表），limit 必须 >= 1，最多 HISTORY_MAX_LIMIT"""
+    limit = request.args.get("limit", 12, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit must be >= 1"}), 400
+    limit = min(limit, HISTORY_MAX_LIMIT)
+    page = max(request.args.get("page", 1, type=int), 1)
+
+    # 从索引中按时间倒序取一页（只包含必要字段）
+    records, total = history_index.page((page - 1) * limit, limit)
+    for record in records:
+        record["result_thumbs"] = thumbnail_urls(record["result_paths"])
+        record["input_thumbs"] = thumbnail_urls(record["input_paths"])
 
     return jsonify(
         {
@@ -313,7 +553,12 @@ def quick_upload():
         return jsonify({"error": "Save failed"}), 500
 
     try:
-        external_url = upload_file(local_path, file.filename)
+        external_url = upload_file(
+            local_path,
+            file.filename,
+            request.form.get("size"),
+            request.form.get("aspect_ratio"),
+        )
         return jsonify(
             {
                 "url": external_url,
@@ -325,34 +570,47 @@ def quick_upload():
         return jsonify({"error": "External upload failed"}), 500
 
 
+def _save_crop(stream) -> str:
+    """保存一张裁剪图到 history/results/：已是 JPEG 的原样写入，其他格式转为 JPG"""
+    filepath = shard_path(RESULTS_DIR, f"{uuid.uuid4().hex}.jpg")
+    head = stream.read(3)
+    stream.seek(0)
+    if head == b"\xff\xd8\xff":
+        with open(filepath, "wb") as f:
+            shutil.copyfileobj(stream, f)
+    else:
+        Image.open(stream).convert("RGB").save(filepath, "JPEG", quality=92)
+    make_thumbnails_safe(str(filepath))
+
+    # 返回相对于项目根目录的路径（前端可直接 /history/results/... 访问）
+    return f"/{filepath.relative_to(Path('.')).as_posix()}"
+
+
 @app.route("/save-cropped-images", methods=["POST"])
 def save_cropped_images():
-    """接收 Base64 图片列表，保存到 history/results/，返回本地路径"""
-    data = request.get_json()
-    base64_images = data.get("images", [])  # list of "data:image/jpeg;base64,..."
+    """
+    接收裁剪图，保存到 history/results/，返回本地路径。
 
-    if not base64_images:
+    - multipart/form-data：多个 images 文件字段（二进制，推荐）
+    - application/json：{"images": ["data:image/jpeg;base64,...", ...]}（兼容旧前端）
+    """
+    if request.files:
+        # multipart：Werkzeug 会把较大的分段缓存在临时文件中，逐个读取保存
+        sources = [file.stream for file in request.files.getlist("images")]
+    else:
+        data = request.get_json(silent=True) or {}
+        sources = data.get("images", [])  # list of "data:image/jpeg;base64,..."
+
+    if not sources:
         return jsonify({"error": "No images provided"}), 400
 
     saved_paths = []
-    for b64_str in base64_images:
+    for source in sources:
         try:
-            # 去掉 data URL 前缀（如果有）
-            if b64_str.startswith("data:image"):
-                header, b64_str = b64_str.split(",", 1)
-
-            # 解码 Base64
-            image_data = base64.b64decode(b64_str)
-            image = Image.open(BytesIO(image_data)).convert("RGB")
-
-            # 生成唯一文件名
-            filename = f"{uuid.uuid4().hex}.jpg"
-            filepath = RESULTS_DIR / filename
-            image.save(filepath, "JPEG", quality=92)
-
-            # 返回相对于项目根目录的路径（前端可直接 /history/results/... 访问）
-            rel_path = f"/{filepath.relative_to(Path('.')).as_posix()}"
-            saved_paths.append(rel_path)
+            if isinstance(source, str):
+                # 去掉 data URL 前缀（如果有）后逐个解码，避免同时持有所有图片
+                source = BytesIO(base64.b64decode(source.split(",", 1)[-1]))
+            saved_paths.append(_save_crop(source))
         except Exception as e:
             print(f"[Save Cropped Image Error] {e}")
             continue
@@ -368,51 +626,93 @@ def save_manual_history():
         record_data = copy.deepcopy(data)
         record_data["local_result_paths"] = [local_result_path]
         record_id = data.get("id", str(uuid.uuid4()))
-        record_path = HISTORY_DIR / f"{record_id}_{i}.json"
-        with open(record_path, "w", encoding="utf-8") as f:
+        json_path = record_path(f"{record_id}_{i}")
+        with open(json_path, "w", encoding="utf-8") as f:
             json.dump(record_data, f, ensure_ascii=False, indent=2)
+        history_index.add(json_path, record_data)
         i += 1
     return jsonify({"success": True})
 
 
+def _delete_local_image(rel_path: str):
+    """删除 history/ 下的一张本地图片及其缩略图（不在 history/ 下的路径忽略）"""
+    full_path = Path(rel_path.lstrip("/")).resolve()
+    history_root = HISTORY_DIR.resolve()
+    if history_root not in full_path.parents:
+        return
+    # 记录中的平铺路径可能已迁移到分片目录
+    actual = resolve(full_path.relative_to(history_root).as_posix())
+    if actual:
+        (HISTORY_DIR / actual).unlink(missing_ok=True)
+    remove_thumbnails(rel_path)
+
+
+def delete_record_group(record_id: str) -> bool:
+    """
+    删除同一 id 的全部历史记录（id.json、id_1.json…）及其结果图和输入图。
+    仍被其他记录或故事板引用的图片会保留。记录不存在时返回 False。
+    """
+    names = history_index.find_group(record_id)
+    if not names:
+        return False
+
+    # 1. 从索引中取出所有关联图片，再删除 JSON 与索引项
+    image_paths = history_index.paths_for(names)
+    for name in names:
+        for json_path in record_candidates(name):
+            json_path.unlink(missing_ok=True)
+        history_index.remove(name)
+
+    # 2. 删除不再被任何记录、任何故事板引用的本地图片
+    unshared = [path for path in image_paths if not history_index.is_referenced(path)]
+    in_storyboards = storage_gc.storyboards.referenced(unshared) if unshared else set()
+    for rel_path in unshared:
+        if rel_path not in in_storyboards:
+            _delete_local_image(rel_path)
+    return True
+
+
 @app.route("/history/<record_id>", methods=["DELETE"])
 def delete_history_record(record_id):
     """删除指定历史记录（JSON + 本地图片）"""
     try:
-        # 1. 找到 JSON 文件
-        json_path = None
-        for f in HISTORY_DIR.glob("*.json"):
-            if f.stem.startswith(record_id):
-                json_path = f
-                break
-
-        if not json_path:
+        if not delete_record_group(record_id):
             return jsonify({"error": "Record not found"}), 404
-
-        # 2. 读取记录，获取所有本地图片路径
-        with open(json_path, "r", encoding="utf-8") as fp:
-            record = json.load(fp)
-
-        all_local_paths = []
-        all_local_paths.extend(record.get("local_result_paths", []))
-
-        # 3. 删除 JSON 文件
-        json_path.unlink()
-
-        # 4. 删除关联的本地图片
-        for rel_path in all_local_paths:
-            if rel_path.startswith("/"):
-                rel_path = rel_path[1:]
-            full_path = Path(rel_path)
-            if full_path.exists():
-                full_path.unlink()
-
         return jsonify({"success": True})
     except Exception as e:
         print(f"[Delete Error] {e}")
         return jsonify({"error": "Delete failed"}), 500
 
 
+@app.route("/history/bulk-delete", methods=["POST"])
+def bulk_delete_history_records():
+    """批量删除：{"ids": [...]}，返回已删除和未找到的 id"""
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids", [])
+    if not isinstance(ids, list) or not ids:
+        return jsonify({"error": "ids is required"}), 400
+
+    deleted, not_found, failed = [], [], []
+    for record_id in ids:
+        try:
+            if delete_record_group(str(record_id)):
+                deleted.append(record_id)
+            else:
+                not_found.append(record_id)
+        except Exception as e:
+            print(f"[Delete Error] {record_id}: {e}")
+            failed.append(record_id)
+
+    return jsonify(
+        {
+            "success": not failed,
+            "deleted": deleted,
+            "not_found": not_found,
+            "failed": failed,
+        }
+    )
+
+
 # @app.route("/swap_face", methods=["POST"])
 # def swap_face():
 #     """
@@ -495,8 +795,13 @@ def swap_face():
                 {"error": "Face swap plugin not configured or unavailable"}
             ), 500
 
-        # 调用插件执行换脸
-        result_url = swap_func(source_image_url=source_url, face_image_url=face_url)
+        # 调用插件执行换脸（占用插件并发名额）
+        result_url = call_plugin_in_slot(
+            get_face_swap_plugin_name(),
+            swap_func,
+            source_image_url=source_url,
+            face_image_url=face_url,
+        )
 
         # 保存结果到本地（统一管理）
         local_path = save_image_from_url(result_url, RESULTS_DIR)
@@ -543,9 +848,253 @@ def dummy_swap_face():
 
 
 # 确保目录存在
-STORYBOARD_DIR = os.path.join(os.path.dirname(__file__), "storyboards")
+STORYBOARD_DIR = os.getenv("STORYBOARD_DIR") or os.path.join(
+    os.path.dirname(__file__), "storyboards"
+)
 os.makedirs(STORYBOARD_DIR, exist_ok=True)
 
+# 故事板目录（按文件 mtime/size 增量刷新的摘要缓存）
+storyboard_catalog = StoryboardCatalog(STORYBOARD_DIR)
+
+# 存储回收：清理历史记录和故事板都不再引用的 inputs/results 图片（GC_INTERVAL > 0 时定期执行）
+storage_gc = StorageGC(history_index, STORYBOARD_DIR)
+storage_gc.start_periodic()
+
+
+@app.route("/storage-gc", methods=["GET", "POST"])
+def storage_gc_route():
+    """
+    POST 在后台启动一次回收：默认 dry-run 只生成报告，{"dry_run": false} 时实际删除；
+    GET 查看运行状态和上次的报告
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        started = storage_gc.start(dry_run=data.get("dry_run", True) is not False)
+        return jsonify({"started": started, **storage_gc.status()}), 202
+    return jsonify(storage_gc.status())
+
+
+# 整板生成：分镜并行执行的线程数（实际并发仍受各插件的 PLUGIN_CONCURRENCY 限制）
+BATCH_PANEL_WORKERS = int(os.getenv("BATCH_PANEL_WORKERS", "12"))
+batch_executor = ThreadPoolExecutor(
+    max_workers=BATCH_PANEL_WORKERS, thread_name_prefix="panel"
+)
+# 写故事板 JSON 时的锁（分镜结果回写是读-改-写）；文件锁在多 worker 部署时同样有效
+STORYBOARD_LOCK_PATH = os.path.join(STORYBOARD_DIR, ".write.lock")
+
+
+def _storyboard_path(storyboard_id):
+    """故事板 JSON 路径；id 不合法时返回 None"""
+    return safe_join(STORYBOARD_DIR, f"{storyboard_id}.json")
+
+
+class _PanelJob:
+    """把单个分镜的阶段事件转发到整板任务上（事件名加 panel_ 前缀并带上分镜序号）"""
+
+    def __init__(self, job, index, panel_id):
+        self.job = job
+        self.index = index
+        self.panel_id = panel_id
+
+    def emit(self, event, **data):
+        self.job.emit(
+            f"panel_{event}", panel=self.index, panel_id=self.panel_id, **data
+        )
+
+
+def _resolve_panel_references(refs, size=None, aspect_ratio=None):
+    """分镜参考图（本地路径或外部 URL）→ (外部 URL 列表, 对应的本地路径列表)"""
+    image_urls, local_paths = [], []
+    for ref in refs:
+        if ref.startswith(("http://", "https://")):
+            image_urls.append(ref)
+            local_paths.append(None)
+        else:
+            # 本地图片先上传（上传缓存命中时不产生网络请求）
+            image_urls.append(
+                upload_file(actual_path(ref), size=size, aspect_ratio=aspect_ratio)
+            )
+            local_paths.append(ref)
+    return image_urls, local_paths
+
+
+def _apply_panel_result(storyboard_id, spec, result):
+    """把分镜生成结果写回故事板 JSON，返回更新后的分镜（找不到时返回 None）"""
+    filepath = _storyboard_path(storyboard_id)
+    with file_lock(STORYBOARD_LOCK_PATH):
+        with open(filepath, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        panels = record.get("panels", [])
+        panel = None
+        if spec.get("panel_id"):
+            panel = next(
+                (p for p in panels if p.get("panel_id") == spec["panel_id"]), None
+            )
+        elif spec["index"] < len(panels):
+            panel = panels[spec["index"]]
+        if panel is None:
+            return None
+
+        # 第一次生成时记下原始参考图，之后重新生成仍以它们为参考
+        panel.setdefault("reference_images", list(panel.get("images", [])))
+        panel["images"] = result["result_urls"] + panel["reference_images"]
+        panel["generation"] = {
+            "record_id": result["record_id"],
+            "prompt": spec["prompt"],
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+        record["timestamp"] = datetime.now(timezone.utc).isoformat()
+
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, filepath)
+        storyboard_catalog.update(filepath, record)
+    return panel
+
+
+def _run_panel(job, spec, storyboard_id):
+    panel_job = _PanelJob(job, spec["index"], spec.get("panel_id"))
+    data = dict(spec)
+    if "references" in data:
+        panel_job.emit("stage", stage="uploading")
+        data["image_urls"], data["local_input_paths"] = _resolve_panel_references(
+            data.pop("references"), data.get("size"), data.get("aspect_ratio")
+        )
+    result = run_generate_job(panel_job, data)
+    panel = _apply_panel_result(storyboard_id, spec, result) if storyboard_id else None
+    return result, panel
+
+
+def run_storyboard_batch_job(job, data):
+    """整板生成：所有分镜并行执行，每完成一个发出 panel_done / panel_failed 事件"""
+    storyboard_id = data.get("storyboard_id")
+    futures = {
+        batch_executor.submit(_run_panel, job, spec, storyboard_id): spec
+        for spec in data["panels"]
+    }
+    results = []
+    for future in as_completed(futures):
+        spec = futures[future]
+        entry = {"panel": spec["index"], "panel_id": spec.get("panel_id")}
+        try:
+            result, panel = future.result()
+            entry.update(
+                success=True,
+                result_urls=result["result_urls"],
+                record_id=result["record_id"],
+                images=panel["images"] if panel else None,
+                reference_images=panel["reference_images"] if panel else None,
+            )
+            job.emit("panel_done", **entry)
+        except Exception as e:
+            print(f"[Storyboard Batch] 分镜 {spec['index']} 失败: {e}")
+            entry.update(success=False, error=str(e))
+            job.emit("panel_failed", **entry)
+        results.append(entry)
+
+    results.sort(key=lambda x: x["panel"])
+    if not any(x["success"] for x in results):
+        raise Exception("All panels failed to generate")
+    return {
+        "success": all(x["success"] for x in results),
+        "storyboard_id": storyboard_id,
+        "panels": results,
+    }
+
+
+job_manager.register("storyboard", run_storyboard_batch_job)
+
+
+@app.route("/generate-storyboard", methods=["POST"])
+def generate_storyboard():
+    """
+    整板生成，立即返回 job id；分镜事件通过 /jobs/<id>/events 获取。
+    请求体二选一：
+    - {"storyboard_id", "panel_ids"?}：按已保存故事板的分镜生成（提示词取 prompt 或 description，
+      参考图取 images），结果写回该故事板
+    - {"panels": [{"prompt", "image_urls", "local_input_paths", "panel_id"?, ...}], "storyboard_id"?}
+    可选 size / aspect_ratio / force_refresh 作为各分镜的默认值
+    """
+    data = request.get_json() or {}
+    storyboard_id = data.get("storyboard_id")
+    defaults = {
+        "size": data.get("size", "2K"),
+        "aspect_ratio": data.get("aspect_ratio", "auto"),
+        "force_refresh": bool(data.get("force_refresh")),
+    }
+
+    record = None
+    if storyboard_id:
+        filepath = _storyboard_path(storyboard_id)
+        if not filepath or not os.path.exists(filepath):
+            return jsonify({"error": "Storyboard not found"}), 404
+        with open(filepath, "r", encoding="utf-8") as f:
+            record = json.load(f)
+
+    specs = []
+    if data.get("panels"):
+        panels = data["panels"]
+        if not isinstance(panels, list) or not all(
+            isinstance(panel, dict) and isinstance(panel.get("prompt") or "", str)
+            for panel in panels
+        ):
+            return jsonify({"error": "panels must be a list of objects"}), 400
+        for i, panel in enumerate(panels):
+            # index 由服务端按位置决定，请求中自带的 index 会被覆盖
+            spec = {**defaults, **panel}
+            spec["index"] = i
+            spec["prompt"] = (spec.get("prompt") or "").strip()
+            specs.append(spec)
+    elif record is not None:
+        panels = record.get("panels", [])
+        if not isinstance(panels, list) or not all(
+            isinstance(panel, dict)
+            and isinstance(panel.get("prompt") or panel.get("description") or "", str)
+            for panel in panels
+        ):
+            return jsonify({"error": "Storyboard has malformed panels"}), 400
+        panel_ids = set(data.get("panel_ids") or [])
+        for i, panel in enumerate(panels):
+            if panel_ids and panel.get("panel_id") not in panel_ids:
+                continue
+            specs.append(
+                dict(
+                    defaults,
+                    index=i,
+                    panel_id=panel.get("panel_id"),
+                    prompt=(
+                        panel.get("prompt") or panel.get("description") or ""
+                    ).strip(),
+                    references=panel.get("reference_images", panel.get("images", [])),
+                )
+            )
+    else:
+        return jsonify({"error": "panels or storyboard_id is required"}), 400
+
+    skipped = [spec["index"] for spec in specs if not spec["prompt"]]
+    specs = [spec for spec in specs if spec["prompt"]]
+    if not specs:
+        return jsonify({"error": "No panel has a prompt"}), 400
+
+    job = job_manager.submit(
+        "storyboard",
+        run_storyboard_batch_job,
+        {"storyboard_id": storyboard_id, "panels": specs},
+    )
+    return (
+        jsonify(
+            {
+                "success": True,
+                "job_id": job.id,
+                "status": job.status,
+                "panels": len(specs),
+                "skipped": skipped,
+            }
+        ),
+        202,
+    )
+
 
 @app.route("/save-storyboard", methods=["POST"])
 def save_storyboard():
@@ -584,32 +1133,87 @@ def save_storyboard():
 
     # 保存为单个 JSON 文件
     filepath = os.path.join(STORYBOARD_DIR, f"{record_id}.json")
-    with open(filepath, "w", encoding="utf-8") as f:
+    with file_lock(STORYBOARD_LOCK_PATH), open(filepath, "w", encoding="utf-8") as f:
         json.dump(record, f, ensure_ascii=False, indent=2)
+    storyboard_catalog.update(filepath, record)
 
     return jsonify({"success": True, "record_id": record_id})
 
 
 @app.route("/list-storyboards", methods=["GET"])
 def list_storyboards():
-    files = []
-    for f in os.listdir(STORYBOARD_DIR):
-        if f.endswith(".json"):
-            with open(os.path.join(STORYBOARD_DIR, f), "r", encoding="utf-8") as fp:
-                try:
-                    data = json.load(fp)
-                    files.append(
-                        {
-                            "id": data.get("id"),
-                            "title": data.get("title", "未命名故事板"),
-                            "timestamp": data.get("timestamp"),
-                        }
-                    )
-                except:
-                    continue
-    # 按时间倒序
-    files.sort(key=lambda x: x["timestamp"], reverse=True)
-    return jsonify(files)
+    """
+    故事板列表（按时间倒序），可选参数：
+    - q：按标题过滤（不区分大小写）
+    - page / limit：分页；不传 limit 时返回全部，limit 必须 >= 1
+    总数通过 X-Total-Count 响应头返回
+    """
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be >= 1"}), 400
+    page = max(request.args.get("page", 1, type=int), 1)
+    offset = (page - 1) * limit if limit else 0
+
+    files, total = storyboard_catalog.list(query, offset, limit)
+    resp = jsonify(files)
+    resp.headers["X-Total-Count"] = str(total)
+    return resp
+
+
+def _local_history_file(ref):
+    """把 /history/... 形式的图片引用解析为本地文件路径；外部 URL 或不存在时返回 None"""
+    if not isinstance(ref, str) or not ref.startswith("/history/"):
+        return None
+    actual = resolve(ref[len("/history/") :])
+    path = actual and safe_join(str(HISTORY_DIR.resolve()), actual)
+    return path if path and os.path.isfile(path) else None
+
+
+@app.route("/export-storyboard/<id>", methods=["GET"])
+def export_storyboard(id):
+    """
+    导出故事板（流式输出），参数：
+    - format：zip（默认，全部图片原图）/ pdf（每个分镜一页）/ sheet（联系表 JPEG）
+    - columns / cell / page：联系表的列数、格子宽度（像素）和页码（从 1 开始，
+      总页数见响应头 X-Sheet-Pages）
+    只导出本地保存的图片（/history/...），外部 URL 会被跳过
+    """
+    fmt = request.args.get("format", "zip").lower()
+    if fmt not in EXPORTERS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+    filepath = _storyboard_path(id)
+    if not filepath or not os.path.exists(filepath):
+        return jsonify({"error": "Not found"}), 404
+    with open(filepath, "r", encoding="utf-8") as f:
+        record = json.load(f)
+
+    panel_files = [
+        [p for p in map(_local_history_file, panel.get("images", [])) if p]
+        for panel in record.get("panels", [])
+    ]
+    exporter, mimetype, extension = EXPORTERS[fmt]
+    kwargs, pages, filename = {}, None, f"{id}.{extension}"
+    if fmt == "sheet":
+        kwargs = {
+            "columns": min(max(request.args.get("columns", 4, type=int), 1), 16),
+            "cell_width": min(max(request.args.get("cell", 384, type=int), 64), 1024),
+            "page": request.args.get("page", 1, type=int),
+        }
+        pages = sheet_pages(panel_files, kwargs["columns"], kwargs["cell_width"])
+        if not 1 <= kwargs["page"] <= pages:
+            return jsonify({"error": f"page must be between 1 and {pages}"}), 400
+        if pages > 1:
+            filename = f"{id}-{kwargs['page']}.{extension}"
+
+    resp = Response(
+        stream_with_context(exporter(record, panel_files, **kwargs)),
+        mimetype=mimetype,
+    )
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if pages is not None:
+        resp.headers["X-Sheet-Pages"] = str(pages)
+    return resp
 
 
 @app.route("/load-storyboard/<id>", methods=["GET"])
@@ -623,4 +1227,5 @@ def load_storyboard(id):
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    # 开发服务器（单进程）；多 worker 部署使用 gunicorn -c gunicorn.conf.py app:app
+    app.run(host="0.0.0.0", port=5001, debug=os.getenv("FLASK_DEBUG", "1") == "1")
@@ -0,0 +1,549 @@
+"""
+离线基准测试：用本地替身驱动完整的生成流程，输出可比较的 JSON 结果。
+
+替身：
+- 桩插件：注册为 nano_banana / rh_official，可配置耗时与失败率，
+  返回指向本地假服务的结果图 URL
+- 假 ImgBB 服务：接收上传（IMGBB_UPLOAD_URL）并提供结果图下载
+- 本地 bare git 仓库：--backend github 时作为 github_jsdelivr 的远端
+
+场景：upload（/upload-images）、generate（/generate + 轮询 /jobs/<id>）、
+history（/history 随机翻页）、storyboards（/list-storyboards 随机翻页）。
+另外在独立进程中测量启动耗时（懒加载插件 vs. 启动时导入全部插件），见结果中的 startup。
+
+用法：
+    python benchmark.py --records 50000 --concurrency 8 --requests 200
+    python benchmark.py --scenarios generate --plugin-latency 0.5 --output bench.json
+
+应用在临时工作目录中运行（history/、storyboards/ 都在其中），不会改动项目数据；
+指定 --workdir 时会复用已生成的数据集。
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+
+import requests
+from PIL import Image
+
+PROJECT_DIR = Path(__file__).resolve().parent
+SCENARIOS = ("upload", "history", "storyboards", "generate")
+
+
+def _image_bytes(size, seed=0, fmt="JPEG", noise=False) -> bytes:
+    img = Image.new("RGB", (size, size), (seed % 256, (seed // 256) % 256, 128))
+    if noise:
+        # 叠加噪声，压缩后的体积接近真实照片
+        grain = Image.effect_noise((size, size), 48).convert("RGB")
+        img = Image.blend(img, grain, 0.35)
+    buf = BytesIO()
+    img.save(buf, fmt, quality=90)
+    return buf.getvalue()
+
+
+# ===== 假 ImgBB / 结果图服务 =====
+
+
+class FakeImageServer:
+    """POST /1/upload 模拟 ImgBB；GET /img/<name> 返回固定的结果图"""
+
+    def __init__(self, result_image: bytes, latency: float = 0.0, bandwidth=0.0):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                with server.lock:
+                    server.bytes_received += length
+                # 模拟固定延迟 + 上行带宽（字节/秒）
+                delay = server.latency + (
+                    length / server.bandwidth if server.bandwidth else 0
+                )
+                if delay:
+                    time.sleep(delay)
+                body = json.dumps(
+                    {"data": {"url": f"{server.base_url}/img/{uuid.uuid4().hex}.jpg"}}
+                ).encode()
+                self._send(200, "application/json", body)
+
+            def do_GET(self):
+                self._send(200, "image/jpeg", server.result_image)
+
+            def _send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.result_image = result_image
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+
+# ===== 桩插件 =====
+
+
+def make_stub_plugin(result_base_url, latency, failure_rate, outputs):
+    def generate_images(image_urls, prompt, size="2K", ar="auto"):
+        # 耗时在 [0.5, 1.5] × latency 之间均匀分布
+        time.sleep(latency * random.uniform(0.5, 1.5))
+        if random.random() < failure_rate:
+            return []
+        return [f"{result_base_url}/img/{uuid.uuid4().hex}.jpg" for _ in range(outputs)]
+
+    return generate_images
+
+
+# ===== 数据集 =====
+
+
+def _git(cwd, *args):
+    subprocess.run(
+        ["git", *args],
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def setup_git_remote(workdir: Path) -> Path:
+    """创建本地 bare 远端和已 clone 的工作仓库，返回工作仓库路径"""
+    remote = workdir / "remote.git"
+    repo = workdir / "repo"
+    if repo.exists():
+        return repo
+    _git(workdir, "init", "-q", "--bare", "-b", "main", str(remote))
+    _git(workdir, "clone", "-q", str(remote), str(repo))
+    _git(repo, "checkout", "-q", "-b", "main")
+    (repo / "README.md").write_text("benchmark\n")
+    _git(repo, "add", "README.md")
+    _git(repo, "commit", "-q", "-m", "init")
+    _git(repo, "push", "-q", "origin", "main")
+    return repo
+
+
+def seed_history(history_dir: Path, count: int):
+    """生成 count 条历史记录 JSON（已存在的 bench-*.json 计入数量）"""
+    history_dir.mkdir(parents=True, exist_ok=True)
+    existing = sum(1 for _ in history_dir.glob("bench-*.json"))
+    start = datetime(2024, 1, 1)
+    for i in range(existing, count):
+        record = {
+            "id": f"bench-{i}",
+            "timestamp": (start + timedelta(seconds=i)).isoformat(),
+            "image_urls": [],
+            "local_input_paths": [f"/history/inputs/bench-{i}-in.jpg"],
+            "result_urls": [],
+            "local_result_paths": [f"/history/results/bench-{i}.jpg"],
+            "prompt": f"benchmark prompt {i}",
+            "size": "2K",
+            "aspect_ratio": "16:9",
+        }
+        with open(history_dir / f"bench-{i}.json", "w", encoding="utf-8") as f:
+            json.dump(record, f)
+
+
+def seed_storyboards(storyboard_dir: Path, count: int, panels: int = 12):
+    storyboard_dir.mkdir(parents=True, exist_ok=True)
+    existing = sum(1 for _ in storyboard_dir.glob("bench-*.json"))
+    start = datetime(2024, 1, 1)
+    for i in range(existing, count):
+        data = {
+            "id": f"bench-{i}",
+            "title": f"Benchmark storyboard {i}",
+            "timestamp": (start + timedelta(minutes=i)).isoformat(),
+            "panels": [
+                {"prompt": f"panel {j}", "image": f"/history/results/bench-{j}.jpg"}
+                for j in range(panels)
+            ],
+        }
+        with open(storyboard_dir / f"bench-{i}.json", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+# ===== 压测 =====
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run_scenario(name, func, total, concurrency):
+    """并发执行 func(i) 共 total 次，统计耗时分位数和吞吐"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            func(i)
+            ok = True
+        except Exception as e:
+            ok = False
+            with lock:
+                errors.append(str(e))
+        elapsed = time.perf_counter() - start
+        if ok:
+            with lock:
+                latencies.append(elapsed)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - wall_start
+    # 服务端与压测客户端在同一进程内，CPU 时间包含两者，适合前后对比
+    cpu = time.process_time() - cpu_start
+
+    latencies.sort()
+    result = {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "wall_seconds": round(wall, 3),
+        "rps": round(total / wall, 2) if wall else None,
+        "cpu_ms_per_request": round(cpu / total * 1000, 2) if total else None,
+        "mean_ms": (
+            round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None
+        ),
+    }
+    for label, p in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+        value = _percentile(latencies, p)
+        result[label] = None if value is None else round(value * 1000, 2)
+    if errors:
+        result["sample_errors"] = sorted(set(errors))[:5]
+    print(
+        f"[Bench] {name}: rps={result['rps']} p50={result['p50_ms']}ms "
+        f"p99={result['p99_ms']}ms cpu={result['cpu_ms_per_request']}ms/req "
+        f"errors={len(errors)}",
+        file=sys.stderr,
+    )
+    return result
+
+
+def build_scenarios(base_url, args, upload_payloads):
+    session_local = threading.local()
+
+    def session():
+        s = getattr(session_local, "session", None)
+        if s is None:
+            s = session_local.session = requests.Session()
+        return s
+
+    def check(resp, status=200):
+        if resp.status_code != status:
+            raise Exception(f"HTTP {resp.status_code}: {resp.text[:200]}")
+        return resp.json()
+
+    def upload(i):
+        files = [
+            ("images", (f"bench-{i}-{j}.jpg", payload, "image/jpeg"))
+            for j, payload in enumerate(upload_payloads[i])
+        ]
+        form = {"size": args.upload_size, "aspect_ratio": args.upload_aspect_ratio}
+        check(session().post(f"{base_url}/upload-images", files=files, data=form))
+
+    def history(i):
+        pages = max(1, args.records // 12)
+        check(session().get(f"{base_url}/history?page={random.randint(1, pages)}"))
+
+    def storyboards(i):
+        pages = max(1, args.storyboards // 20)
+        check(
+            session().get(
+                f"{base_url}/list-storyboards?page={random.randint(1, pages)}&limit=20"
+            )
+        )
+
+    def generate(i):
+        job = check(
+            session().post(
+                f"{base_url}/generate",
+                json={
+                    "prompt": f"benchmark {i}",
+                    "image_urls": [],
+                    "size": "2K",
+                    "aspect_ratio": "16:9",
+                },
+            ),
+            202,
+        )
+        deadline = time.time() + args.job_timeout
+        while time.time() < deadline:
+            state = check(session().get(f"{base_url}/jobs/{job['job_id']}"))
+            if state["status"] == "succeeded":
+                return
+            if state["status"] == "failed":
+                raise Exception(f"job failed: {state.get('error')}")
+            time.sleep(args.poll_interval)
+        raise Exception("job timeout")
+
+    return {
+        "upload": upload,
+        "history": history,
+        "storyboards": storyboards,
+        "generate": generate,
+    }
+
+
+# 在新进程中测量启动耗时：导入 app（插件只读取 manifest），以及导入全部插件模块的额外耗时
+_STARTUP_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import app
+import_app = time.perf_counter() - start
+import plugins
+start = time.perf_counter()
+for name in plugins.list_plugin_names():
+    plugins.get_plugin(name)
+    plugins.get_plugin(name, "swap_face")
+resolve_all = time.perf_counter() - start
+print(json.dumps({"import_app": import_app, "resolve_all": resolve_all,
+                  "plugins": plugins.list_plugin_names()}))
+"""
+
+
+def measure_startup(workdir: Path, runs: int) -> dict:
+    """
+    启动耗时（中位数，毫秒）。import_app_ms 为懒加载下的启动耗时；
+    eager_import_ms 额外加上导入全部插件模块的耗时，相当于启动时就加载所有插件
+    """
+    env = dict(os.environ, PYTHONPATH=str(PROJECT_DIR))
+    samples = []
+    for i in range(runs + 1):
+        proc = subprocess.run(
+            [sys.executable, "-c", _STARTUP_SNIPPET],
+            check=False,  # 失败时下面抛出带 stderr 的异常
+            cwd=workdir,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"startup measurement failed: {proc.stderr[-500:]}")
+        if i > 0:  # 第一次运行会建立历史索引，不计入
+            samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    def median_ms(values):
+        values = sorted(values)
+        return round(values[len(values) // 2] * 1000, 1)
+
+    result = {
+        "runs": runs,
+        "plugins": samples[-1]["plugins"],
+        "import_app_ms": median_ms(s["import_app"] for s in samples),
+        "resolve_all_plugins_ms": median_ms(s["resolve_all"] for s in samples),
+        "eager_import_ms": median_ms(
+            s["import_app"] + s["resolve_all"] for s in samples
+        ),
+    }
+    print(
+        f"[Bench] startup: lazy={result['import_app_ms']}ms "
+        f"eager={result['eager_import_ms']}ms plugins={result['plugins']}",
+        file=sys.stderr,
+    )
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=100, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--records", type=int, default=1000, help="历史记录数量")
+    parser.add_argument("--storyboards", type=int, default=200, help="故事板数量")
+    parser.add_argument("--images-per-upload", type=int, default=3)
+    parser.add_argument("--image-size", type=int, default=1024, help="上传/结果图边长")
+    parser.add_argument(
+        "--upload-format", choices=("jpeg", "png", "webp"), default="jpeg"
+    )
+    parser.add_argument("--backend", choices=("imgbb", "github"), default="imgbb")
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--upload-bandwidth",
+        type=float,
+        default=0,
+        help="假图床上行带宽（字节/秒），0 表示不限",
+    )
+    parser.add_argument("--upload-size", default="", help="上传时携带的 size，如 2K")
+    parser.add_argument(
+        "--upload-aspect-ratio", default="", help="上传时携带的 aspect_ratio"
+    )
+    parser.add_argument("--plugin-latency", type=float, default=0.5)
+    parser.add_argument("--plugin-failure-rate", type=float, default=0.0)
+    parser.add_argument("--plugin-outputs", type=int, default=1)
+    parser.add_argument("--job-timeout", type=float, default=120)
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument(
+        "--startup-runs", type=int, default=3, help="启动耗时测量次数，0 表示跳过"
+    )
+    parser.add_argument("--workdir", help="工作目录（默认临时目录，结束后删除）")
+    parser.add_argument("--output", help="结果 JSON 写入文件（默认输出到 stdout）")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {sorted(unknown)}")
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    keep_workdir = bool(args.workdir)
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="storyboard-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    workdir = workdir.resolve()
+
+    fake = FakeImageServer(
+        _image_bytes(args.image_size), args.upload_latency, args.upload_bandwidth
+    )
+
+    # 配置必须在导入 app 之前写入环境变量
+    os.environ.update(
+        {
+            "UPLOAD_BACKEND": "imgbb",
+            "IMGBB_API_KEY": "bench",
+            "IMGBB_UPLOAD_URL": f"{fake.base_url}/1/upload",
+            "STORYBOARD_DIR": str(workdir / "storyboards"),
+            "UPLOAD_CACHE_ENABLED": "0",
+        }
+    )
+    if args.backend == "github":
+        # 仓库提交需要的身份信息（本地 bare 远端不校验）
+        for key in ("GIT_AUTHOR", "GIT_COMMITTER"):
+            os.environ.setdefault(f"{key}_NAME", "bench")
+            os.environ.setdefault(f"{key}_EMAIL", "bench@localhost")
+        os.environ.update(
+            {
+                "UPLOAD_BACKEND": "github_jsdelivr",
+                "GITHUB_USERNAME": "bench",
+                "GITHUB_REPO": "bench",
+                "GITHUB_BRANCH": "main",
+                "LOCAL_REPO_PATH": str(setup_git_remote(workdir)),
+            }
+        )
+
+    print(f"[Bench] 准备数据集: {workdir}", file=sys.stderr)
+    seed_history(workdir / "history", args.records)
+    seed_storyboards(workdir / "storyboards", args.storyboards)
+
+    startup = measure_startup(workdir, args.startup_runs) if args.startup_runs else None
+
+    os.chdir(workdir)
+    sys.path.insert(0, str(PROJECT_DIR))
+    setup_start = time.perf_counter()
+    from werkzeug.serving import make_server
+
+    import app as app_module
+    from plugins import register_plugin
+
+    startup_seconds = time.perf_counter() - setup_start
+
+    stub = make_stub_plugin(
+        fake.base_url,
+        args.plugin_latency,
+        args.plugin_failure_rate,
+        args.plugin_outputs,
+    )
+    register_plugin("nano_banana", stub)
+    register_plugin("rh_official", stub)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    # 上传内容各不相同，避免命中上传缓存或 CDN 去重
+    upload_payloads = [
+        [
+            _image_bytes(
+                args.image_size,
+                seed=i * args.images_per_upload + j,
+                fmt=args.upload_format.upper(),
+                noise=True,
+            )
+            for j in range(args.images_per_upload)
+        ]
+        for i in range(args.requests if "upload" in scenarios else 0)
+    ]
+    funcs = build_scenarios(base_url, args, upload_payloads)
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            k: v for k, v in vars(args).items() if k not in ("output", "workdir")
+        },
+        "startup_seconds": round(startup_seconds, 3),
+        "startup": startup,
+        "scenarios": {},
+    }
+    try:
+        for name in scenarios:
+            received = fake.bytes_received
+            results["scenarios"][name] = run_scenario(
+                name, funcs[name], args.requests, args.concurrency
+            )
+            if name == "upload":
+                results["scenarios"][name]["external_bytes_per_request"] = round(
+                    (fake.bytes_received - received) / args.requests
+                )
+    finally:
+        server.shutdown()
+        fake.httpd.shutdown()
+        if not keep_workdir:
+            os.chdir(PROJECT_DIR)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""
+多进程部署的跨进程协调（COORDINATION=sqlite，见 gunicorn.conf.py）。
+
+默认（COORDINATION=local）只运行一个进程，任务和并发名额都在进程内管理。
+启用 sqlite 模式后，同一台机器上的所有 worker 通过一个 SQLite 文件协调：
+
+- 名额（lease）：全局任务名额 JOB_GLOBAL_CONCURRENCY 和各插件的并发上限在所有
+  worker 间共享，多开 worker 不会让服务商收到超出限流的调用
+- 任务存储：任务状态和事件写入数据库，/jobs/<id> 和 SSE 可以由任意 worker 响应
+- 任务归属：任务记录执行它的 worker，worker 每 HEARTBEAT_INTERVAL 秒心跳一次
+- 崩溃恢复：心跳超过 WORKER_TIMEOUT 秒的 worker 视为已退出，它持有的名额被释放，
+  未完成的任务按 JOB_RECOVERY 处理：fail（默认，标记失败）或 requeue（由存活的
+  worker 重新执行，最多 JOB_MAX_ATTEMPTS 次；注意会再次调用付费插件）
+
+另提供 file_lock()：跨进程文件锁，用于故事板 JSON 的读-改-写、git 提交等。
+
+配置（.env）：
+    COORDINATION            local / sqlite，默认 local
+    COORDINATION_DB         数据库路径，默认 history/coordination.sqlite3
+    JOB_GLOBAL_CONCURRENCY  所有 worker 合计同时运行的任务数，0 表示不限制
+    HEARTBEAT_INTERVAL      心跳间隔（秒），默认 5
+    WORKER_TIMEOUT          多久没有心跳视为 worker 已退出（秒），默认 30
+    JOB_RECOVERY            fail / requeue，默认 fail
+    JOB_MAX_ATTEMPTS        requeue 时任务最多执行几次，默认 2
+"""
+
+import asyncio
+import atexit
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows：文件锁退化为进程内互斥（多 worker 部署需要 Linux/macOS）
+    fcntl = None
+
+load_dotenv()
+
+COORDINATION = os.getenv("COORDINATION", "local").lower()
+COORDINATION_DB = os.getenv("COORDINATION_DB") or os.path.join(
+    "history", "coordination.sqlite3"
+)
+JOB_GLOBAL_CONCURRENCY = int(os.getenv("JOB_GLOBAL_CONCURRENCY", "0"))
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "5"))
+WORKER_TIMEOUT = float(os.getenv("WORKER_TIMEOUT", "30"))
+JOB_RECOVERY = os.getenv("JOB_RECOVERY", "fail").lower()
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+
+# 名额用尽时的轮询间隔（秒）：从 LEASE_POLL_MIN 开始逐步放慢到 LEASE_POLL_MAX
+LEASE_POLL_MIN = 0.05
+LEASE_POLL_MAX = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    id         TEXT PRIMARY KEY,  -- host:pid:随机后缀
+    pid        INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    token       TEXT PRIMARY KEY,
+    name        TEXT NOT NULL,  -- jobs / plugin:<name>
+    worker      TEXT NOT NULL,
+    acquired_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leases_name ON leases (name);
+CREATE INDEX IF NOT EXISTS idx_leases_worker ON leases (worker);
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    params      TEXT NOT NULL,  -- JSON
+    status      TEXT NOT NULL,
+    result      TEXT,           -- JSON
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL,
+    worker      TEXT,           -- 负责执行的 worker，NULL 表示等待认领
+    attempts    INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, worker);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq    INTEGER NOT NULL,
+    event  TEXT NOT NULL,  -- JSON
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+UNFINISHED = ("queued", "running")
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """
+    跨进程互斥（flock）；同一进程内的不同线程之间同样互斥。
+    blocking=False 时不等待，with 得到的值表示是否拿到了锁。
+    """
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(os.path.abspath(path), threading.Lock())
+        acquired = lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def is_helper_process() -> bool:
+    """
+    multiprocessing 启动的辅助进程（如导出进程池）。spawn 方式会在子进程中重新导入
+    主模块（python app.py 时即 app.py），这类进程不登记为 worker、不认领任务
+    """
+    # 重新导入主模块发生在子进程准备阶段，此时 parent_process() 还未设置
+    return multiprocessing.parent_process() is not None or getattr(
+        multiprocessing.current_process(), "_inheriting", False
+    )
+
+
+class Coordinator:
+    """SQLite 上的共享名额、任务存储与 worker 心跳（线程安全，每个线程一个连接）"""
+
+    def __init__(self, db_path=COORDINATION_DB):
+        self.db_path = db_path
+        self.worker_id = None
+        self._pid = None
+        self._local = threading.local()
+        self._tick_callbacks = []
+        self._start_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    # ===== 连接与事务 =====
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # fork 出来的进程不能沿用父进程的连接
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE：写事务开始时就拿到写锁，读-判断-写之间不会被其他进程插入"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ===== worker 注册与心跳 =====
+
+    def start(self, on_tick=None):
+        """登记当前进程并启动心跳线程（每个进程一次；fork 后重新登记）"""
+        if is_helper_process():
+            return
+        with self._start_lock:
+            if on_tick is not None and on_tick not in self._tick_callbacks:
+                self._tick_callbacks.append(on_tick)
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.worker_id = (
+                f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:6]}"
+            )
+            self._register()
+            threading.Thread(
+                target=self._heartbeat_loop, name="coordination", daemon=True
+            ).start()
+            atexit.register(self._unregister, self.worker_id)
+            print(f"[Coordination] worker {self.worker_id} 已登记（{self.db_path}）")
+
+    def _register(self):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (id, pid, started_at, heartbeat)"
+                " VALUES (?, ?, ?, ?)",
+                (self.worker_id, self._pid, now, now),
+            )
+
+    def _unregister(self, worker_id):
+        """正常退出：释放名额并注销；未完成的任务由其他 worker 按崩溃恢复处理"""
+        if worker_id != self.worker_id:
+            return
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM leases WHERE worker = ?", (worker_id,))
+                conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+        except sqlite3.Error as e:
+            print(f"[Coordination] 注销失败: {e}")
+
+    def _heartbeat_loop(self):
+        while True:
+            try:
+                self.heartbeat()
+                self.recover()
+                for callback in list(self._tick_callbacks):
+                    callback()
+            except Exception as e:
+                print(f"[Coordination] 心跳失败: {e}")
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def heartbeat(self):
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE workers SET heartbeat = ? WHERE id = ?",
+                (time.time(), self.worker_id),
+            ).rowcount
+        if not updated:
+            # 心跳中断太久，已被其他 worker 判定退出（名额已释放），重新登记
+            print(f"[Coordination] worker {self.worker_id} 曾被判定退出，重新登记")
+            self._register()
+
+    def recover(self):
+        """释放已退出 worker 的名额，并按 JOB_RECOVERY 处理它们遗留的任务"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM workers WHERE heartbeat < ?", (now - WORKER_TIMEOUT,)
+            )
+            conn.execute(
+                "DELETE FROM leases WHERE worker NOT IN (SELECT id FROM workers)"
+            )
+            orphans = conn.execute(
+                "SELECT id, worker, attempts FROM jobs"
+                " WHERE status IN (?, ?) AND worker IS NOT NULL"
+                " AND worker NOT IN (SELECT id FROM workers)",
+                UNFINISHED,
+            ).fetchall()
+            for job_id, worker, attempts in orphans:
+                if JOB_RECOVERY == "requeue" and attempts < JOB_MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', worker = NULL,"
+                        " started_at = NULL WHERE id = ?",
+                        (job_id,),
+                    )
+                    self._append_event(
+                        conn, job_id, {"event": "requeued", "abandoned_by": worker}
+                    )
+                    print(
+                        f"[Coordination] 任务 {job_id} 的 worker {worker} 已退出，重新排队"
+                    )
+                    continue
+                error = f"Worker {worker} exited before the job finished"
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?"
+                    " WHERE id = ?",
+                    (error, now, job_id),
+                )
+                self._append_event(
+                    conn,
+                    job_id,
+                    {"event": "failed", "result": None, "error": error},
+                )
+                print(
+                    f"[Coordination] 任务 {job_id} 的 worker {worker} 已退出，标记失败"
+                )
+
+    # ===== 共享名额 =====
+
+    def try_acquire(self, name, limit):
+        """名额未满时占用一个，返回 token；已满返回 None"""
+        with self._transaction() as conn:
+            (held,) = conn.execute(
+                "SELECT COUNT(*) FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+            if held >= limit:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO leases (token, name, worker, acquired_at)"
+                " VALUES (?, ?, ?, ?)",
+                (token, name, self.worker_id, time.time()),
+            )
+            return token
+
+    def release(self, token):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE token = ?", (token,))
+
+    @contextmanager
+    def lease(self, name, limit):
+        """占用名额（阻塞轮询直到拿到），退出时释放"""
+        self.start()
+        delay = LEASE_POLL_MIN
+        while (token := self.try_acquire(name, limit)) is None:
+            time.sleep(delay)
+            delay = min(delay * 1.5, LEASE_POLL_MAX)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    async def acquire_async(self, name, limit):
+        """等待并占用一个名额，返回 token（由调用方 release）；等待时不占用线程"""
+        self.start()
+        delay = LEASE_POLL_MIN
+        while (token := await asyncio.to_thread(self.try_acquire, name, limit)) is None:
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, LEASE_POLL_MAX)
+        return token
+
+    # ===== 任务存储 =====
+
+    def save_job(self, job: dict, params=None, attempt=1):
+        """
+        写入任务状态（job 为 Job.to_dict() 的结果，归属为当前 worker，attempt 为
+        第几次执行）。任务已被 recover() 标记失败或重新排队后，原来的执行不再覆盖：
+        只有归属的 worker 和执行次数都一致、且任务尚未结束时才更新。
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, result, error,"
+                " created_at, started_at, finished_at, worker, attempts)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET status = excluded.status,"
+                " result = excluded.result, error = excluded.error,"
+                " started_at = excluded.started_at, finished_at = excluded.finished_at"
+                " WHERE jobs.worker = excluded.worker"
+                " AND jobs.attempts = excluded.attempts"
+                " AND jobs.status IN (?, ?)",
+                (
+                    job["id"],
+                    job["kind"],
+                    json.dumps(params or {}, ensure_ascii=False),
+                    job["status"],
+                    json.dumps(job["result"], ensure_ascii=False),
+                    job["error"],
+                    job["created_at"],
+                    job["started_at"],
+                    job["finished_at"],
+                    self.worker_id,
+                    attempt,
+                    *UNFINISHED,
+                ),
+            )
+
+    @staticmethod
+    def _append_event(conn, job_id, event, seq=None):
+        if seq is None:
+            (seq,) = conn.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM job_events WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        event.setdefault("time", time.time())
+        conn.execute(
+            "INSERT OR IGNORE INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+            (job_id, seq, json.dumps(event, ensure_ascii=False)),
+        )
+
+    def append_event(self, job_id, seq, event):
+        with self._transaction() as conn:
+            self._append_event(conn, job_id, dict(event), seq)
+
+    def load_job(self, job_id):
+        row = (
+            self._conn()
+            .execute(
+                "SELECT id, kind, params, status, result, error, created_at,"
+                " started_at, finished_at, worker, attempts FROM jobs WHERE id = ?",
+                (job_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        keys = (
+            "id kind params status result error created_at"
+            " started_at finished_at worker attempts"
+        ).split()
+        job = dict(zip(keys, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def load_events(self, job_id, since=0):
+        rows = (
+            self._conn()
+            .execute(
+                "SELECT seq, event FROM job_events WHERE job_id = ? AND seq >= ?"
+                " ORDER BY seq",
+                (job_id, since),
+            )
+            .fetchall()
+        )
+        # 只返回连续的一段，避免跳过尚未提交的事件
+        events = []
+        for seq, event in rows:
+            if seq != since + len(events):
+                break
+            events.append(json.loads(event))
+        return events
+
+    def claim_jobs(self, kinds, limit):
+        """认领等待中的无主任务（重新排队的遗弃任务），返回认领到的任务 id"""
+        if not kinds or limit <= 0:
+            return []
+        marks = ",".join("?" * len(kinds))
+        claimed = []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE status = 'queued' AND worker IS NULL"
+                f" AND kind IN ({marks}) ORDER BY created_at LIMIT ?",
+                (*kinds, limit),
+            ).fetchall()
+            for (job_id,) in rows:
+                conn.execute(
+                    "UPDATE jobs SET worker = ?, attempts = attempts + 1 WHERE id = ?",
+                    (self.worker_id, job_id),
+                )
+                claimed.append(job_id)
+        return claimed
+
+    def count_jobs(self, status) -> int:
+        (count,) = (
+            self._conn()
+            .execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))
+            .fetchone()
+        )
+        return count
+
+    def prune_jobs(self, finished_before):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM job_events WHERE job_id IN"
+                " (SELECT id FROM jobs WHERE finished_at < ?)",
+                (finished_before,),
+            )
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (finished_before,))
+
+
+coordinator = Coordinator() if COORDINATION == "sqlite" else None
@@ -0,0 +1,34 @@
+"""
+多 worker 部署（gunicorn，仅 Linux/macOS）：
+
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py app:app
+
+本配置会设置 COORDINATION=sqlite：各 worker 通过同一个 SQLite 数据库共享任务状态、
+全局任务名额和各插件的并发名额，worker 崩溃后由其他 worker 回收（见 coordination.py）。
+
+注意：
+- 生成结果缓存（RESULT_CACHE_*）和 /metrics 的指标仍是每个 worker 各自一份
+- 不要开启 preload_app：共享事件循环、线程池和 SQLite 连接都不能跨 fork 使用
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# history/、storyboards/ 等都是相对项目目录的路径
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("GUNICORN_WORKERS", str(os.cpu_count() or 1)))
+# SSE（/jobs/<id>/events）和导出下载会长时间占用一个线程，所以用 gthread 并多开线程
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+# gthread 下 timeout 只用于判定 worker 失去响应，不限制单个请求的时长
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+preload_app = False
+
+raw_env = ["COORDINATION=sqlite"]
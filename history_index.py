@@ -0,0 +1,235 @@
+"""
+历史记录索引（SQLite）。
+
+历史记录本身仍然是 HISTORY_DIR 下的一个个 JSON 文件（新记录按分片存放在
+records/ 下，见 history_layout），本模块只维护一份
+持久化的索引，避免 /history 每次请求都 glob + stat + 逐个解析 JSON：
+
+- /generate、/history-record 写入 JSON 后调用 add()
+- DELETE /history/<record_id> 通过 find_group() 直接找到同一 id 的全部 JSON
+  （/history-record 会写出 id_1、id_2…），删除后调用 remove()
+- /history 通过 page() 直接按修改时间倒序取一页摘要
+- record_paths 表记录每条记录引用的本地图片，删除图片前用 is_referenced()
+  确认没有其他记录仍在使用；缺少字段、无法生成摘要的记录不在 /history 中
+  显示（summary 为 NULL），但引用的图片照样登记，不会被 GC 回收
+
+已有的 JSON 文件可以通过 rebuild() 回填：
+
+    python history_index.py rebuild
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+from history_layout import iter_record_files
+
+INDEX_FILENAME = "index.sqlite3"
+# 表结构版本，旧版本的索引会在启动时自动重建
+SCHEMA_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    name      TEXT PRIMARY KEY,  -- JSON 文件名（不含 .json），如 uuid 或 uuid_1
+    record_id TEXT NOT NULL,     -- 记录内的 id 字段
+    mtime     REAL NOT NULL,     -- JSON 文件修改时间，用于排序
+    summary   TEXT               -- /history 返回给前端的摘要（JSON），无法生成时为 NULL
+);
+CREATE INDEX IF NOT EXISTS idx_records_mtime ON records (mtime DESC, name);
+CREATE INDEX IF NOT EXISTS idx_records_record_id ON records (record_id);
+CREATE TABLE IF NOT EXISTS record_paths (
+    name TEXT NOT NULL,  -- records.name
+    path TEXT NOT NULL   -- 引用的本地图片，如 /history/results/x.jpg
+);
+CREATE INDEX IF NOT EXISTS idx_record_paths_name ON record_paths (name);
+CREATE INDEX IF NOT EXISTS idx_record_paths_path ON record_paths (path);
+"""
+
+
+def summarize_record(record: dict) -> dict:
+    """只保留 /history 需要返回给前端的字段"""
+    return {
+        "id": record["id"],
+        "timestamp": record["timestamp"],
+        "result_paths": record.get("local_result_paths", []),
+        "result_urls": record.get("result_urls", []),
+        "input_paths": record.get("local_input_paths", []),
+        "input_urls": record.get("image_urls", []),
+        "params": {
+            "size": record["size"],
+            "aspect_ratio": record["aspect_ratio"],
+            "prompt": record["prompt"],
+        },
+    }
+
+
+def _index_row(json_path: Path, record: dict):
+    """(name, record_id, mtime, summary_json, 引用的本地图片)"""
+    try:
+        summary = json.dumps(summarize_record(record), ensure_ascii=False)
+    except KeyError as e:
+        # 不在 /history 中显示，但仍登记引用的图片，避免被 GC 当作孤儿回收
+        print(f"[History Index] 记录缺少字段 {e}，不生成摘要: {json_path}")
+        summary = None
+    paths = [
+        path
+        for key in ("local_result_paths", "local_input_paths")
+        for path in record.get(key) or []
+        if isinstance(path, str) and path
+    ]
+    return (
+        json_path.stem,
+        str(record.get("id", json_path.stem)),
+        os.path.getmtime(json_path),
+        summary,
+        list(dict.fromkeys(paths)),
+    )
+
+
+class HistoryIndex:
+    """HISTORY_DIR 下 JSON 记录的 SQLite 索引（线程安全，每个线程一个连接）"""
+
+    def __init__(self, history_dir: Path, db_path: Path = None, auto_rebuild=True):
+        self.history_dir = Path(history_dir)
+        self.db_path = Path(db_path) if db_path else self.history_dir / INDEX_FILENAME
+        self._local = threading.local()
+
+        is_new = not self.db_path.exists()
+        with self._conn() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                # 旧版本的 summary 列为 NOT NULL，删表后按新结构重建
+                conn.execute("DROP TABLE IF EXISTS records")
+                conn.execute("DROP TABLE IF EXISTS record_paths")
+            conn.executescript(_SCHEMA)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        # 首次创建（或表结构升级）时，自动从已有 JSON 回填
+        if (is_new or version < SCHEMA_VERSION) and auto_rebuild:
+            count = self.rebuild()
+            if count:
+                print(f"[History Index] 已从现有 JSON 回填 {count} 条记录")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, json_path: Path, record: dict):
+        """登记（或覆盖）一个刚写入的 JSON 记录"""
+        with self._conn() as conn:
+            self._insert(conn, [_index_row(Path(json_path), record)])
+
+    @staticmethod
+    def _insert(conn, rows):
+        conn.executemany(
+            "INSERT OR REPLACE INTO records (name, record_id, mtime, summary)"
+            " VALUES (?, ?, ?, ?)",
+            [row[:4] for row in rows],
+        )
+        conn.executemany(
+            "DELETE FROM record_paths WHERE name = ?", [(row[0],) for row in rows]
+        )
+        conn.executemany(
+            "INSERT INTO record_paths (name, path) VALUES (?, ?)",
+            [(row[0], path) for row in rows for path in row[4]],
+        )
+
+    def remove(self, name: str):
+        """按 JSON 文件名（不含 .json）移除索引项"""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM records WHERE name = ?", (name,))
+            conn.execute("DELETE FROM record_paths WHERE name = ?", (name,))
+
+    def find_group(self, record_id: str) -> list:
+        """返回属于同一 id 的全部 JSON 文件名（id.json 以及 id_1.json、id_2.json…）"""
+        rows = (
+            self._conn()
+            .execute(
+                "SELECT name FROM records WHERE record_id = ? OR name = ?",
+                (record_id, record_id),
+            )
+            .fetchall()
+        )
+        return [row[0] for row in rows]
+
+    def paths_for(self, names) -> list:
+        """返回这些记录引用的所有本地图片路径（去重）"""
+        conn = self._conn()
+        paths = []
+        for name in names:
+            for (path,) in conn.execute(
+                "SELECT path FROM record_paths WHERE name = ?", (name,)
+            ):
+                if path not in paths:
+                    paths.append(path)
+        return paths
+
+    def is_referenced(self, path: str) -> bool:
+        """是否还有记录引用该图片"""
+        row = (
+            self._conn()
+            .execute("SELECT 1 FROM record_paths WHERE path = ? LIMIT 1", (path,))
+            .fetchone()
+        )
+        return row is not None
+
+    def referenced_paths(self, since: float = None) -> set:
+        """所有记录引用的本地图片；提供 since 时只返回该时间之后写入的记录引用的图片"""
+        if since is None:
+            rows = self._conn().execute("SELECT DISTINCT path FROM record_paths")
+        else:
+            rows = self._conn().execute(
+                "SELECT DISTINCT p.path FROM record_paths p"
+                " JOIN records r ON r.name = p.name WHERE r.mtime >= ?",
+                (since,),
+            )
+        return {row[0] for row in rows}
+
+    def page(self, offset: int, limit: int):
+        """按修改时间倒序取一页摘要，返回 (records, total)"""
+        conn = self._conn()
+        total = conn.execute(
+            "SELECT COUNT(*) FROM records WHERE summary IS NOT NULL"
+        ).fetchone()[0]
+        rows = conn.execute(
+            "SELECT summary FROM records WHERE summary IS NOT NULL"
+            " ORDER BY mtime DESC, name LIMIT ? OFFSET ?",
+            (limit, offset),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows], total
+
+    def rebuild(self) -> int:
+        """清空索引并从 HISTORY_DIR 下所有 JSON 文件重建，返回登记的记录数"""
+        rows = {}  # 迁移过程中同一记录可能同时出现在平铺和分片位置，按文件名去重
+        for f in iter_record_files(self.history_dir):
+            try:
+                with open(f, "r", encoding="utf-8") as fp:
+                    record = json.load(fp)
+                rows[f.stem] = _index_row(f, record)
+            except Exception as e:
+                print(f"[History Index] Load error: {f} - {e}")
+                continue
+
+        with self._conn() as conn:
+            conn.execute("DELETE FROM records")
+            conn.execute("DELETE FROM record_paths")
+            self._insert(conn, list(rows.values()))
+        return len(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("用法: python history_index.py rebuild [HISTORY_DIR]")
+        sys.exit(1)
+
+    target_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path("history")
+    index = HistoryIndex(target_dir, auto_rebuild=False)
+    print(f"[History Index] 重建完成，共 {index.rebuild()} 条记录")
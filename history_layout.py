@@ -0,0 +1,222 @@
+"""
+history/ 的分片目录布局。
+
+inputs/、results/ 和历史记录 JSON 原先都平铺在一个目录里，文件数到几十万之后
+glob、listdir 和新建文件都会变慢，备份也很难分批。新写入的文件按文件名（不含扩展名）
+SHA-1 的前缀分到子目录：
+
+    history/results/3f/<uuid>.jpg
+    history/thumbs/256/results/3f/<uuid>.jpg   （缩略图跟随原图的路径）
+    history/records/3f/<uuid>.json             （历史记录 JSON）
+
+分片目录只由文件名决定，不需要映射表：resolve() 对任意 history/ 下的路径依次尝试
+当前布局、平铺布局和其他分片层数，所以旧记录、旧故事板里保存的平铺 URL 在迁移后
+仍然可以访问，记录和故事板中的 URL 不需要改写。比较两个路径是否指向同一张图片时
+（GC 等）使用 logical_path()，即去掉分片目录后的路径。
+
+在线迁移（服务运行期间执行即可）：
+
+    python history_layout.py migrate --dry-run   # 只统计需要移动的文件
+    python history_layout.py migrate             # 移动已有文件到当前布局
+
+每个文件先硬链接到新位置再删除原路径，任何时刻至少有一个路径存在；文件系统不支持
+硬链接时退化为 rename。正在写入的 .part 临时文件会跳过。
+
+配置（.env）：
+    HISTORY_SHARD_LEVELS  分片层数（每层 2 个十六进制字符，即 256 个子目录），
+                          0 表示沿用平铺布局，默认 1
+"""
+
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HISTORY_DIR = Path("history")
+RECORDS_DIR = HISTORY_DIR / "records"
+THUMB_DIR = HISTORY_DIR / "thumbs"
+# 分片存放的图片子目录（缩略图在 thumbs/<尺寸>/ 下使用同样的子目录）
+IMAGE_SUBDIRS = ("inputs", "results")
+
+MAX_SHARD_LEVELS = 3
+SHARD_WIDTH = 2
+HISTORY_SHARD_LEVELS = min(
+    max(int(os.getenv("HISTORY_SHARD_LEVELS", "1")), 0), MAX_SHARD_LEVELS
+)
+# resolve() 尝试的分片层数：当前布局优先，其次平铺（迁移前的文件），最后是其他层数
+_LOOKUP_LEVELS = tuple(
+    dict.fromkeys([HISTORY_SHARD_LEVELS, 0, *range(1, MAX_SHARD_LEVELS + 1)])
+)
+
+
+def shard_dirs(filename: str, levels: int = HISTORY_SHARD_LEVELS) -> list:
+    """文件名对应的分片目录，如 'abc.jpg' → ['3f']"""
+    digest = hashlib.sha1(Path(filename).stem.encode("utf-8")).hexdigest()
+    return [digest[i * SHARD_WIDTH : (i + 1) * SHARD_WIDTH] for i in range(levels)]
+
+
+def shard_path(folder: Path, filename: str) -> Path:
+    """新文件在 folder 下按当前布局的位置（会创建分片目录）"""
+    path = Path(folder).joinpath(*shard_dirs(filename)) / filename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def record_path(name: str) -> Path:
+    """新写入的历史记录 JSON 的位置（name 不含 .json）"""
+    if not HISTORY_SHARD_LEVELS:
+        return HISTORY_DIR / f"{name}.json"
+    return shard_path(RECORDS_DIR, f"{name}.json")
+
+
+def record_candidates(name: str) -> list:
+    """历史记录 JSON 可能所在的全部位置（平铺的旧记录和各分片层数）"""
+    return [
+        (
+            HISTORY_DIR / f"{name}.json"
+            if not levels
+            else RECORDS_DIR.joinpath(*shard_dirs(name, levels)) / f"{name}.json"
+        )
+        for levels in _LOOKUP_LEVELS
+    ]
+
+
+def iter_record_files(history_dir: Path = HISTORY_DIR):
+    """产出所有历史记录 JSON（平铺的旧记录 + records/ 下分片存放的记录）"""
+    history_dir = Path(history_dir)
+    yield from history_dir.glob("*.json")
+    yield from (history_dir / RECORDS_DIR.name).glob("**/*.json")
+
+
+def logical_path(path: str) -> str:
+    """去掉分片目录：'history/results/3f/abc.jpg' → 'history/results/abc.jpg'"""
+    parts = path.split("/")
+    for levels in range(MAX_SHARD_LEVELS, 0, -1):
+        if len(parts) > levels + 1 and parts[-1 - levels : -1] == shard_dirs(
+            parts[-1], levels
+        ):
+            return "/".join(parts[: -1 - levels] + parts[-1:])
+    return path
+
+
+def candidates(subpath: str) -> list:
+    """HISTORY_DIR 下的相对路径（如 'results/abc.jpg'）在各种布局下可能的位置"""
+    parts = logical_path(subpath).split("/")
+    return list(
+        dict.fromkeys(
+            "/".join(parts[:-1] + shard_dirs(parts[-1], levels) + parts[-1:])
+            for levels in _LOOKUP_LEVELS
+        )
+    )
+
+
+def resolve(subpath: str):
+    """
+    把 HISTORY_DIR 下的相对路径（平铺或分片形式均可）解析为实际存在的文件，
+    返回实际的相对路径；找不到（或路径含 ..）时返回 None
+    """
+    subpath = subpath.replace("\\", "/").lstrip("/")
+    if not subpath or ".." in subpath.split("/"):
+        return None
+    if (HISTORY_DIR / subpath).is_file():
+        return subpath
+    for candidate in candidates(subpath):
+        if (HISTORY_DIR / candidate).is_file():
+            return candidate
+    return None
+
+
+def actual_path(ref: str) -> str:
+    """
+    本地图片引用（如 '/history/inputs/x.jpg'，平铺或分片形式）→ 实际的文件路径
+    （如 'history/inputs/3f/x.jpg'）；不在 history/ 下或找不到时原样去掉开头的 /
+    """
+    rel = ref.replace("\\", "/").lstrip("/")
+    prefix = HISTORY_DIR.as_posix() + "/"
+    if rel.startswith(prefix):
+        actual = resolve(rel[len(prefix) :])
+        if actual:
+            return prefix + actual
+    return rel
+
+
+def _move(src: Path, dst: Path) -> str:
+    """硬链接到新位置后删除原路径，返回 moved / conflict / gone"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        # 上次迁移中断在链接之后，或新布局下已有同名文件
+        if not os.path.samefile(src, dst):
+            return "conflict"
+    except FileNotFoundError:
+        return "gone"  # 迁移期间被删除
+    except OSError:
+        # 不支持硬链接：直接改名
+        if dst.exists():
+            return "conflict"
+        os.replace(src, dst)
+        return "moved"
+    src.unlink(missing_ok=True)
+    return "moved"
+
+
+def _migration_targets():
+    """产出 (当前位置, 当前布局下的位置)，只包含需要移动的文件"""
+    image_dirs = [HISTORY_DIR / subdir for subdir in IMAGE_SUBDIRS]
+    if THUMB_DIR.is_dir():
+        image_dirs += [
+            size_dir / subdir
+            for size_dir in sorted(THUMB_DIR.iterdir())
+            for subdir in IMAGE_SUBDIRS
+        ]
+    for folder in image_dirs:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in files:
+                if name.endswith(".part"):
+                    continue
+                src = Path(root) / name
+                target = folder.joinpath(*shard_dirs(name)) / name
+                if src != target:
+                    yield src, target
+
+    for src in sorted(iter_record_files()):
+        target = (
+            RECORDS_DIR.joinpath(*shard_dirs(src.name)) / src.name
+            if HISTORY_SHARD_LEVELS
+            else HISTORY_DIR / src.name
+        )
+        if src != target:
+            yield src, target
+
+
+def migrate(dry_run=False) -> dict:
+    """把已有文件移动到当前布局（HISTORY_SHARD_LEVELS），返回统计"""
+    stats = {"pending": 0, "moved": 0, "conflict": 0, "gone": 0}
+    for src, target in _migration_targets():
+        stats["pending"] += 1
+        if dry_run:
+            continue
+        result = _move(src, target)
+        stats[result] += 1
+        if result == "conflict":
+            print(f"[History Layout] 目标已存在且内容不同，跳过: {src} -> {target}")
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("用法: python history_layout.py migrate [--dry-run]")
+        sys.exit(1)
+
+    dry_run = "--dry-run" in sys.argv[2:]
+    stats = migrate(dry_run=dry_run)
+    print(
+        f"[History Layout] {'dry-run ' if dry_run else ''}迁移完成"
+        f"（分片层数 {HISTORY_SHARD_LEVELS}）: {stats}"
+    )
@@ -0,0 +1,171 @@
+"""
+上传图片的规范化（save_uploaded_file_as_jpg 使用）。
+
+按文件头的魔数判断真实格式（不看扩展名）：
+
+- 符合要求的 JPEG（RGB / 灰度、EXIF 方向为正）逐段复制，不解码也不重新编码，
+  画质不会因为反复经过本系统而下降。默认去掉 EXIF / XMP / IPTC / 注释段
+  （与原先重新编码的结果一致，GPS 等信息不会传到图床），保留 ICC 色彩配置
+- EXIF 方向不为正的 JPEG 按方向旋转后重新编码
+- 段结构不完整的 JPEG（如被截断、缺少 EOI）改为完整解码后重新编码，
+  真正截断的图片在解码时报错
+- PNG / WebP / GIF 等其他格式解码后编码为 UPLOAD_OUTPUT_FORMAT，JPEG 输出时透明部分铺白底
+
+配置（.env）：
+    UPLOAD_OUTPUT_FORMAT   需要重新编码时的输出格式：jpeg / webp / png，默认 jpeg
+    UPLOAD_OUTPUT_QUALITY  输出质量（jpeg / webp），默认 92
+    UPLOAD_KEEP_METADATA   直接复制 JPEG 时是否保留 EXIF 等元数据，默认 0
+"""
+
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+load_dotenv()
+
+# 输出格式 -> (Pillow 格式名, 扩展名)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+    "png": ("PNG", ".png"),
+}
+UPLOAD_OUTPUT_FORMAT = os.getenv("UPLOAD_OUTPUT_FORMAT", "jpeg").lower()
+if UPLOAD_OUTPUT_FORMAT not in OUTPUT_FORMATS:
+    print(
+        f"[Normalize] 不支持的 UPLOAD_OUTPUT_FORMAT={UPLOAD_OUTPUT_FORMAT}，使用 jpeg"
+    )
+    UPLOAD_OUTPUT_FORMAT = "jpeg"
+UPLOAD_OUTPUT_QUALITY = int(os.getenv("UPLOAD_OUTPUT_QUALITY", "92"))
+UPLOAD_KEEP_METADATA = os.getenv("UPLOAD_KEEP_METADATA", "0") == "1"
+
+EXIF_ORIENTATION = 0x0112
+
+# 直接复制时去掉的段：APP1（EXIF / XMP）、APP13（IPTC）、COM（注释）
+_METADATA_MARKERS = {0xE1, 0xED, 0xFE}
+# 没有长度字段的标记：TEM、RST0-7
+_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def sniff_format(head: bytes) -> str:
+    """根据文件头判断格式：jpeg / png / webp / gif / other"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return "other"
+
+
+def _is_conforming_jpeg(img) -> bool:
+    """可以原样使用的 JPEG：YCbCr / 灰度（不是 CMYK），且不需要按 EXIF 旋转"""
+    return img.mode in ("RGB", "L") and img.getexif().get(EXIF_ORIENTATION, 1) == 1
+
+
+def _copy_jpeg(src, dst, keep_metadata=False):
+    """
+    逐段复制 JPEG，可选去掉元数据段；扫描数据（SOS 之后）原样复制。
+    段长度不足或没有以 EOI 结尾时抛出 ValueError
+    """
+    if src.read(2) != b"\xff\xd8":
+        raise ValueError("Not a JPEG stream")
+    dst.write(b"\xff\xd8")
+    while True:
+        marker = src.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ValueError("Malformed JPEG marker")
+        while marker[1] == 0xFF:  # 标记前的填充字节
+            marker = b"\xff" + src.read(1)
+        code = marker[1]
+        if code == 0xDA:  # SOS：之后都是压缩数据
+            dst.write(marker)
+            tail = b""
+            while chunk := src.read(COPY_CHUNK_SIZE):
+                dst.write(chunk)
+                tail = (tail + chunk)[-2:]
+            if tail != b"\xff\xd9":
+                raise ValueError("JPEG does not end with EOI")
+            return
+        if code in _STANDALONE_MARKERS:
+            dst.write(marker)
+            continue
+        length = src.read(2)
+        size = int.from_bytes(length, "big") - 2
+        body = src.read(size)
+        if len(length) < 2 or size < 0 or len(body) < size:
+            raise ValueError("Truncated JPEG segment")
+        if keep_metadata or code not in _METADATA_MARKERS:
+            dst.write(marker + length + body)
+
+
+def _encode(img, pil_format, fp):
+    img = ImageOps.exif_transpose(img)
+    icc_profile = img.info.get("icc_profile")
+    if pil_format == "JPEG":
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (
+            img.mode == "P" and "transparency" in img.info
+        )
+        if has_alpha:
+            # 透明部分铺白底
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.split()[-1])
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+        img = img.convert("RGBA")
+
+    options = {"icc_profile": icc_profile} if icc_profile else {}
+    if pil_format in ("JPEG", "WEBP"):
+        options["quality"] = UPLOAD_OUTPUT_QUALITY
+    img.save(fp, pil_format, **options)
+
+
+def _write_part(path: Path, write) -> Path:
+    """先写 .part，完成后改名为 path；失败时删除 .part"""
+    part_path = path.with_suffix(".part")
+    try:
+        with open(part_path, "wb") as f:
+            write(f)
+        part_path.replace(path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def normalize_upload(stream, dest_stem: Path):
+    """
+    把上传的图片流规范化后写入 dest_stem + 扩展名（先写 .part，完成后改名）。
+    返回 (最终路径, 源格式, 处理方式)，处理方式为 copied / transposed / converted。
+    无法识别或被截断的图片抛出异常。
+    """
+    head = stream.read(16)
+    stream.seek(0)
+    source_format = sniff_format(head)
+
+    with Image.open(stream) as img:  # 只读取文件头
+        if source_format == "jpeg" and _is_conforming_jpeg(img):
+            stream.seek(0)
+            try:
+                path = _write_part(
+                    Path(dest_stem).with_suffix(".jpg"),
+                    lambda f: _copy_jpeg(stream, f, UPLOAD_KEEP_METADATA),
+                )
+                return path, source_format, "copied"
+            except ValueError as e:
+                # 截断的图片在下面完整解码时报错；EOI 之后有附加数据的图片正常重新编码
+                print(f"[Normalize] JPEG 无法直接复制（{e}），改为重新编码")
+
+        pil_format, suffix = OUTPUT_FORMATS[UPLOAD_OUTPUT_FORMAT]
+        rotate_only = source_format == "jpeg" and img.mode in ("RGB", "L")
+        action = "transposed" if rotate_only else "converted"
+        path = _write_part(
+            Path(dest_stem).with_suffix(suffix), lambda f: _encode(img, pil_format, f)
+        )
+    return path, source_format, action
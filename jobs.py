@@ -0,0 +1,285 @@
+"""
+生成任务队列。
+
+POST /generate 不再阻塞整个请求，而是把任务交给 JobManager：
+- 任务进入队列后立即返回 job id
+- 固定大小的线程池执行任务（JOB_WORKERS，默认 4）
+- 客户端通过 GET /jobs/<id> 轮询，或 GET /jobs/<id>/events 订阅 SSE 事件
+
+各插件自身的并发上限由 plugins.acquire_plugin_slot() 控制，这里只负责排队和状态。
+
+多 worker 部署（COORDINATION=sqlite，见 coordination.py）时：
+- 任务状态和事件同时写入协调数据库，其他 worker 收到的 /jobs/<id> 请求
+  通过 StoredJob 从数据库读取
+- 所有 worker 合计同时运行的任务数受 JOB_GLOBAL_CONCURRENCY 限制
+- 执行任务的 worker 退出后，重新排队的任务由存活的 worker 认领执行
+  （按 register() 登记的任务类型找到执行函数）
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from dotenv import load_dotenv
+
+from coordination import JOB_GLOBAL_CONCURRENCY, coordinator
+from metrics import QUEUE_WAIT
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# 已结束的任务在内存中保留多久（秒），过期后 /jobs/<id> 返回 404
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+
+class Job:
+    """单个任务的状态与事件流"""
+
+    def __init__(self, kind: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.attempt = 1  # 第几次执行（遗弃后重新排队的任务递增）
+        self.events = []
+        self._cond = threading.Condition()
+        self.emit(QUEUED)
+
+    @classmethod
+    def restore(cls, stored: dict, events: list) -> "Job":
+        """从协调数据库恢复一个重新排队的任务（接续原有事件序号）"""
+        job = cls.__new__(cls)
+        job.id = stored["id"]
+        job.kind = stored["kind"]
+        job.params = stored["params"]
+        job.status = QUEUED
+        job.result = None
+        job.error = None
+        job.created_at = stored["created_at"]
+        job.started_at = None
+        job.finished_at = None
+        job.attempt = stored["attempts"]
+        job.events = events
+        job._cond = threading.Condition()
+        return job
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def emit(self, event: str, **data):
+        """追加一个事件并唤醒所有等待中的订阅者"""
+        with self._cond:
+            self.events.append({"event": event, "time": time.time(), **data})
+            if coordinator is not None:
+                coordinator.append_event(self.id, len(self.events) - 1, self.events[-1])
+            self._cond.notify_all()
+
+    def wait_events(self, since: int, timeout: float):
+        """返回序号 >= since 的事件；暂无新事件时最多等待 timeout 秒"""
+        with self._cond:
+            if since >= len(self.events) and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[since:]
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class StoredJob:
+    """其他 worker 上的任务：只读视图，状态和事件从协调数据库轮询"""
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, stored: dict):
+        self.id = stored["id"]
+        self._stored = stored
+
+    @property
+    def status(self) -> str:
+        return self._stored["status"]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def _reload(self):
+        self._stored = coordinator.load_job(self.id) or self._stored
+
+    def wait_events(self, since: int, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            events = coordinator.load_events(self.id, since)
+            if events:
+                return events
+            self._reload()
+            if self.finished:
+                # 结束事件先于状态写入，这里再读一次即可拿到
+                return coordinator.load_events(self.id, since)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+
+    def to_dict(self) -> dict:
+        return {
+            key: self._stored[key]
+            for key in (
+                "id",
+                "kind",
+                "status",
+                "result",
+                "error",
+                "created_at",
+                "started_at",
+                "finished_at",
+            )
+        }
+
+
+class JobManager:
+    """任务队列 + 线程池"""
+
+    def __init__(self, max_workers: int = JOB_WORKERS, ttl: int = JOB_TTL):
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+        self._jobs = {}
+        self._handlers = {}
+        self._lock = threading.Lock()
+        if coordinator is not None:
+            coordinator.start(self._on_tick)
+
+    def register(self, kind: str, func):
+        """登记任务类型的执行函数，接手其他 worker 遗弃的任务时据此执行"""
+        self._handlers[kind] = func
+
+    def submit(self, kind: str, func, params: dict) -> Job:
+        """
+        提交任务。func(job, params) 在工作线程中执行：
+        返回值作为 job.result；抛出异常则任务失败，异常信息写入 job.error。
+        """
+        job = Job(kind, params)
+        self._handlers.setdefault(kind, func)
+        self._save(job)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and coordinator is not None:
+            stored = coordinator.load_job(job_id)
+            job = StoredJob(stored) if stored else None
+        return job
+
+    def queue_depth(self) -> int:
+        if coordinator is not None:
+            return coordinator.count_jobs(QUEUED)
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    @staticmethod
+    def _save(job: Job):
+        if coordinator is not None:
+            coordinator.save_job(job.to_dict(), job.params, job.attempt)
+
+    def _run(self, job: Job, func):
+        # 多 worker 时先占用全局任务名额，等待期间任务保持 queued
+        if coordinator is not None and JOB_GLOBAL_CONCURRENCY > 0:
+            slot = coordinator.lease("jobs", JOB_GLOBAL_CONCURRENCY)
+        else:
+            slot = nullcontext()
+        with slot:
+            self._execute(job, func)
+
+    def _execute(self, job: Job, func):
+        job.status = RUNNING
+        job.started_at = time.time()
+        QUEUE_WAIT.observe(job.started_at - job.created_at, "jobs")
+        self._save(job)
+        job.emit(RUNNING, queued_seconds=job.started_at - job.created_at)
+        try:
+            job.result = func(job, job.params)
+            status = SUCCEEDED
+        except Exception as e:
+            print(f"[Job {job.id}] 失败: {e}")
+            job.error = str(e)
+            status = FAILED
+        job.finished_at = time.time()
+        job.status = status
+        job.emit(status, result=job.result, error=job.error)
+        self._save(job)
+
+    def _on_tick(self):
+        """心跳线程中调用：清理过期任务，认领重新排队的遗弃任务"""
+        coordinator.prune_jobs(time.time() - self.ttl)
+        with self._lock:
+            idle = self.max_workers - sum(
+                1 for job in self._jobs.values() if not job.finished
+            )
+        for job_id in coordinator.claim_jobs(list(self._handlers), idle):
+            stored = coordinator.load_job(job_id)
+            job = Job.restore(stored, coordinator.load_events(job_id))
+            print(f"[Job {job.id}] 接手遗弃的任务（第 {stored['attempts']} 次执行）")
+            with self._lock:
+                self._jobs[job.id] = job
+            self._executor.submit(self._run, job, self._handlers[job.kind])
+
+    def _prune(self):
+        """清理过期的已结束任务（调用方需持有 self._lock）"""
+        deadline = time.time() - self.ttl
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < deadline
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def sse_stream(job: Job, last_event_id: int = -1, keepalive: float = 15.0):
+    """把任务事件转换为 text/event-stream，任务结束后关闭流"""
+    cursor = last_event_id + 1
+    while True:
+        events = job.wait_events(cursor, keepalive)
+        if not events:
+            if job.finished:
+                return
+            yield ": keepalive\n\n"
+            continue
+        for event in events:
+            payload = json.dumps(event, ensure_ascii=False)
+            yield f"id: {cursor}\nevent: {event['event']}\ndata: {payload}\n\n"
+            cursor += 1
+            if event["event"] in FINISHED_STATES:
+                return
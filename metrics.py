@@ -0,0 +1,190 @@
+"""
+运行指标（Prometheus 文本格式，由 /metrics 输出）。
+
+不依赖 prometheus_client，只实现本项目需要的 Counter / Histogram /
+回调 Gauge。每次记录只是一次加锁和几次整数加法，开销在微秒级。
+
+用法：
+    with timed("save_image_from_url"):
+        ...
+    STAGE_BYTES_IN.inc("save_image_from_url", amount=len(data))
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 覆盖毫秒级（本地 PIL 处理）到分钟级（插件生成）的耗时分布
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labelvalues -> [每个桶的计数..., +Inf 计数, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(labelvalues)
+            if data is None:
+                data = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+            data[idx] += 1
+            data[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for labelvalues, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), data[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", bound)])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {data[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackGauge:
+    """读取时才计算的 Gauge（如队列长度）"""
+
+    def __init__(self, name, documentation, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        _registry.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            yield f"{self.name} {self.func()}"
+        except Exception as e:
+            print(f"[Metrics] {self.name} 读取失败: {e}")
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ===== 指标定义 =====
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["route", "method", "status"],
+)
+REQUEST_BYTES_IN = Counter(
+    "http_request_bytes_total", "HTTP request body bytes", ["route"]
+)
+RESPONSE_BYTES_OUT = Counter(
+    "http_response_bytes_total", "HTTP response body bytes", ["route"]
+)
+
+# stage：save_uploaded_file_as_jpg / upload_file / generate_images / save_image_from_url …
+# target：插件名或上传后端，无则为空
+STAGE_LATENCY = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Pipeline stage latency",
+    ["stage", "target"],
+)
+STAGE_ERRORS = Counter(
+    "pipeline_stage_errors_total", "Pipeline stage errors", ["stage", "target"]
+)
+STAGE_BYTES_IN = Counter(
+    "pipeline_stage_bytes_in_total", "Bytes read by a pipeline stage", ["stage"]
+)
+STAGE_BYTES_OUT = Counter(
+    "pipeline_stage_bytes_out_total", "Bytes written by a pipeline stage", ["stage"]
+)
+
+# queue：jobs（任务排队）/ plugin:<name>（等待插件并发名额）
+QUEUE_WAIT = Histogram(
+    "queue_wait_seconds", "Time spent waiting in a queue or for a slot", ["queue"]
+)
+
+UPLOAD_CACHE_LOOKUPS = Counter(
+    "upload_cache_lookups_total", "Upload cache lookups", ["result"]
+)
+
+# format：jpeg / png / webp / gif / other；action：copied / transposed / converted
+UPLOAD_NORMALIZE = Counter(
+    "upload_normalize_total",
+    "Uploaded images by source format and action",
+    ["format", "action"],
+)
+
+
+@contextmanager
+def timed(stage, target=""):
+    """记录代码块耗时；抛出异常时同时计入错误数"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage, target)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage, target)
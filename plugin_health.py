@@ -0,0 +1,191 @@
+"""
+插件健康度与熔断。
+
+每次插件调用后记录成功/失败和耗时（最近 HEALTH_WINDOW 次），据此：
+
+- 熔断：连续失败 BREAKER_FAILURE_THRESHOLD 次，或窗口内失败率超过
+  BREAKER_FAILURE_RATE（且样本数足够），插件进入 open 状态被跳过；
+  BREAKER_COOLDOWN 秒后进入 half_open，放行一次探测调用，成功则恢复
+- 自适应排序（FALLBACK_POLICY=adaptive）：按“期望成功耗时”
+  （p50 耗时 / 成功率）重新排列有足够样本的插件，样本不足的保持原位
+
+失败包括抛出异常、返回空结果，以及（可选）耗时超过 BREAKER_SLOW_CALL_SECONDS。
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FALLBACK_POLICY = os.getenv("FALLBACK_POLICY", "static").lower()
+HEALTH_WINDOW = int(os.getenv("HEALTH_WINDOW", "50"))
+HEALTH_MIN_SAMPLES = int(os.getenv("HEALTH_MIN_SAMPLES", "5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "0"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class _PluginState:
+    def __init__(self):
+        self.calls = deque(maxlen=HEALTH_WINDOW)  # (ok, latency)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_started_at = None
+        self.total_calls = 0
+        self.total_failures = 0
+
+    def success_rate(self):
+        if not self.calls:
+            return None
+        return sum(1 for ok, _ in self.calls if ok) / len(self.calls)
+
+    def latency(self, p):
+        if not self.calls:
+            return None
+        return _percentile([latency for _, latency in self.calls], p)
+
+
+class PluginHealth:
+    def __init__(self):
+        self._plugins = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name) -> _PluginState:
+        state = self._plugins.get(name)
+        if state is None:
+            state = self._plugins[name] = _PluginState()
+        return state
+
+    def record(self, name, ok: bool, latency: float):
+        """记录一次调用结果，并更新熔断状态"""
+        if ok and BREAKER_SLOW_CALL_SECONDS and latency > BREAKER_SLOW_CALL_SECONDS:
+            ok = False
+        with self._lock:
+            s = self._get(name)
+            s.calls.append((ok, latency))
+            s.total_calls += 1
+            s.probe_started_at = None
+            if ok:
+                s.consecutive_failures = 0
+                if s.state != CLOSED:
+                    print(f"[Breaker] {name} 恢复")
+                s.state = CLOSED
+                return
+
+            s.total_failures += 1
+            s.consecutive_failures += 1
+            rate = s.success_rate()
+            too_many_failures = (
+                len(s.calls) >= HEALTH_MIN_SAMPLES and 1 - rate >= BREAKER_FAILURE_RATE
+            )
+            if (
+                s.state == HALF_OPEN
+                or s.consecutive_failures >= BREAKER_FAILURE_THRESHOLD
+                or too_many_failures
+            ):
+                if s.state != OPEN:
+                    print(f"[Breaker] {name} 熔断 {BREAKER_COOLDOWN:.0f}s")
+                s.state = OPEN
+                s.opened_at = time.time()
+
+    def available(self, name) -> bool:
+        """
+        插件是否可以列为候选：不在冷却中的 open 状态，且 half_open 的探测没有被占用。
+        只做判断，不占用探测名额（候选可能因前面的插件胜出而不会被调用）
+        """
+        with self._lock:
+            s = self._get(name)
+            now = time.time()
+            if s.state == OPEN:
+                return now - s.opened_at >= BREAKER_COOLDOWN
+            if s.state == HALF_OPEN:
+                return s.probe_started_at is None or (
+                    now - s.probe_started_at >= BREAKER_COOLDOWN
+                )
+            return True
+
+    def allow(self, name) -> bool:
+        """
+        即将调用插件时判断是否放行；open 状态冷却结束后放行一次探测，
+        并占用探测名额直到 record() 回报结果
+        """
+        with self._lock:
+            s = self._get(name)
+            if s.state == CLOSED:
+                return True
+            now = time.time()
+            if s.state == OPEN and now - s.opened_at >= BREAKER_COOLDOWN:
+                s.state = HALF_OPEN
+            if s.state == HALF_OPEN:
+                # 同一时间只放行一个探测；探测未回报（如调用被取消）时冷却后再放行
+                if s.probe_started_at is None or (
+                    now - s.probe_started_at >= BREAKER_COOLDOWN
+                ):
+                    s.probe_started_at = now
+                    return True
+            return False
+
+    def order(self, names, policy=None):
+        """按策略排列候选插件；adaptive 只重排有足够样本的插件"""
+        policy = (policy or FALLBACK_POLICY).lower()
+        names = list(names)
+        if policy != "adaptive":
+            return names
+
+        def expected_latency(name):
+            s = self._plugins[name]
+            return s.latency(0.5) / max(s.success_rate(), 0.05)
+
+        with self._lock:
+            ranked = [
+                name
+                for name in names
+                if name in self._plugins
+                and len(self._plugins[name].calls) >= HEALTH_MIN_SAMPLES
+            ]
+            slots = [i for i, name in enumerate(names) if name in ranked]
+            for i, name in zip(slots, sorted(ranked, key=expected_latency)):
+                names[i] = name
+        return names
+
+    def snapshot(self) -> dict:
+        """各插件的健康度，供 /plugins/health 使用"""
+        with self._lock:
+            result = {}
+            for name, s in self._plugins.items():
+                rate = s.success_rate()
+                p50, p95 = s.latency(0.5), s.latency(0.95)
+                result[name] = {
+                    "state": s.state,
+                    "success_rate": None if rate is None else round(rate, 3),
+                    "p50": None if p50 is None else round(p50, 3),
+                    "p95": None if p95 is None else round(p95, 3),
+                    "window": len(s.calls),
+                    "consecutive_failures": s.consecutive_failures,
+                    "total_calls": s.total_calls,
+                    "total_failures": s.total_failures,
+                    "retry_in": (
+                        max(0.0, round(s.opened_at + BREAKER_COOLDOWN - time.time(), 1))
+                        if s.state == OPEN
+                        else 0.0
+                    ),
+                }
+            return result
+
+
+plugin_health = PluginHealth()
@@ -0,0 +1,84 @@
+"""
+插件调用运行时：进程内共享的 asyncio 事件循环。
+
+插件入口（generate_images / swap_face）可以是普通函数，也可以是 async def：
+
+- async 插件直接在共享循环上执行，等待服务商返回（轮询、sleep）时不占用线程，
+  一个进程可以同时保持大量调用在途
+- 同步插件通过线程池适配（PLUGIN_SYNC_WORKERS，默认 32），与原先行为一致
+
+同步代码（任务线程、Flask 路由）通过 run_coroutine() / call_plugin() 调用；
+在共享循环内部则使用 call_plugin_async()。
+
+配置（.env）：
+    PLUGIN_SYNC_WORKERS  同步插件适配线程池大小，默认 32
+"""
+
+import asyncio
+import inspect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PLUGIN_SYNC_WORKERS = int(os.getenv("PLUGIN_SYNC_WORKERS", "32"))
+
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """返回共享事件循环（首次调用时在后台线程中启动）"""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(
+                ThreadPoolExecutor(
+                    max_workers=PLUGIN_SYNC_WORKERS, thread_name_prefix="plugin-sync"
+                )
+            )
+            _loop_thread = threading.Thread(
+                target=loop.run_forever, name="plugin-loop", daemon=True
+            )
+            _loop_thread.start()
+            _loop = loop
+        return _loop
+
+
+def run_coroutine(coro, timeout=None):
+    """在共享循环上执行协程并阻塞等待结果（不能在共享循环线程内调用）"""
+    loop = get_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_coroutine() called from the plugin event loop")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+def is_async_plugin(func) -> bool:
+    return inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(
+        getattr(func, "__call__", None)
+    )
+
+
+async def call_plugin_async(func, *args, **kwargs):
+    """在共享循环内调用插件：async 插件直接 await，同步插件放到适配线程池"""
+    if is_async_plugin(func):
+        return await func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, partial(func, *args, **kwargs))
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def call_plugin(func, *args, **kwargs):
+    """在同步代码中调用插件：同步插件直接在当前线程执行，async 插件交给共享循环"""
+    if is_async_plugin(func):
+        return run_coroutine(func(*args, **kwargs))
+    return func(*args, **kwargs)
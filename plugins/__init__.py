@@ -1,29 +1,165 @@
 # plugins/__init__.py
 """
-插件系统加载器。
+插件注册表。
 
 规则：
-- 只加载 plugins/ 下的子目录（如 plugins/nano_banana/）
-- 默认跳过 plugins/example/（除非在 PLUGIN_ENABLED 中显式启用）
-- 通过 .env 中的 PLUGIN_ENABLED 控制加载哪些插件
+- 只发现 plugins/ 下的子目录（如 plugins/nano_banana/）
+- 默认跳过 plugins/example*/ 示例插件（除非在 PLUGIN_ENABLED 中显式启用）
+- 通过 .env 中的 PLUGIN_ENABLED 控制启用哪些插件
+- 通过 .env 中的 PLUGIN_CONCURRENCY 限制每个插件的同时调用数，
+  如 PLUGIN_CONCURRENCY=nano_banana:2,rh_official:1
+  （未列出的插件使用 manifest 中的 concurrency，再没有则用 PLUGIN_DEFAULT_CONCURRENCY，默认 2）
+  多 worker 部署（COORDINATION=sqlite）时该上限由所有 worker 共享，见 coordination.py
+
+发现插件时只读取 plugins/<name>/manifest.json，不导入插件模块；模块在第一次调用
+get_plugin() / get_face_swap_plugin() 时才导入，解析出的函数会被缓存。
+没有 manifest 的旧插件同样支持，导入后按模块中是否有对应函数判断能力。
+
+manifest.json 示例：
+    {
+        "name": "nano_banana",
+        "module": "plugin",
+        "capabilities": ["generate_images"],
+        "sizes": ["1K", "2K", "4K"],
+        "aspect_ratios": ["auto", "1:1", "16:9", "9:16"],
+        "concurrency": 2
+    }
+sizes / aspect_ratios 为空表示不限制；aspect_ratio 为 "auto" 时总是允许。
+
+插件入口既可以是普通函数，也可以是 async def（在共享事件循环上执行，见 plugin_runtime）。
 """
 
+import asyncio
 import importlib
+import json
 import os
+import threading
+import time
 from pathlib import Path
 
 from dotenv import load_dotenv
 
+from coordination import coordinator
+from metrics import QUEUE_WAIT
+from plugin_runtime import call_plugin_async, get_loop, run_coroutine
+
 # 加载项目根目录的 .env（应包含 PLUGIN_ENABLED）
 load_dotenv()
 
 PLUGIN_DIR = Path(__file__).parent
-_loaded_plugins = {}
+MANIFEST_FILENAME = "manifest.json"
+PLUGIN_DEFAULT_CONCURRENCY = int(os.getenv("PLUGIN_DEFAULT_CONCURRENCY", "2"))
+_plugins = None  # 插件名 -> PluginSpec，首次使用时发现
+_plugins_lock = threading.Lock()
+_discover_lock = threading.Lock()
+_plugin_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+
+def _parse_concurrency(value: str) -> dict:
+    """解析 "name:2,other:1" 形式的并发配置"""
+    limits = {}
+    for item in value.split(","):
+        name, _, limit = item.strip().partition(":")
+        if name and limit.strip().isdigit():
+            limits[name.strip()] = max(1, int(limit))
+    return limits
+
+
+PLUGIN_CONCURRENCY = _parse_concurrency(os.getenv("PLUGIN_CONCURRENCY", ""))
+
+
+class PluginSpec:
+    """一个插件的元数据；模块在第一次解析某个能力时才导入"""
+
+    def __init__(self, name, manifest=None):
+        manifest = manifest or {}
+        self.name = name
+        self.module_name = manifest.get("module", "plugin")
+        self.description = manifest.get("description", "")
+        # None 表示未声明（没有 manifest 的旧插件），导入后按函数是否存在判断
+        self.capabilities = manifest.get("capabilities")
+        self.sizes = manifest.get("sizes") or []
+        self.aspect_ratios = manifest.get("aspect_ratios") or []
+        self.concurrency = manifest.get("concurrency")
+        self._module = None
+        self._import_failed = False
+        self._callables = {}  # 能力名 -> 函数（解析失败时为 None，同样缓存）
+        self._lock = threading.Lock()
+
+    def supports(self, capability, size=None, aspect_ratio=None) -> bool:
+        """根据 manifest 判断是否支持该能力和参数（不导入模块）"""
+        if self.capabilities is not None and capability not in self.capabilities:
+            return False
+        if size and self.sizes and size not in self.sizes:
+            return False
+        if (
+            aspect_ratio
+            and aspect_ratio != "auto"
+            and self.aspect_ratios
+            and aspect_ratio not in self.aspect_ratios
+        ):
+            return False
+        return True
+
+    def resolve(self, capability):
+        """返回能力对应的函数，首次调用时导入模块"""
+        if not self.supports(capability):
+            return None
+        with self._lock:
+            if capability in self._callables:
+                return self._callables[capability]
+            if self._module is None and not self._import_failed:
+                module_path = f"plugins.{self.name}.{self.module_name}"
+                start = time.perf_counter()
+                try:
+                    self._module = importlib.import_module(module_path)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    print(f"[Plugin] ✅ 已导入 {self.name}（{elapsed:.0f} ms）")
+                except Exception as e:
+                    # 导入失败不再重试，与原先启动时加载失败的行为一致
+                    self._import_failed = True
+                    print(f"[Plugin] ❌ 加载失败 {self.name}: {e}")
+            func = getattr(self._module, capability, None) if self._module else None
+            if self._module is not None and func is None:
+                print(f"[Plugin] {self.name} 缺少 {capability} 函数")
+            self._callables[capability] = func
+            return func
+
+    def register(self, capability, func):
+        with self._lock:
+            self._callables[capability] = func
+        if self.capabilities is not None and capability not in self.capabilities:
+            self.capabilities = self.capabilities + [capability]
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "capabilities": self.capabilities,
+            "sizes": self.sizes,
+            "aspect_ratios": self.aspect_ratios,
+            "concurrency": get_plugin_concurrency(self.name),
+            "imported": self._module is not None,
+        }
+
+
+def _read_manifest(plugin_dir: Path):
+    manifest_path = plugin_dir / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[Plugin] manifest 读取失败 {manifest_path}: {e}")
+        return None
 
 
 def load_plugins():
-    global _loaded_plugins
-    _loaded_plugins = {}
+    """发现插件（只读取 manifest，不导入模块）。可重复调用以重新扫描"""
+    global _plugins
+    plugins = {}
 
     # 从 .env 读取启用的插件列表
     enabled_str = os.getenv("PLUGIN_ENABLED", "").strip()
@@ -46,8 +182,8 @@ def load_plugins():
         if plugin_name.startswith("__"):
             continue
 
-        # 默认跳过 example 插件，除非显式启用
-        if plugin_name == "example" and (
+        # 默认跳过 example / example_async 等示例插件，除非显式启用
+        if plugin_name.startswith("example") and (
             enabled_set is None or plugin_name not in enabled_set
         ):
             if enabled_set is not None:
@@ -59,46 +195,139 @@ def load_plugins():
             print(f"[Plugin] 跳过未启用的插件: {plugin_name}")
             continue
 
-        # 尝试加载 plugin.py
-        module_path = f"plugins.{plugin_name}.plugin"
-        try:
-            module = importlib.import_module(module_path)
+        manifest = _read_manifest(item)
+        if manifest is None and not (item / "plugin.py").exists():
+            continue
+        plugins[plugin_name] = PluginSpec(plugin_name, manifest)
+
+    print(f"[Plugin] 发现插件: {sorted(plugins)}")
+    with _plugins_lock:
+        _plugins = plugins
+    return plugins
+
 
-            if not hasattr(module, "generate_images"):
-                print(f"[Plugin] 跳过 {plugin_name}：缺少 generate_images 函数")
-                continue
+def _get_plugins() -> dict:
+    if _plugins is None:
+        with _discover_lock:
+            if _plugins is None:
+                load_plugins()
+    return _plugins
 
-            _loaded_plugins[plugin_name] = module.generate_images
-            print(f"[Plugin] ✅ 成功加载: {plugin_name}")
 
-        except Exception as e:
-            print(f"[Plugin] ❌ 加载失败 {plugin_name}: {e}")
+def get_plugin_spec(name):
+    return _get_plugins().get(name)
 
 
-def get_plugin(name):
-    """根据插件名返回 generate_images 函数，若不存在返回 None"""
-    return _loaded_plugins.get(name)
+def get_plugin(name, capability="generate_images"):
+    """根据插件名返回能力对应的函数（默认 generate_images），若不存在返回 None"""
+    spec = get_plugin_spec(name)
+    return spec.resolve(capability) if spec else None
+
+
+def plugin_supports(name, capability, size=None, aspect_ratio=None) -> bool:
+    """插件是否声明支持该能力和参数（不导入模块）"""
+    spec = get_plugin_spec(name)
+    return spec is not None and spec.supports(capability, size, aspect_ratio)
+
+
+def register_plugin(name, generate_images):
+    """在运行时注册插件（如基准测试用的桩插件），同名插件的 generate_images 会被替换"""
+    plugins = _get_plugins()
+    with _plugins_lock:
+        spec = plugins.get(name)
+        if spec is None:
+            spec = plugins[name] = PluginSpec(name, {"capabilities": []})
+    spec.register("generate_images", generate_images)
 
 
 def list_plugin_names():
-    """返回当前已加载的插件名列表"""
-    return list(_loaded_plugins.keys())
+    """返回当前已发现的插件名列表"""
+    return list(_get_plugins().keys())
+
+
+def list_plugins():
+    """返回所有插件的元数据，供 /plugins 使用"""
+    return [spec.to_dict() for spec in _get_plugins().values()]
+
+
+def get_face_swap_plugin_name():
+    """FACE_SWAP_PLUGIN 配置的换脸插件名（未配置时为空字符串）"""
+    return os.getenv("FACE_SWAP_PLUGIN", "").strip()
 
 
 def get_face_swap_plugin():
     """返回指定的换脸插件函数（从 FACE_SWAP_PLUGIN 配置读取）"""
-    plugin_name = os.getenv("FACE_SWAP_PLUGIN", "").strip()
+    plugin_name = get_face_swap_plugin_name()
     if not plugin_name:
         return None
-    func = _loaded_plugins.get(plugin_name)
-    if func is None:
+    if get_plugin_spec(plugin_name) is None:
         print(f"[FaceSwap] 插件未加载或不存在: {plugin_name}")
         return None
     # 注意：换脸插件必须实现 `swap_face(source_url, face_url)` 函数
-    # 我们假设插件模块有一个 `swap_face` 函数（而不是 generate_images）
-    try:
-        module = importlib.import_module(f"plugins.{plugin_name}.plugin")
-        return getattr(module, "swap_face", None)
-    except Exception as e:
-        print(f"[FaceSwap] 获取 swap_face 函数失败: {e}")
-        return None
+    return get_plugin(plugin_name, "swap_face")
+
+
+def get_plugin_concurrency(name):
+    """返回插件允许的最大并发调用数（.env 配置优先，其次 manifest）"""
+    if name in PLUGIN_CONCURRENCY:
+        return PLUGIN_CONCURRENCY[name]
+    spec = get_plugin_spec(name)
+    if spec is not None and spec.concurrency:
+        return max(1, int(spec.concurrency))
+    return PLUGIN_DEFAULT_CONCURRENCY
+
+
+def _get_semaphore(name) -> asyncio.BoundedSemaphore:
+    # 名额由共享事件循环上的信号量管理，同步和异步调用方共用同一组名额
+    with _semaphores_lock:
+        sem = _plugin_semaphores.get(name)
+        if sem is None:
+            sem = asyncio.BoundedSemaphore(get_plugin_concurrency(name))
+            _plugin_semaphores[name] = sem
+        return sem
+
+
+async def acquire_plugin_slot(name):
+    """
+    在共享事件循环内占用插件的一个并发名额（名额用尽时等待，不占用线程），
+    返回释放函数。释放函数需要在共享循环上调用，可以挂在调用插件的 future 的
+    done-callback 上：同步插件的适配线程跑完之前名额一直被占用，即使等待结果的
+    协程已经被取消（hedge / race 中落败的调用）。
+    """
+    sem = _get_semaphore(name)
+    start = time.perf_counter()
+    await sem.acquire()
+    token = None
+    if coordinator is not None:
+        # 多 worker 部署：进程内名额之外再占用所有 worker 共享的名额
+        try:
+            token = await coordinator.acquire_async(
+                f"plugin:{name}", get_plugin_concurrency(name)
+            )
+        except BaseException:
+            sem.release()
+            raise
+    QUEUE_WAIT.observe(time.perf_counter() - start, f"plugin:{name}")
+
+    def release():
+        if token is not None:
+            get_loop().run_in_executor(None, coordinator.release, token)
+        sem.release()
+
+    return release
+
+
+def call_plugin_in_slot(name, func, *args, **kwargs):
+    """
+    在同步代码中（如 /swap_face）占用插件名额后调用插件，名额用尽时阻塞等待；
+    与调度器共用同一份名额，保证不超过服务商的限流
+    """
+
+    async def call():
+        release = await acquire_plugin_slot(name)
+        try:
+            return await call_plugin_async(func, *args, **kwargs)
+        finally:
+            release()
+
+    return run_coroutine(call())
@@ -7,6 +7,9 @@
 插件必须实现：
     generate_images(image_urls, prompt, size="2K", ar="auto") -> list[str]
 
+同目录下的 manifest.json 声明插件能力（generate_images / swap_face）、
+支持的尺寸与长宽比、并发上限；主程序只读取 manifest，第一次调用时才导入本模块。
+
 环境变量：
     示例中不需要密钥，但真实插件应在 .env 中配置。
 """
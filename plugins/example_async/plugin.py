@@ -0,0 +1,66 @@
+"""
+异步示例插件：与 plugins/example 功能相同，但入口是 async def。
+
+async 插件在主程序的共享事件循环上执行，等待服务商处理（轮询、sleep）期间
+不占用任何线程，因此可以把 manifest.json 中的 concurrency 设得较高。
+
+插件必须实现：
+    async def generate_images(image_urls, prompt, size="2K", ar="auto") -> list[str]
+
+注意：
+    - 不要在 async 函数里直接调用阻塞函数（requests、time.sleep），否则会卡住整个事件循环；
+      应使用异步 HTTP 客户端（如 aiohttp、httpx.AsyncClient）和 asyncio.sleep
+    - 没有异步客户端时，可以用 asyncio.to_thread() 包装单次阻塞调用（如下例）
+"""
+
+import asyncio
+from urllib.parse import urlencode
+
+import requests
+
+PLUGIN_NAME = "example_async"
+POLL_INTERVAL = 1.0  # 轮询间隔（秒）
+POLL_TIMES = 3  # 示例中模拟的轮询次数
+
+
+async def generate_images(image_urls, prompt, size="2K", ar="auto"):
+    """
+    插件主入口（异步）。
+
+    Args:
+        image_urls (list[str]): 已由主程序上传到外网的图片 URL 列表（如 ImgBB）
+        prompt (str): 用户输入的文本提示
+        size (str): 分辨率，如 "2K", "4K"
+        ar (str): 宽高比，如 "16:9", "1:1", "auto"
+
+    Returns:
+        list[str]: 成功生成的图片 URL 列表（可被浏览器直接访问），失败返回 []
+    """
+    print(f"[{PLUGIN_NAME}] 收到请求: prompt='{prompt}', size={size}, ar={ar}")
+
+    try:
+        width, height = 1920, 1080  # 默认 2K
+        if size == "4K":
+            width, height = 3840, 2160
+        if ar == "1:1":
+            height = width
+
+        # === 示例逻辑：模拟“提交任务 → 轮询状态” ===
+        # 真实插件在这里提交任务拿到 task_id，然后每隔 POLL_INTERVAL 查询一次；
+        # await asyncio.sleep 期间事件循环可以处理其他插件调用
+        for _ in range(POLL_TIMES):
+            await asyncio.sleep(POLL_INTERVAL)
+
+        params = urlencode({"w": width, "h": height, "random": hash(prompt) % 1000})
+        placeholder_url = f"https://picsum.photos/{width}/{height}?{params}"
+
+        # 没有异步 HTTP 客户端时，用 to_thread 包装阻塞调用
+        resp = await asyncio.to_thread(requests.head, placeholder_url, timeout=5)
+        if resp.status_code == 200:
+            print(f"[{PLUGIN_NAME}] 返回示例图: {placeholder_url}")
+            return [placeholder_url]
+        print(f"[{PLUGIN_NAME}] 占位图不可用")
+    except Exception as e:
+        print(f"[{PLUGIN_NAME}] 插件异常: {e}")
+
+    return []
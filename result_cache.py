@@ -0,0 +1,179 @@
+"""
+生成结果缓存（默认关闭）。
+
+同样的提示词 + 参考图 + 分辨率 + 长宽比重复提交时（页面刷新后重试、双击等），
+直接返回之前保存的本地结果图，不再调用付费且耗时的插件：
+
+- 键：规范化后的提示词、各参考图的内容哈希、size、aspect_ratio
+- 内存 LRU，最多 RESULT_CACHE_MAX_ENTRIES 条，超过 RESULT_CACHE_TTL 秒过期
+- 结果图已被删除（如删除了对应历史记录）时视为未命中
+- 同时到达的相同请求只调用一次插件，其余等待同一个结果
+- 请求带 force_refresh 时跳过缓存重新生成（结果会覆盖旧条目），也不等待进行中的
+  相同请求（它的结果可能正是要替换的那个）；之后到达的相同请求等待刷新后的结果
+
+配置（.env）：
+    RESULT_CACHE_ENABLED      是否启用，默认 0
+    RESULT_CACHE_MAX_ENTRIES  最多缓存条数，默认 1000
+    RESULT_CACHE_TTL          有效期（秒），0 表示永不过期，默认 86400
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from history_layout import actual_path
+from upload_cache import file_digest
+
+load_dotenv()
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "0") == "1"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+
+
+@lru_cache(maxsize=4096)
+def _input_digest(local_path: str) -> str:
+    # history/inputs 下的文件写入后不再修改，按路径记住哈希即可
+    return file_digest(local_path)
+
+
+def result_cache_key(prompt, image_urls, local_input_paths, size, aspect_ratio):
+    """
+    计算缓存键。参考图优先使用本地文件的内容哈希（同一张图每次上传的文件名不同），
+    本地文件不可用时退回外部 URL。
+    """
+    inputs = []
+    for i, url in enumerate(image_urls or []):
+        local = local_input_paths[i] if i < len(local_input_paths or []) else None
+        digest = None
+        if local:
+            try:
+                # 平铺 URL 与迁移后的分片路径指向同一个文件，哈希相同
+                digest = _input_digest(actual_path(local))
+            except OSError:
+                pass
+        inputs.append(digest or f"url:{url}")
+    raw = json.dumps(
+        [" ".join((prompt or "").split()), inputs, size, aspect_ratio],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """键 → 生成结果（run_generate_job 的返回值）的 LRU 缓存，带请求合并"""
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (created_at, result)
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _files_exist(result) -> bool:
+        return all(
+            os.path.exists(actual_path(path)) for path in result.get("result_urls", [])
+        )
+
+    def _evict(self, key, entry):
+        """移除失效的条目（调用方需持有 self._lock；条目已被替换时不动）"""
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+            self.evictions += 1
+
+    def _lookup(self, key):
+        """返回有效的缓存结果；结果图是否存在在锁外检查，不让磁盘 I/O 阻塞其他请求"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.time() - entry[0] > self.ttl:
+                self._evict(key, entry)
+                return None
+
+        files_exist = self._files_exist(entry[1])
+        with self._lock:
+            if not files_exist:
+                self._evict(key, entry)
+                return None
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[1]
+
+    def get_or_compute(self, key, compute, force_refresh=False):
+        """
+        返回 (result, source)，source 为 hit / coalesced / miss。
+        未命中时由第一个请求执行 compute()，同时到达的相同请求等待它的结果。
+        force_refresh 时总是重新执行 compute()，不合并到进行中的请求。
+        """
+        while True:
+            if not force_refresh:
+                result = self._lookup(key)
+                if result is not None:
+                    return result, "hit"
+            with self._lock:
+                if not force_refresh and key in self._entries:
+                    continue  # 锁外检查期间有相同请求写入了结果，重新检查
+                future = None if force_refresh else self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    # 强制刷新替换进行中的请求：之后到达的请求等待新的结果
+                    future = self._inflight[key] = Future()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+                break
+
+        if not owner:
+            return future.result(), "coalesced"
+
+        try:
+            result = compute()
+        except BaseException as e:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            # 期间被强制刷新替换时，以刷新的结果为准，不覆盖缓存
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                self._entries[key] = (time.time(), result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        future.set_result(result)
+        return result, "miss"
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": True,
+                "entries": len(self._entries),
+                "inflight": len(self._inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+            }
+
+
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
@@ -466,7 +466,10 @@ document
 
     const tempCanvas = document.createElement("canvas");
     const tempCtx = tempCanvas.getContext("2d");
-    let dataUrls = [];
+    // 以二进制 JPEG Blob 上传（比 base64 JSON 小约 1/3，后端无需重新编码）
+    const toJpegBlob = () =>
+      new Promise((resolve) => tempCanvas.toBlob(resolve, "image/jpeg", 0.92));
+    let blobs = [];
 
     if (cropState.mode === "quadrants") {
       const iw = cropState.imgWidth;
@@ -489,7 +492,7 @@ document
         tempCanvas.height = cropH;
         tempCtx.clearRect(0, 0, cropW, cropH);
         tempCtx.drawImage(img, -x, -y, iw, ih);
-        dataUrls.push(tempCanvas.toDataURL("image/jpeg", 0.92));
+        blobs.push(await toJpegBlob());
       }
     } else if (cropState.mode === "free") {
       const { x, y, width, height } = cropState.free;
@@ -508,15 +511,18 @@ document
         cropState.imgWidth,
         cropState.imgHeight,
       );
-      dataUrls.push(tempCanvas.toDataURL("image/jpeg", 0.92));
+      blobs.push(await toJpegBlob());
     }
 
     // 保存到后端
     try {
+      const formData = new FormData();
+      blobs.forEach((blob, idx) => {
+        formData.append("images", blob, `crop_${idx}.jpg`);
+      });
       let resp = await fetch("/save-cropped-images", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ images: dataUrls }),
+        body: formData,
       });
       let result = await resp.json();
       if (!result.success) throw new Error("Save failed");
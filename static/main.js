@@ -38,9 +38,56 @@
     $("#promptPreview").text(text || "（提示词为空）");
   }
 
+  // ===== 任务跟踪 =====
+  // 优先通过 SSE（/jobs/<id>/events）等待任务结束，不支持或断开时退回轮询 /jobs/<id>
+  function waitForJob(jobId) {
+    return new Promise((resolve, reject) => {
+      let settled = false;
+      const finish = (job) => {
+        if (settled) return;
+        settled = true;
+        if (job.status === "succeeded") resolve(job.result);
+        else reject(new Error(job.error || "生成失败"));
+      };
+
+      const poll = () => {
+        $.get(`/jobs/${jobId}`)
+          .done((job) => {
+            if (job.status === "succeeded" || job.status === "failed") {
+              finish(job);
+            } else if (!settled) {
+              setTimeout(poll, 2000);
+            }
+          })
+          .fail((xhr) => {
+            settled = true;
+            reject(new Error(xhr.responseJSON?.error || "任务查询失败"));
+          });
+      };
+
+      if (!window.EventSource) {
+        poll();
+        return;
+      }
+
+      const source = new EventSource(`/jobs/${jobId}/events`);
+      ["succeeded", "failed"].forEach((type) => {
+        source.addEventListener(type, (e) => {
+          source.close();
+          const data = JSON.parse(e.data);
+          finish({ status: type, result: data.result, error: data.error });
+        });
+      });
+      source.onerror = () => {
+        source.close();
+        if (!settled) poll();
+      };
+    });
+  }
+
   // ===== 生成图片 =====
   let isGenerating = false;
-  $("#generateBtn").click(function () {
+  $("#generateBtn").click(function (e) {
     if (isGenerating) return;
     const prompt = $("#promptPreview").text().trim();
     if (!prompt || prompt === "（提示词为空）") {
@@ -61,9 +108,13 @@
         prompt: prompt,
         size: $("#resolution").val(),
         aspect_ratio: $("#aspectRatio").val(),
+        // 按住 Shift 点击：跳过结果缓存，强制重新生成
+        force_refresh: e.shiftKey,
       }),
-      success: function (res) {
-        if (res.success) {
+    })
+      .then((res) => waitForJob(res.job_id))
+      .then(
+        function (res) {
           let html = "";
           res.result_urls.forEach((url) => {
             html += `
@@ -77,19 +128,17 @@
           });
           $("#generatedPreview").html(html);
           loadHistoryPage(1);
-        } else {
-          alert("生成失败: " + (res.error || "未知错误"));
-        }
-      },
-      error: function (xhr) {
-        const err = xhr.responseJSON?.error || "请求失败";
-        alert("生成错误: " + err);
-      },
-      complete: function () {
+        },
+        function (err) {
+          // jQuery 请求失败时为 xhr，任务失败时为 Error
+          const msg = err.responseJSON?.error || err.message || "请求失败";
+          alert("生成错误: " + msg);
+        },
+      )
+      .always(function () {
         isGenerating = false;
         $("#generateBtn").prop("disabled", false).text("生成图片");
-      },
-    });
+      });
   });
 
   // ===== 历史记录 =====
@@ -98,7 +147,7 @@
     if (item.input_paths && item.input_paths.length > 0) {
       inputHtml = '<h5>输入参考图：</h5><div class="d-flex flex-wrap gap-2">';
       item.input_paths.forEach((url) => {
-        inputHtml += `<a href="${url}" data-lightbox="inputs-${item.id}"><img src="${url}" style="width:60px;height:60px;object-fit:cover;"></a>`;
+        inputHtml += `<a href="${url}" data-lightbox="inputs-${item.id}"><img src="${thumbUrl(url)}" style="width:60px;height:60px;object-fit:cover;"></a>`;
       });
       inputHtml += "</div>";
     }
@@ -139,7 +188,9 @@
       function (data) {
         let html = "";
         data.records.forEach((item) => {
-          const url = item.result_paths[0] || "";
+          // 画廊小图使用缩略图，拖拽/编辑仍使用原图路径
+          const url =
+            item.result_thumbs?.["256"]?.[0] || item.result_paths[0] || "";
           html += `
             <div class="col-6 col-sm-4 col-md-2 mb-3">
               <div class="card history-card" data-item='${JSON.stringify(item).replace(/'/g, "&#39;")}'>
@@ -411,7 +462,7 @@
         inputHtml =
           '<h5 class="mt-3">输入参考图：</h5><div class="d-flex flex-wrap gap-2">';
         item.input_paths.forEach((url) => {
-          inputHtml += `<img src="${url}" style="width:50px;height:50px;object-fit:cover;">`;
+          inputHtml += `<img src="${thumbUrl(url)}" style="width:50px;height:50px;object-fit:cover;">`;
         });
         inputHtml += "</div>";
       }
@@ -439,7 +490,7 @@
               <div class="modal-body">
                 <div class="text-center mb-3">
                   <a href="${resultLocalPath}" data-lightbox="history-detail">
-                    <img src="${resultLocalPath}" class="img-fluid rounded" style="max-height:400px;">
+                    <img src="${thumbUrl(resultLocalPath, 768)}" class="img-fluid rounded" style="max-height:400px;">
                   </a>
                 </div>
                 <div>${paramsText}</div>
@@ -609,6 +660,8 @@
           const blob = await resp.blob();
           const formData = new FormData();
           formData.append("file", blob, "reference.jpg");
+          formData.append("size", $("#resolution").val() || "");
+          formData.append("aspect_ratio", $("#aspectRatio").val() || "");
 
           const uploadRes = await fetch("/quick-upload", {
             method: "POST",
@@ -498,7 +498,7 @@ window.QuickAccess = (function () {
       return `
       <div class="quick-img-item position-relative border rounded d-flex justify-content-center align-items-center"
            style="width:120px;height:120px;cursor:pointer;" title="${title || "点击加入参考图"}">
-        <img src="${img.localPath || img.remoteUrl}" style="width:100%;height:100%;object-fit:contain;">
+        <img src="${thumbUrl(img.localPath) || img.remoteUrl}" style="width:100%;height:100%;object-fit:contain;">
         ${titleDisplay}
         <div class="dropdown" style="position:absolute;top:-8px;right:-8px;">
           <button class="btn btn-sm btn-dark dropdown-toggle" type="button" data-bs-toggle="dropdown" style="width:20px;height:20px;padding:0;font-size:10px;line-height:1;">⋮</button>
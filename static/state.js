@@ -1,5 +1,12 @@
 // state.js
 
+// 本地历史图片 → 缩略图 URL（与后端 thumbnails.py 的目录规则一致）
+// 如 /history/results/x.jpg → /history/thumbs/256/results/x.jpg；其他 URL 原样返回
+function thumbUrl(url, size = 256) {
+  const m = /^\/history\/((?:inputs|results)\/.+)$/.exec(url || "");
+  return m ? `/history/thumbs/${size}/${m[1]}` : url;
+}
+
 // 全局提示函数
 function showToast(message, type = "info", delay = 0) {
   // type: 'success', 'error', 'warning', 'info'
@@ -103,6 +103,7 @@
     });
 
     $("#saveStoryboardBtn").click(saveStoryboard);
+    $("#generateStoryboardBtn").click(generateAllPanels);
   }
 
   // 清空当前故事板，开始新的
@@ -172,7 +173,7 @@
             : panel.images
                 .map(
                   (url, idx) =>
-                    `<a href="${url}" data-lightbox="panel-${panel.panel_id}" style="position:absolute; top:0; left:0; width:90%; height:90%; " class="panel-image-stack-link"><img src="${url}"  class="panel-image-stack" style="z-index:${panel.images.length - idx}"></a>`,
+                    `<a href="${url}" data-lightbox="panel-${panel.panel_id}" style="position:absolute; top:0; left:0; width:90%; height:90%; " class="panel-image-stack-link"><img src="${thumbUrl(url, 768)}"  class="panel-image-stack" style="z-index:${panel.images.length - idx}"></a>`,
                 )
                 .join("");
 
@@ -223,7 +224,7 @@
       await new Promise((resolve, reject) => {
         img.onload = () => resolve();
         img.onerror = () => reject(new Error("加载参考图失败"));
-        img.src = firstImageUrl;
+        img.src = thumbUrl(firstImageUrl, 768);
       });
 
       const aspectRatio = img.naturalWidth / img.naturalHeight;
@@ -287,6 +288,8 @@
     for (const file of files) {
       const formData = new FormData();
       formData.append("file", file);
+      formData.append("size", $("#resolution").val() || "");
+      formData.append("aspect_ratio", $("#aspectRatio").val() || "");
       const resp = await fetch("/quick-upload", {
         method: "POST",
         body: formData,
@@ -344,6 +347,7 @@
         description: p.description,
         camera_movement: p.cameraMovement,
         camera_note: p.cameraNote,
+        reference_images: p.reference_images, // 整板生成前的原始参考图
       })),
     };
 
@@ -362,6 +366,7 @@
         window.shouldHighlightNewRecords = true;
 
         loadStoryboardListIntoDropdown();
+        return true;
         // document.querySelector('button[data-bs-target="#quick-gen"]').click();
       } else {
         throw new Error(result.error || "保存失败");
@@ -370,6 +375,65 @@
       console.error(err);
       showToast("保存失败：" + err.message, "error", 5000);
     }
+    return false;
+  }
+
+  // ===== 整板生成 =====
+  // 先保存，再让后端并行生成所有有描述的分镜；每个分镜完成后结果已写回故事板，这里同步到界面
+  async function generateAllPanels() {
+    const btn = $("#generateStoryboardBtn");
+    if (btn.prop("disabled")) return;
+    if (!(await saveStoryboard())) return;
+
+    btn.prop("disabled", true).text("生成中...");
+    const done = () => btn.prop("disabled", false).text("生成全部分镜");
+    try {
+      const resp = await fetch("/generate-storyboard", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          storyboard_id: storyboardState.currentId,
+          size: $("#resolution").val(),
+          aspect_ratio: $("#aspectRatio").val(),
+        }),
+      });
+      const res = await resp.json();
+      if (!resp.ok) throw new Error(res.error || "提交失败");
+
+      const source = new EventSource(`/jobs/${res.job_id}/events`);
+      source.addEventListener("panel_done", (e) => {
+        const data = JSON.parse(e.data);
+        if (data.images) {
+          updatePanel(data.panel_id, {
+            images: data.images,
+            reference_images: data.reference_images,
+          });
+        }
+        renderPanels();
+        applyUniformAspectRatio();
+      });
+      source.addEventListener("panel_failed", (e) => {
+        const data = JSON.parse(e.data);
+        showToast(`分镜 ${data.panel + 1} 生成失败：${data.error}`, "error", 5000);
+      });
+      ["succeeded", "failed"].forEach((type) => {
+        source.addEventListener(type, (e) => {
+          source.close();
+          done();
+          const data = JSON.parse(e.data);
+          if (type === "succeeded") showToast("整板生成完成", "success", 5000);
+          else showToast("整板生成失败：" + data.error, "error", 5000);
+          window.shouldHighlightNewRecords = true;
+        });
+      });
+      source.onerror = () => {
+        source.close();
+        done();
+      };
+    } catch (err) {
+      done();
+      showToast("整板生成失败：" + err.message, "error", 5000);
+    }
   }
 
   async function switchToStoryboard(id) {
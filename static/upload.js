@@ -231,6 +231,9 @@
 
     const formData = new FormData();
     convertedFiles.forEach((f) => formData.append("images", f));
+    // 服务端按生成分辨率和长宽比缩小外部上传的副本（本地仍保存原图）
+    formData.append("size", $("#resolution").val() || "");
+    formData.append("aspect_ratio", $("#aspectRatio").val() || "");
 
     const xhr = new XMLHttpRequest();
     xhr.open("POST", "/upload-images", true);
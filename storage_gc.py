@@ -0,0 +1,367 @@
+"""
+history/inputs、history/results 的存储回收（GC）与磁盘配额。
+
+引用集合 = 历史索引中所有记录引用的本地图片（record_paths）
+         + STORYBOARD_DIR 下所有故事板 JSON 中出现的 history/ 路径
+（平铺 URL 与迁移到分片目录后的文件按 history_layout.logical_path() 视为同一张图片）
+
+每次运行：
+1. 分批扫描 inputs/、results/（每批之间暂停，不长时间占用磁盘和 CPU）
+2. 未被引用、且修改时间早于 GC_GRACE_DAYS 的文件列为孤儿
+3. 设置了 GC_QUOTA_MB 且删除孤儿后仍超出配额时，按最近访问时间（atime，
+   不早于 mtime）从旧到新继续淘汰未被引用的文件（不受宽限期限制，但至少
+   存在 GC_MIN_AGE 秒）；GC_EVICT_REFERENCED=1 时被引用的文件也会被淘汰
+   （对应历史记录保留，但图片不再可用）
+4. 分批删除，每批删除前重新检查运行期间新写入的记录和改动过的故事板
+5. 删除原图已不存在的缩略图
+
+dry-run 只生成报告不删除。前端 localStorage 中的快捷访问图片不在引用集合内，
+超过宽限期后可能被回收。atime 依赖文件系统挂载选项（relatime 下每天最多更新一次）。
+
+多 worker 部署时通过 history/.gc.lock 保证同一时间只有一个进程在运行。
+
+手动运行：
+    python storage_gc.py            # dry-run，输出报告
+    python storage_gc.py --delete   # 实际删除
+
+配置（.env）：
+    GC_INTERVAL          后台自动运行间隔（秒），0 表示不自动运行，默认 0
+    GC_GRACE_DAYS        未被引用的文件保留多少天，默认 7
+    GC_QUOTA_MB          inputs + results 总大小上限（MB），0 表示不限制，默认 0
+    GC_MIN_AGE           配额淘汰时文件至少存在多久（秒），默认 3600
+    GC_EVICT_REFERENCED  配额不足时是否淘汰被引用的文件，默认 0
+    GC_BATCH_SIZE        每批扫描 / 删除的文件数，默认 500
+    GC_BATCH_PAUSE       每批之间暂停（秒），默认 0.05
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from coordination import file_lock, is_helper_process
+from history_layout import logical_path, resolve
+from thumbnails import HISTORY_DIR, SOURCE_SUBDIRS, THUMB_DIR, remove_thumbnails
+
+load_dotenv()
+
+GC_INTERVAL = int(os.getenv("GC_INTERVAL", "0"))
+GC_GRACE_DAYS = float(os.getenv("GC_GRACE_DAYS", "7"))
+GC_QUOTA_MB = int(os.getenv("GC_QUOTA_MB", "0"))
+GC_MIN_AGE = int(os.getenv("GC_MIN_AGE", "3600"))
+GC_EVICT_REFERENCED = os.getenv("GC_EVICT_REFERENCED", "0") == "1"
+GC_BATCH_SIZE = int(os.getenv("GC_BATCH_SIZE", "500"))
+GC_BATCH_PAUSE = float(os.getenv("GC_BATCH_PAUSE", "0.05"))
+
+STORYBOARD_DIR = os.getenv("STORYBOARD_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "storyboards"
+)
+GC_LOCK_PATH = HISTORY_DIR / ".gc.lock"
+# 报告中最多列出的文件数
+REPORT_SAMPLE = 50
+
+
+def _normalize(path):
+    """
+    '/history/inputs/x.jpg' → 'history/inputs/x.jpg'（统一分隔符，去掉分片目录，
+    平铺 URL 与分片后的实际文件对应同一个值）；非本地路径返回 None
+    """
+    if not isinstance(path, str) or path.startswith(("http://", "https://", "data:")):
+        return None
+    rel = logical_path(path.replace("\\", "/").split("?", 1)[0].lstrip("/"))
+    return rel if rel.startswith(HISTORY_DIR.as_posix() + "/") else None
+
+
+def _collect_paths(value, out: set):
+    """递归收集 JSON 中所有 history/ 下的路径（不依赖故事板的具体字段）"""
+    if isinstance(value, dict):
+        for item in value.values():
+            _collect_paths(item, out)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_paths(item, out)
+    else:
+        rel = _normalize(value)
+        if rel:
+            out.add(rel)
+
+
+class StoryboardReferences:
+    """
+    STORYBOARD_DIR 下所有故事板引用的 history/ 图片，按文件 mtime 增量刷新
+    （只重新解析改动过的故事板）。回收和删除历史记录共用，线程安全。
+    """
+
+    def __init__(self, storyboard_dir):
+        self.storyboard_dir = storyboard_dir
+        self._files = {}  # 文件名 -> (mtime_ns, 引用的路径)
+        self._lock = threading.Lock()
+
+    def refresh(self) -> set:
+        """重新扫描目录，返回当前所有故事板引用的路径（logical_path 形式）"""
+        with self._lock:
+            try:
+                entries = [
+                    entry
+                    for entry in os.scandir(self.storyboard_dir)
+                    if entry.name.endswith(".json") and not entry.name.startswith(".")
+                ]
+            except OSError:
+                entries = []
+            files = {}
+            for entry in entries:
+                try:
+                    mtime_ns = entry.stat().st_mtime_ns
+                except OSError:
+                    continue
+                cached = self._files.get(entry.name)
+                if cached and cached[0] == mtime_ns:
+                    files[entry.name] = cached
+                    continue
+                refs = set()
+                try:
+                    with open(entry.path, "r", encoding="utf-8") as f:
+                        _collect_paths(json.load(f), refs)
+                except (OSError, ValueError) as e:
+                    print(f"[Storage GC] 读取故事板失败 {entry.path}: {e}")
+                files[entry.name] = (mtime_ns, refs)
+            self._files = files
+            return set().union(*(refs for _, refs in files.values()))
+
+    def referenced(self, paths) -> set:
+        """paths 中被故事板引用的那些（平铺 URL 和分片路径视为同一张图片）"""
+        refs = self.refresh()
+        return {path for path in paths if _normalize(path) in refs}
+
+
+class _References:
+    """引用集合；refresh() 只重新读取运行期间新写入的记录和改动过的故事板"""
+
+    def __init__(self, history_index, storyboards: StoryboardReferences):
+        self.history_index = history_index
+        self.storyboards = storyboards
+        self._since = time.time()
+        self.paths = {
+            rel for rel in map(_normalize, history_index.referenced_paths()) if rel
+        }
+        self.paths |= storyboards.refresh()
+
+    def refresh(self):
+        since, self._since = self._since, time.time()
+        for path in self.history_index.referenced_paths(since=since - 1):
+            rel = _normalize(path)
+            if rel:
+                self.paths.add(rel)
+        # 只增不减：运行期间从故事板中移除的图片留到下次回收
+        self.paths |= self.storyboards.refresh()
+
+    def __contains__(self, rel):
+        return logical_path(rel) in self.paths
+
+
+def _scan_files():
+    """分批产出 inputs/、results/ 下的文件：(相对路径, 大小, mtime, atime)"""
+    batch = []
+    for subdir in SOURCE_SUBDIRS:
+        for root, dirs, files in os.walk(HISTORY_DIR / subdir):
+            dirs.sort()
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                batch.append(
+                    (Path(path).as_posix(), st.st_size, st.st_mtime, st.st_atime)
+                )
+                if len(batch) >= GC_BATCH_SIZE:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def _sample(files):
+    return [
+        {"path": f"/{rel}", "size": size, "mtime": mtime, "atime": atime}
+        for rel, size, mtime, atime in files[:REPORT_SAMPLE]
+    ]
+
+
+class StorageGC:
+    def __init__(self, history_index, storyboard_dir=STORYBOARD_DIR):
+        self.history_index = history_index
+        self.storyboards = StoryboardReferences(storyboard_dir)
+        self.state = {"running": False, "last_report": None}
+        self._lock = threading.Lock()
+
+    def run(self, dry_run=True) -> dict:
+        """执行一次回收并返回报告；已有回收在运行（包括其他 worker）时返回 None"""
+        with self._lock:
+            if self.state["running"]:
+                return None
+            self.state["running"] = True
+        try:
+            with file_lock(GC_LOCK_PATH, blocking=False) as acquired:
+                if not acquired:
+                    return None
+                report = self._run(dry_run)
+            self.state["last_report"] = report
+            print(
+                f"[Storage GC] {'dry-run ' if dry_run else ''}完成: "
+                f"孤儿 {report['orphans']['count']} 个，配额淘汰 {report['evict']['count']} 个，"
+                f"释放 {report['freed_bytes']} 字节"
+            )
+            return report
+        finally:
+            self.state["running"] = False
+
+    def _run(self, dry_run) -> dict:
+        started = time.time()
+        refs = _References(self.history_index, self.storyboards)
+
+        files = []
+        for batch in _scan_files():
+            files.extend(batch)
+            time.sleep(GC_BATCH_PAUSE)
+        refs.refresh()
+        total_bytes = sum(f[1] for f in files)
+
+        grace_deadline = started - GC_GRACE_DAYS * 86400
+        orphans = [f for f in files if f[0] not in refs and f[2] < grace_deadline]
+
+        evict = []
+        quota = GC_QUOTA_MB * 1024 * 1024
+        remaining = total_bytes - sum(f[1] for f in orphans)
+        if quota and remaining > quota:
+            orphan_set = {f[0] for f in orphans}
+            min_age_deadline = started - GC_MIN_AGE
+            pool = [
+                f
+                for f in files
+                if f[0] not in orphan_set
+                and f[2] < min_age_deadline
+                and (GC_EVICT_REFERENCED or f[0] not in refs)
+            ]
+            # 最近访问时间：atime 不早于 mtime（noatime 挂载时退化为 mtime）
+            pool.sort(key=lambda f: max(f[2], f[3]))
+            for f in pool:
+                if remaining <= quota:
+                    break
+                evict.append(f)
+                remaining -= f[1]
+
+        deleted, skipped, freed = 0, 0, 0
+        if not dry_run:
+            targets = [(f, False) for f in orphans] + [(f, True) for f in evict]
+            for i in range(0, len(targets), GC_BATCH_SIZE):
+                refs.refresh()
+                for (rel, size, _, _), from_quota in targets[i : i + GC_BATCH_SIZE]:
+                    # 运行期间重新被引用的文件跳过（配额淘汰被引用文件时除外）
+                    if rel in refs and not (from_quota and GC_EVICT_REFERENCED):
+                        skipped += 1
+                        continue
+                    try:
+                        os.remove(rel)
+                    except FileNotFoundError:
+                        continue
+                    except OSError as e:
+                        print(f"[Storage GC] 删除失败 {rel}: {e}")
+                        continue
+                    remove_thumbnails(rel)
+                    deleted += 1
+                    freed += size
+                time.sleep(GC_BATCH_PAUSE)
+
+        stale_thumbs = self._sweep_thumbnails(dry_run)
+
+        return {
+            "dry_run": dry_run,
+            "started_at": started,
+            "seconds": round(time.time() - started, 3),
+            "scanned": len(files),
+            "total_bytes": total_bytes,
+            "referenced": len(refs.paths),
+            "grace_days": GC_GRACE_DAYS,
+            "orphans": {
+                "count": len(orphans),
+                "bytes": sum(f[1] for f in orphans),
+                "sample": _sample(orphans),
+            },
+            "quota_bytes": quota,
+            "evict": {
+                "count": len(evict),
+                "bytes": sum(f[1] for f in evict),
+                "sample": _sample(evict),
+            },
+            # 配额无法满足时（剩余文件都被引用或太新）仍超出的字节数
+            "over_quota_bytes": max(0, remaining - quota) if quota else 0,
+            "deleted": deleted,
+            "skipped_rereferenced": skipped,
+            "freed_bytes": freed,
+            "stale_thumbnails": stale_thumbs,
+        }
+
+    @staticmethod
+    def _sweep_thumbnails(dry_run) -> int:
+        """删除原图已不存在的缩略图，返回数量"""
+        count = 0
+        prefix_len = len(THUMB_DIR.parts) + 1  # thumbs/<尺寸>/
+        for root, _, files in os.walk(THUMB_DIR):
+            for name in files:
+                if name.endswith(".part"):
+                    continue  # 正在写入的临时文件，完成后会改名为缩略图
+                thumb = Path(root) / name
+                if resolve("/".join(thumb.parts[prefix_len:])):
+                    continue
+                count += 1
+                if not dry_run:
+                    thumb.unlink(missing_ok=True)
+        return count
+
+    def start(self, dry_run=True) -> bool:
+        """在后台线程中运行一次；已在运行时返回 False"""
+        if self.state["running"]:
+            return False
+        threading.Thread(
+            target=self.run, args=(dry_run,), name="storage-gc", daemon=True
+        ).start()
+        return True
+
+    def start_periodic(self, interval=GC_INTERVAL):
+        """每隔 interval 秒在后台执行一次实际删除（interval 为 0 时不启动）"""
+        if interval <= 0 or is_helper_process():
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.run(dry_run=False)
+                except Exception as e:
+                    print(f"[Storage GC] 运行失败: {e}")
+
+        threading.Thread(target=loop, name="storage-gc-periodic", daemon=True).start()
+
+    def status(self) -> dict:
+        return {
+            **self.state,
+            "interval": GC_INTERVAL,
+            "grace_days": GC_GRACE_DAYS,
+            "quota_mb": GC_QUOTA_MB,
+        }
+
+
+if __name__ == "__main__":
+    from history_index import HistoryIndex
+
+    delete = "--delete" in sys.argv[1:]
+    report = StorageGC(HistoryIndex(HISTORY_DIR)).run(dry_run=not delete)
+    if report is None:
+        print("[Storage GC] 已有回收在运行")
+        sys.exit(1)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,138 @@
+"""
+故事板目录（/list-storyboards 使用）。
+
+每个故事板 JSON 都包含完整的 panels，列表只需要 id/title/timestamp。
+本模块按文件的 (mtime, size) 缓存摘要：
+
+- save_storyboard 保存后直接调用 update()，无需重新解析
+- 其他途径修改的文件在 refresh() 时通过 os.scandir 的 stat 信息发现，
+  只重新解析有变化的文件
+- 摘要持久化到 STORYBOARD_DIR/.catalog.json，重启后无需全量解析
+"""
+
+import json
+import os
+import threading
+import time
+
+CATALOG_FILENAME = ".catalog.json"
+
+
+def _summarize(data: dict) -> dict:
+    return {
+        "id": data.get("id"),
+        "title": data.get("title", "未命名故事板"),
+        "timestamp": data.get("timestamp"),
+    }
+
+
+class StoryboardCatalog:
+    def __init__(self, directory: str, refresh_interval: float = 2.0):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.catalog_path = os.path.join(directory, CATALOG_FILENAME)
+        self._entries = {}  # 文件名 -> {"mtime_ns", "size", "summary"}
+        self._sorted = None  # 按时间倒序排好的摘要列表（缓存）
+        self._last_refresh = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.catalog_path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save(self):
+        """持久化摘要（调用方需持有 self._lock）"""
+        if not self._dirty:
+            return
+        tmp_path = f"{self.catalog_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.catalog_path)
+            self._dirty = False
+        except OSError as e:
+            print(f"[Storyboard Catalog] 保存失败: {e}")
+
+    def update(self, filepath: str, data: dict):
+        """save_storyboard 写入文件后调用，直接登记摘要"""
+        st = os.stat(filepath)
+        with self._lock:
+            self._entries[os.path.basename(filepath)] = {
+                "mtime_ns": st.st_mtime_ns,
+                "size": st.st_size,
+                "summary": _summarize(data),
+            }
+            self._sorted = None
+            self._dirty = True
+            self._save()
+
+    def refresh(self, force: bool = False):
+        """对比目录中文件的 (mtime, size)，只重新解析新增或变化的文件"""
+        with self._lock:
+            if not force and time.time() - self._last_refresh < self.refresh_interval:
+                return
+            seen = set()
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    name = entry.name
+                    if not name.endswith(".json") or name.startswith("."):
+                        continue
+                    seen.add(name)
+                    st = entry.stat()
+                    cached = self._entries.get(name)
+                    if (
+                        cached
+                        and cached["mtime_ns"] == st.st_mtime_ns
+                        and cached["size"] == st.st_size
+                    ):
+                        continue
+                    try:
+                        with open(entry.path, "r", encoding="utf-8") as fp:
+                            summary = _summarize(json.load(fp))
+                    except Exception:
+                        self._entries.pop(name, None)
+                        continue
+                    self._entries[name] = {
+                        "mtime_ns": st.st_mtime_ns,
+                        "size": st.st_size,
+                        "summary": summary,
+                    }
+                    self._sorted = None
+                    self._dirty = True
+
+            for name in set(self._entries) - seen:
+                del self._entries[name]
+                self._sorted = None
+                self._dirty = True
+
+            self._last_refresh = time.time()
+            self._save()
+
+    def list(self, query: str = "", offset: int = 0, limit: int = None):
+        """
+        按时间倒序返回 (摘要列表, 总数)，query 按标题做不区分大小写的包含匹配。
+        limit 为 None 时返回全部，否则必须 >= 1
+        """
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be >= 1")
+        self.refresh()
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(
+                    (entry["summary"] for entry in self._entries.values()),
+                    key=lambda x: x["timestamp"] or "",
+                    reverse=True,
+                )
+            items = self._sorted
+
+        if query:
+            query = query.lower()
+            items = [x for x in items if query in (x["title"] or "").lower()]
+        total = len(items)
+        end = None if limit is None else offset + limit
+        return items[offset:end], total
@@ -0,0 +1,314 @@
+"""
+故事板导出（/export-storyboard/<id>）。
+
+三种格式，均以生成器逐块输出，不在内存或临时文件中拼出完整文件：
+
+- zip：每个分镜的全部图片原样打包（JPEG 不再压缩，ZIP_STORED），附带 storyboard.json；
+  写入不可 seek 的流，边读源文件边输出
+- pdf：每个分镜一页（取分镜第一张图），手写的 PDF 写入器逐页输出，图片以
+  DCTDecode 直接嵌入 JPEG 数据
+- sheet：分镜缩略图拼成联系表（JPEG），单张画布不超过 EXPORT_SHEET_MAX_PIXELS，分镜多时分页
+
+图片解码和缩放在进程池中并行（EXPORT_WORKERS），并且只预取 EXPORT_PREFETCH 个分镜，
+所以内存占用与分镜数量无关：pdf 只持有少量已缩放的页面，sheet 只持有一页的画布。
+进程池使用 spawn 启动方式：服务进程里有任务线程、上传线程和 SQLite 连接，
+fork 出的子进程可能继承被其他线程持有的锁而死锁。spawn 会在子进程中重新导入主模块，
+其中的后台协调和定期回收会自动跳过（见 coordination.is_helper_process）。
+"""
+
+import io
+import json
+import math
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+
+from dotenv import load_dotenv
+from PIL import Image, ImageDraw
+
+load_dotenv()
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXPORT_PREFETCH = int(os.getenv("EXPORT_PREFETCH", str(EXPORT_WORKERS * 2)))
+# PDF 页面图片的最长边（像素）与 JPEG 质量
+EXPORT_PDF_MAX_EDGE = int(os.getenv("EXPORT_PDF_MAX_EDGE", "2048"))
+EXPORT_QUALITY = int(os.getenv("EXPORT_QUALITY", "85"))
+# 联系表单页画布的像素上限，放不下的分镜放到后续页
+EXPORT_SHEET_MAX_PIXELS = int(os.getenv("EXPORT_SHEET_MAX_PIXELS", "24000000"))
+
+CHUNK_SIZE = 256 * 1024
+# 联系表格子的高宽比范围（按第一张图决定，避免极端比例的图片撑大画布）
+SHEET_ASPECT_RANGE = (0.25, 4.0)
+SHEET_GAP, SHEET_LABEL_HEIGHT = 8, 20
+PDF_PAGE_LONG_EDGE = 842  # A4 长边（pt）
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=EXPORT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _render_image(path, max_width, max_height, as_jpeg):
+    """
+    进程池中执行：解码并缩小到 max_width × max_height 以内。
+    返回 (数据, 宽, 高)，as_jpeg 时数据为 JPEG 字节，否则为 RGB 原始像素；读取失败返回 None
+    """
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (max_width, max_height))  # JPEG 解码时直接按比例缩小
+            img = img.convert("RGB")
+            img.thumbnail((max_width, max_height), Image.LANCZOS)
+            if not as_jpeg:
+                return img.tobytes(), img.width, img.height
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=EXPORT_QUALITY)
+            return buf.getvalue(), img.width, img.height
+    except Exception as e:
+        print(f"[Export] 读取失败 {path}: {e}")
+        return None
+
+
+def _render_all(paths, max_width, max_height, as_jpeg):
+    """按顺序产出每张图的渲染结果，同时最多 EXPORT_PREFETCH 张在进程池中处理"""
+    pool = _get_pool()
+    pending = deque()
+    for path in paths:
+        pending.append(
+            pool.submit(_render_image, path, max_width, max_height, as_jpeg)
+            if path
+            else None
+        )
+        if len(pending) >= EXPORT_PREFETCH:
+            future = pending.popleft()
+            yield future.result() if future else None
+    while pending:
+        future = pending.popleft()
+        yield future.result() if future else None
+
+
+class _ChunkWriter(io.RawIOBase):
+    """不可 seek 的输出流：写入的数据暂存，由生成器取走"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def export_zip(record, panel_files):
+    """
+    panel_files：与 record["panels"] 对应的本地文件列表（每个分镜一个列表）。
+    逐块产出 ZIP 数据。
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_STORED) as zf:
+        for i, files in enumerate(panel_files, start=1):
+            for k, path in enumerate(files, start=1):
+                with ExitStack() as stack:
+                    # 先打开源文件：读不到的图片跳过，不在 ZIP 中留下半个条目
+                    try:
+                        size = os.path.getsize(path)
+                        src = stack.enter_context(open(path, "rb"))
+                    except OSError as e:
+                        print(f"[Export] 跳过 {path}: {e}")
+                        continue
+                    info = zipfile.ZipInfo(
+                        f"panel-{i:03d}-{k}{os.path.splitext(path)[1] or '.jpg'}"
+                    )
+                    info.file_size = size
+                    with zf.open(info, "w", force_zip64=size > 2**31) as dst:
+                        for chunk in iter(partial(src.read, CHUNK_SIZE), b""):
+                            dst.write(chunk)
+                            yield writer.drain()
+        zf.writestr("storyboard.json", json.dumps(record, ensure_ascii=False, indent=2))
+    yield writer.drain()
+
+
+def export_pdf(record, panel_files):
+    """每个分镜一页（分镜第一张图），逐页产出 PDF 数据"""
+    offsets = {}  # 对象号 -> 字节偏移
+    position = 0
+
+    def emit(data: bytes):
+        nonlocal position
+        position += len(data)
+        return data
+
+    def obj(number, body: bytes, stream: bytes = None):
+        offsets[number] = position
+        data = f"{number} 0 obj\n".encode() + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        return emit(data + b"\nendobj\n")
+
+    yield emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    # 1：Catalog，2：Pages（页数确定后最后写入）；每页占 3 个对象：图片、内容流、页面
+    page_refs = []
+    paths = [files[0] if files else None for files in panel_files]
+    rendered = _render_all(paths, EXPORT_PDF_MAX_EDGE, EXPORT_PDF_MAX_EDGE, True)
+    for result in rendered:
+        if result is None:
+            continue
+        jpeg, width, height = result
+        scale = PDF_PAGE_LONG_EDGE / max(width, height)
+        page_w, page_h = round(width * scale, 2), round(height * scale, 2)
+
+        image_no = 3 + len(page_refs) * 3
+        content_no, page_no = image_no + 1, image_no + 2
+        yield obj(
+            image_no,
+            (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode "
+                f"/Length {len(jpeg)} >>"
+            ).encode(),
+            jpeg,
+        )
+        content = f"q {page_w} 0 0 {page_h} 0 0 cm /Im0 Do Q".encode()
+        yield obj(content_no, f"<< /Length {len(content)} >>".encode(), content)
+        yield obj(
+            page_no,
+            (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w} {page_h}] "
+                f"/Resources << /XObject << /Im0 {image_no} 0 R >> >> "
+                f"/Contents {content_no} 0 R >>"
+            ).encode(),
+        )
+        page_refs.append(f"{page_no} 0 R")
+
+    yield obj(
+        2,
+        f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>".encode(),
+    )
+    yield obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    size = max(offsets) + 1
+    xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+    for number in range(1, size):
+        xref.append(f"{offsets.get(number, 0):010d} 00000 n \n")
+    xref_offset = position
+    yield emit(
+        (
+            "".join(xref)
+            + f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+        ).encode()
+    )
+
+
+def _sheet_layout(paths, columns, cell_width):
+    """
+    联系表布局：(列数, 格子宽, 格子高, 每页行数)。格子按第一张可用图片的宽高比；
+    每页画布不超过 EXPORT_SHEET_MAX_PIXELS，单行就超出时缩小格子
+    """
+    columns = max(1, min(columns, len(paths) or 1))
+    aspect = 9 / 16
+    for path in paths:
+        if path:
+            try:
+                with Image.open(path) as img:
+                    aspect = min(
+                        max(img.height / img.width, SHEET_ASPECT_RANGE[0]),
+                        SHEET_ASPECT_RANGE[1],
+                    )
+                break
+            except Exception:
+                continue
+
+    def row_pixels(width):
+        sheet_width = columns * width + (columns + 1) * SHEET_GAP
+        return sheet_width * (round(width * aspect) + SHEET_LABEL_HEIGHT + SHEET_GAP)
+
+    while cell_width > 64 and row_pixels(cell_width) > EXPORT_SHEET_MAX_PIXELS:
+        cell_width = max(64, int(cell_width * 0.8))
+    rows = max(1, EXPORT_SHEET_MAX_PIXELS // row_pixels(cell_width))
+    return columns, cell_width, round(cell_width * aspect), rows
+
+
+def sheet_pages(panel_files, columns=4, cell_width=384) -> int:
+    """联系表的页数"""
+    paths = [files[0] if files else None for files in panel_files]
+    columns, _, _, rows = _sheet_layout(paths, columns, cell_width)
+    return max(1, math.ceil(len(paths) / (columns * rows)))
+
+
+def export_contact_sheet(record, panel_files, columns=4, cell_width=384, page=1):
+    """
+    分镜（第一张图）拼成网格，输出 JPEG。画布过大时分页（见 _sheet_layout），
+    page 从 1 开始；编号沿用分镜在故事板中的序号
+    """
+    all_paths = [files[0] if files else None for files in panel_files]
+    columns, cell_width, cell_height, rows = _sheet_layout(
+        all_paths, columns, cell_width
+    )
+    first = (page - 1) * columns * rows
+    paths = all_paths[first : first + columns * rows]
+    rows = max(1, math.ceil(len(paths) / columns))
+
+    gap, label_height = SHEET_GAP, SHEET_LABEL_HEIGHT
+    sheet = Image.new(
+        "RGB",
+        (
+            columns * cell_width + (columns + 1) * gap,
+            rows * (cell_height + label_height) + (rows + 1) * gap,
+        ),
+        (24, 24, 24),
+    )
+    draw = ImageDraw.Draw(sheet)
+    for i, result in enumerate(_render_all(paths, cell_width, cell_height, False)):
+        x = gap + (i % columns) * (cell_width + gap)
+        y = gap + (i // columns) * (cell_height + label_height + gap)
+        draw.text((x, y + 4), str(first + i + 1), fill=(200, 200, 200))
+        if result is None:
+            continue
+        pixels, width, height = result
+        tile = Image.frombytes("RGB", (width, height), pixels)
+        sheet.paste(
+            tile,
+            (
+                x + (cell_width - width) // 2,
+                y + label_height + (cell_height - height) // 2,
+            ),
+        )
+
+    buf = io.BytesIO()
+    sheet.save(buf, "JPEG", quality=EXPORT_QUALITY)
+    buf.seek(0)
+    for chunk in iter(lambda: buf.read(CHUNK_SIZE), b""):
+        yield chunk
+
+
+EXPORTERS = {
+    "zip": (export_zip, "application/zip", "zip"),
+    "pdf": (export_pdf, "application/pdf", "pdf"),
+    "sheet": (export_contact_sheet, "image/jpeg", "jpg"),
+}
@@ -1,25 +1,222 @@
-# test_gen_api.py
-from plugins import get_plugin, load_plugins
+import asyncio
+import os
+import threading
+import time
 
-load_plugins()
+from metrics import STAGE_ERRORS, STAGE_LATENCY
+from plugin_health import plugin_health
+from plugin_runtime import call_plugin_async, is_async_plugin, run_coroutine
+from plugins import acquire_plugin_slot, get_plugin, plugin_supports
 
+# 调度模式：
+# - sequential：按顺序逐个尝试（默认）
+# - hedge：先调用第一个插件，HEDGE_DELAY 秒内没有结果再并行启动下一个
+# - race：所有插件同时启动，取最先返回的非空结果
+FALLBACK_MODE = os.getenv("FALLBACK_MODE", "sequential").lower()
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "15"))
 
-def generate_via_image_fallback(
-    image_urls, prompt, size="2K", ar="auto", fallback_order=None
+# 调度统计（用于调整 HEDGE_DELAY）
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "hedges_launched": 0,  # 因超时而额外启动的调用
+    "wasted_calls": 0,  # 已经有赢家后仍在运行的调用
+    "wins": {},
+}
+
+
+def get_fallback_stats():
+    """返回调度统计：各插件胜出次数、耗时分位数、浪费的调用数"""
+    latencies = {
+        name: {"count": health["window"], "p50": health["p50"], "p95": health["p95"]}
+        for name, health in plugin_health.snapshot().items()
+    }
+    with _stats_lock:
+        return {
+            "mode": FALLBACK_MODE,
+            "hedge_delay": HEDGE_DELAY,
+            "requests": _stats["requests"],
+            "hedges_launched": _stats["hedges_launched"],
+            "wasted_calls": _stats["wasted_calls"],
+            "wins": dict(_stats["wins"]),
+            "latencies": latencies,
+        }
+
+
+async def _timed_call(name, func, kwargs, started=None):
+    """在插件名额内调用插件（同步或 async），返回 (result, 耗时, 异常)"""
+    release = await acquire_plugin_slot(name)
+    # 拿到名额、确定要调用时才占用 half_open 的探测名额
+    if not plugin_health.allow(name):
+        release()
+        print(f"[Plugin] 已熔断，跳过: {name}")
+        return [], 0.0, None
+    if started is not None:
+        started.add(name)
+    start = time.time()
+    # 名额在调用真正结束时释放：同步插件被取消后适配线程仍会跑完，期间继续占用名额
+    call = asyncio.ensure_future(call_plugin_async(func, **kwargs))
+
+    def finished(fut):
+        release()
+        if not fut.cancelled():
+            fut.exception()  # 落败调用之后抛出的异常已无人等待，避免告警
+
+    call.add_done_callback(finished)
+    try:
+        result = await asyncio.shield(call)
+        error = None
+    except asyncio.CancelledError:
+        if is_async_plugin(func):
+            call.cancel()  # async 插件可以真正停止
+        raise
+    except Exception as e:
+        result, error = [], e
+    elapsed = time.time() - start
+    STAGE_LATENCY.observe(elapsed, "generate_images", name)
+    if not result:
+        STAGE_ERRORS.inc("generate_images", name)
+    plugin_health.record(name, bool(result), elapsed)
+    return result, elapsed, error
+
+
+async def _generate_hedged(candidates, kwargs, hedge_delay):
+    """
+    对冲调度：依次启动候选插件，前一个在 hedge_delay 秒内没有返回（或返回空/异常）
+    就启动下一个；第一个非空结果胜出，其余调用取消（async 插件会真正停止，
+    同步插件在适配线程中跑完后结果被忽略，跑完之前继续占用插件名额）。
+    """
+    pending = {}  # task -> name
+    started = set()  # 已拿到名额、实际开始调用的插件
+    latencies = {}
+    next_idx = 0
+
+    def launch():
+        nonlocal next_idx
+        name, func = candidates[next_idx]
+        next_idx += 1
+        print(f"🚀 尝试插件: {name}")
+        task = asyncio.ensure_future(_timed_call(name, func, kwargs, started))
+        pending[task] = name
+
+    launch()
+    if hedge_delay <= 0:
+        while next_idx < len(candidates):
+            launch()
+
+    winner, result = None, []
+    while pending and winner is None:
+        timeout = hedge_delay if next_idx < len(candidates) else None
+        done, _ = await asyncio.wait(
+            pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            # 超时未返回：对冲，启动下一个插件
+            with _stats_lock:
+                _stats["hedges_launched"] += 1
+            launch()
+            continue
+
+        for task in done:
+            name = pending.pop(task)
+            res, elapsed, error = task.result()
+            latencies[name] = round(elapsed, 3)
+            if error is not None:
+                print(f"[Plugin {name}] 异常: {error}")
+            if res and winner is None:
+                winner, result = name, res
+
+        # 当前没有在跑的调用且还没有结果：立即尝试下一个
+        if winner is None and not pending and next_idx < len(candidates):
+            launch()
+
+    # 落败的调用：还在等名额的直接取消，已开始的计为浪费
+    losers = list(pending.values())
+    wasted = sum(1 for name in losers if name in started)
+    for task in pending:
+        task.cancel()
+
+    with _stats_lock:
+        _stats["wasted_calls"] += wasted
+        if winner:
+            _stats["wins"][winner] = _stats["wins"].get(winner, 0) + 1
+
+    print(f"[Hedge] winner={winner} latencies={latencies} cancelled={losers}")
+    return result
+
+
+async def generate_via_image_fallback_async(
+    image_urls,
+    prompt,
+    size="2K",
+    ar="auto",
+    fallback_order=None,
+    mode=None,
+    hedge_delay=None,
 ):
+    """在共享事件循环内执行的调度入口"""
     if fallback_order is None:
         fallback_order = ["nano_banana", "rh_third", "rh_official"]
+    mode = (mode or FALLBACK_MODE).lower()
+    hedge_delay = HEDGE_DELAY if hedge_delay is None else hedge_delay
+    kwargs = dict(image_urls=image_urls, prompt=prompt, size=size, ar=ar)
+
+    with _stats_lock:
+        _stats["requests"] += 1
 
-    for name in fallback_order:
-        func = get_plugin(name)
+    candidates = []
+    for name in plugin_health.order(fallback_order):
+        if not plugin_supports(name, "generate_images", size, ar):
+            print(f"[Plugin] 未找到或不支持 size={size} ar={ar}: {name}")
+            continue
+        # 首次解析会导入插件模块，放到线程池中避免阻塞事件循环
+        func = await asyncio.to_thread(get_plugin, name)
         if not func:
             print(f"[Plugin] 未找到: {name}")
             continue
+        if not plugin_health.available(name):
+            print(f"[Plugin] 已熔断，跳过: {name}")
+            continue
+        candidates.append((name, func))
+
+    if not candidates:
+        return []
+
+    if mode in ("hedge", "race"):
+        return await _generate_hedged(
+            candidates, kwargs, 0 if mode == "race" else hedge_delay
+        )
+
+    for name, func in candidates:
         print(f"🚀 尝试插件: {name}")
-        try:
-            result = func(image_urls=image_urls, prompt=prompt, size=size, ar=ar)
-            if result:
-                return result
-        except Exception as e:
-            print(f"[Plugin {name}] 异常: {e}")
+        result, _, error = await _timed_call(name, func, kwargs)
+        if error is not None:
+            print(f"[Plugin {name}] 异常: {error}")
+        if result:
+            with _stats_lock:
+                _stats["wins"][name] = _stats["wins"].get(name, 0) + 1
+            return result
     return []
+
+
+def generate_via_image_fallback(
+    image_urls,
+    prompt,
+    size="2K",
+    ar="auto",
+    fallback_order=None,
+    mode=None,
+    hedge_delay=None,
+):
+    """同步入口（任务线程中调用）：在共享事件循环上执行调度并等待结果"""
+    return run_coroutine(
+        generate_via_image_fallback_async(
+            image_urls,
+            prompt,
+            size=size,
+            ar=ar,
+            fallback_order=fallback_order,
+            mode=mode,
+            hedge_delay=hedge_delay,
+        )
+    )
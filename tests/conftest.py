@@ -0,0 +1,6 @@
+import os
+import sys
+
+# 测试直接导入项目根目录下的模块；上传缓存写在 history/ 下，测试中关闭
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("UPLOAD_CACHE_ENABLED", "0")
@@ -0,0 +1,56 @@
+"""Coordinator 任务存储：recover() 的判定不能被原来的执行覆盖"""
+
+import time
+
+import pytest
+
+import coordination
+from coordination import Coordinator
+
+
+def job(status, **fields):
+    return {
+        "id": "job1",
+        "kind": "generate",
+        "status": status,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        **fields,
+    }
+
+
+@pytest.fixture
+def coordinator(tmp_path):
+    # 不调用 start()：没有登记的 worker 在 recover() 看来都已退出
+    coordinator = Coordinator(str(tmp_path / "coordination.sqlite3"))
+    coordinator.worker_id = "worker-1"
+    coordinator.save_job(job("running"))
+    return coordinator
+
+
+def test_job_marked_failed_by_recovery_is_not_overwritten(coordinator):
+    coordinator.recover()
+    assert coordinator.load_job("job1")["status"] == "failed"
+
+    coordinator.save_job(job("succeeded", result={"ok": True}))
+
+    assert coordinator.load_job("job1")["status"] == "failed"
+
+
+def test_requeued_job_only_accepts_writes_from_the_new_attempt(
+    coordinator, monkeypatch
+):
+    monkeypatch.setattr(coordination, "JOB_RECOVERY", "requeue")
+    coordinator.recover()
+    # 同一个 worker 重新登记后认领了自己被判定遗弃的任务
+    assert coordinator.claim_jobs(["generate"], 1) == ["job1"]
+
+    coordinator.save_job(job("succeeded", result={"stale": True}), attempt=1)
+    assert coordinator.load_job("job1")["status"] == "queued"
+
+    coordinator.save_job(job("succeeded", result={"ok": True}), attempt=2)
+    stored = coordinator.load_job("job1")
+    assert (stored["status"], stored["result"]) == ("succeeded", {"ok": True})
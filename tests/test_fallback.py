@@ -0,0 +1,55 @@
+"""generate_via_image_fallback 与熔断探测的测试（插件用本地函数代替）"""
+
+import pytest
+
+import test_gen_api
+from plugin_health import BREAKER_FAILURE_THRESHOLD, HALF_OPEN, PluginHealth
+
+calls = []  # probed_plugin 收到的调用
+
+
+def ok_plugin(**kwargs):
+    return ["https://example.com/ok.jpg"]
+
+
+def probed_plugin(**kwargs):
+    calls.append(kwargs)
+    return ["https://example.com/probe.jpg"]
+
+
+@pytest.fixture
+def health(monkeypatch):
+    """独立的健康度状态；'probe' 处于冷却结束、尚未探测的 half_open 状态"""
+    health = PluginHealth()
+    for _ in range(BREAKER_FAILURE_THRESHOLD):
+        health.record("probe", False, 0.1)
+    health._plugins["probe"].opened_at = 0
+    plugins = {"ok": ok_plugin, "probe": probed_plugin}
+    monkeypatch.setattr(test_gen_api, "plugin_health", health)
+    monkeypatch.setattr(test_gen_api, "get_plugin", plugins.get)
+    monkeypatch.setattr(test_gen_api, "plugin_supports", lambda name, *a: True)
+    calls.clear()
+    return health
+
+
+@pytest.mark.parametrize("mode", ["sequential", "hedge"])
+def test_unlaunched_candidate_keeps_half_open_probe(health, mode):
+    result = test_gen_api.generate_via_image_fallback(
+        [], "prompt", fallback_order=["ok", "probe"], mode=mode, hedge_delay=5
+    )
+
+    assert result == ["https://example.com/ok.jpg"]
+    assert calls == []
+    # 没有被调用的插件不能占用探测名额，下一次请求仍可探测
+    assert health.allow("probe")
+    assert health.snapshot()["probe"]["state"] == HALF_OPEN
+
+
+def test_half_open_probe_is_called_once_claimed(health):
+    result = test_gen_api.generate_via_image_fallback(
+        [], "prompt", fallback_order=["probe", "ok"], mode="sequential"
+    )
+
+    assert result == ["https://example.com/probe.jpg"]
+    assert len(calls) == 1
+    assert health.snapshot()["probe"]["state"] == "closed"
@@ -0,0 +1,83 @@
+"""history_layout 测试：路径解析与在线迁移"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+import history_layout
+from history_layout import logical_path, migrate, resolve, shard_dirs
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(history_layout, "HISTORY_SHARD_LEVELS", 1)
+    for subdir in ("inputs", "results", "thumbs/256/results"):
+        (tmp_path / "history" / subdir).mkdir(parents=True)
+    return tmp_path / "history"
+
+
+def sharded(subdir, name):
+    return "/".join([subdir, *shard_dirs(name, 1), name])
+
+
+@pytest.mark.parametrize(
+    "subpath",
+    ["../secret.jpg", "results/../../secret.jpg", "results/..", "..\\secret.jpg"],
+)
+def test_resolve_rejects_parent_directories(history, subpath):
+    (history.parent / "secret.jpg").write_bytes(b"x")
+    (history / "results" / "secret.jpg").write_bytes(b"x")
+    assert resolve(subpath) is None
+
+
+def test_resolve_finds_flat_and_sharded_files(history):
+    (history / "results" / "flat.jpg").write_bytes(b"x")
+    path = history / sharded("results", "moved.jpg")
+    path.parent.mkdir()
+    path.write_bytes(b"x")
+
+    assert resolve("results/flat.jpg") == "results/flat.jpg"
+    assert resolve("/results/moved.jpg") == sharded("results", "moved.jpg")
+    assert resolve(sharded("results", "moved.jpg")) == sharded("results", "moved.jpg")
+    assert resolve("results/missing.jpg") is None
+    assert logical_path(f"history/{sharded('results', 'moved.jpg')}") == (
+        "history/results/moved.jpg"
+    )
+
+
+def test_migrate_moves_files_skips_part_files_and_is_idempotent(history):
+    (history / "results" / "a.jpg").write_bytes(b"a")
+    (history / "inputs" / "b.jpg").write_bytes(b"b")
+    (history / "thumbs" / "256" / "results" / "a.jpg").write_bytes(b"t")
+    (history / "results" / "c.part").write_bytes(b"partial")
+    (history / "record1.json").write_text(json.dumps({"id": "record1"}))
+
+    assert migrate(dry_run=True)["pending"] == 4
+    assert (history / "results" / "a.jpg").exists()
+
+    stats = migrate()
+
+    assert stats == {"pending": 4, "moved": 4, "conflict": 0, "gone": 0}
+    assert (history / "results" / "c.part").exists()
+    assert not (history / "results" / "a.jpg").exists()
+    assert (history / sharded("results", "a.jpg")).read_bytes() == b"a"
+    assert (history / sharded("inputs", "b.jpg")).read_bytes() == b"b"
+    assert (history / "thumbs" / "256" / sharded("results", "a.jpg")).exists()
+    assert (history / sharded("records", "record1.json")).exists()
+    assert resolve("results/a.jpg") == sharded("results", "a.jpg")
+
+    assert migrate() == {"pending": 0, "moved": 0, "conflict": 0, "gone": 0}
+
+
+def test_migrate_completes_an_interrupted_move(history):
+    # 上次迁移在硬链接之后、删除原路径之前中断
+    flat = history / "results" / "a.jpg"
+    flat.write_bytes(b"a")
+    target = history / sharded("results", "a.jpg")
+    target.parent.mkdir()
+    Path(target).hardlink_to(flat)
+
+    assert migrate()["moved"] == 1
+    assert not flat.exists() and target.read_bytes() == b"a"
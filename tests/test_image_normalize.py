@@ -0,0 +1,75 @@
+"""normalize_upload / _copy_jpeg 测试：直接复制、按方向旋转、截断的图片"""
+
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from image_normalize import EXIF_ORIENTATION, _copy_jpeg, normalize_upload
+
+
+def jpeg(size=(64, 32), orientation=1, comment=b"") -> bytes:
+    img = Image.new("RGB", size, (200, 40, 40))
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = orientation
+    exif[0x010F] = "TestCamera"  # Make
+    out = BytesIO()
+    img.save(out, "JPEG", exif=exif, comment=comment, quality=90)
+    return out.getvalue()
+
+
+def scan_data(data: bytes) -> bytes:
+    return data[data.index(b"\xff\xda") :]
+
+
+def test_conforming_jpeg_is_copied_without_metadata(tmp_path):
+    source = jpeg(comment=b"secret note")
+
+    path, source_format, action = normalize_upload(BytesIO(source), tmp_path / "out")
+
+    data = path.read_bytes()
+    assert (path.suffix, source_format, action) == (".jpg", "jpeg", "copied")
+    assert b"Exif" in source and b"Exif" not in data
+    assert b"secret note" not in data
+    # 压缩数据原样保留，没有重新编码
+    assert scan_data(data) == scan_data(source)
+    with Image.open(path) as img:
+        assert img.size == (64, 32)
+
+
+def test_copy_keeps_metadata_when_requested():
+    out = BytesIO()
+    _copy_jpeg(BytesIO(jpeg()), out, keep_metadata=True)
+    assert b"TestCamera" in out.getvalue()
+
+
+def test_rotated_jpeg_is_transposed(tmp_path):
+    path, _, action = normalize_upload(BytesIO(jpeg(orientation=6)), tmp_path / "out")
+
+    assert action == "transposed"
+    with Image.open(path) as img:
+        assert img.size == (32, 64)
+        assert img.getexif().get(EXIF_ORIENTATION, 1) == 1
+
+
+@pytest.mark.parametrize("cut", [-200, 40], ids=["scan-data", "header"])
+def test_truncated_jpeg_is_rejected(tmp_path, cut):
+    source = jpeg(size=(256, 256))
+
+    with pytest.raises((OSError, SyntaxError)):
+        normalize_upload(BytesIO(source[:cut]), tmp_path / "out")
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_copy_rejects_jpeg_without_eoi():
+    with pytest.raises(ValueError):
+        _copy_jpeg(BytesIO(jpeg()[:-2]), BytesIO())
+
+
+def test_jpeg_with_trailing_data_is_reencoded(tmp_path):
+    path, _, action = normalize_upload(BytesIO(jpeg() + b"\x00" * 16), tmp_path / "out")
+
+    assert action == "transposed"
+    with Image.open(path) as img:
+        assert img.size == (64, 32)
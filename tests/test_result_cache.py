@@ -0,0 +1,44 @@
+"""ResultCache 的请求合并与强制刷新"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from result_cache import ResultCache
+
+
+def test_force_refresh_does_not_attach_to_inflight_computation():
+    cache = ResultCache()
+    started, release = threading.Event(), threading.Event()
+
+    def stale():
+        started.set()
+        release.wait(5)
+        return {"result_urls": [], "value": "stale"}
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        first = pool.submit(cache.get_or_compute, "key", stale)
+        started.wait(5)
+        refreshed = cache.get_or_compute(
+            "key", lambda: {"result_urls": [], "value": "fresh"}, force_refresh=True
+        )
+        release.set()
+        assert first.result()[0]["value"] == "stale"
+
+    assert refreshed == ({"result_urls": [], "value": "fresh"}, "miss")
+    # 先开始的计算晚结束，也不能覆盖刷新后的结果
+    assert cache.get_or_compute("key", stale)[0]["value"] == "fresh"
+
+
+def test_result_files_are_checked_outside_the_lock(monkeypatch):
+    cache = ResultCache()
+    cache.get_or_compute("key", lambda: {"result_urls": ["/history/results/x.jpg"]})
+    locked = []
+    monkeypatch.setattr(
+        cache, "_files_exist", lambda result: locked.append(cache._lock.locked())
+    )
+
+    # 结果图不存在：视为未命中，重新计算
+    result, source = cache.get_or_compute("key", lambda: {"result_urls": []})
+
+    assert (result, source) == ({"result_urls": []}, "miss")
+    assert locked == [False]
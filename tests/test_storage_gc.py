@@ -0,0 +1,123 @@
+"""StorageGC 测试：在临时目录下构造 history/ 和故事板目录"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+import storage_gc
+from history_index import HistoryIndex
+from history_layout import record_path, resolve, shard_path
+
+OLD = time.time() - 30 * 86400  # 早于宽限期
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    """切换到临时目录，返回 (历史索引, 故事板目录)"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage_gc, "GC_GRACE_DAYS", 7)
+    monkeypatch.setattr(storage_gc, "GC_BATCH_PAUSE", 0)
+    Path("history").mkdir()
+    storyboards = tmp_path / "storyboards"
+    storyboards.mkdir()
+    return HistoryIndex(Path("history")), storyboards
+
+
+def image(subdir, name, mtime=OLD) -> str:
+    """写入一张图片并设置修改时间，返回 /history/... 形式的 URL"""
+    path = shard_path(Path("history") / subdir, name)
+    path.write_bytes(b"\xff\xd8\xff" + name.encode())
+    os.utime(path, (mtime, mtime))
+    return f"/history/{subdir}/{name}"
+
+
+def exists(url) -> bool:
+    return resolve(url.removeprefix("/history/")) is not None
+
+
+def write_record(index, name, record):
+    path = record_path(name)
+    path.write_text(json.dumps(record), encoding="utf-8")
+    index.add(path, record)
+
+
+def test_images_of_record_missing_fields_are_kept(history):
+    index, storyboards = history
+    result = image("results", "kept.jpg")
+    source = image("inputs", "kept-input.jpg")
+    # 缺少 size / prompt：不在 /history 中显示，但 JSON 仍在，图片不能被回收
+    write_record(
+        index,
+        "partial",
+        {
+            "id": "partial",
+            "local_result_paths": [result],
+            "local_input_paths": [source],
+        },
+    )
+    orphan = image("results", "orphan.jpg")
+
+    report = storage_gc.StorageGC(index, storyboards).run(dry_run=False)
+
+    assert report["deleted"] == 1
+    assert exists(result) and exists(source)
+    assert not exists(orphan)
+    assert index.page(0, 10) == ([], 0)
+
+
+def test_rebuild_keeps_images_of_record_missing_fields(history):
+    index, storyboards = history
+    result = image("results", "kept.jpg")
+    path = record_path("partial")
+    path.write_text(json.dumps({"local_result_paths": [result]}), encoding="utf-8")
+    index.rebuild()
+
+    storage_gc.StorageGC(index, storyboards).run(dry_run=False)
+
+    assert exists(result)
+
+
+def test_grace_period_and_dry_run(history):
+    index, storyboards = history
+    old = image("results", "old.jpg")
+    recent = image("results", "recent.jpg", mtime=time.time() - 86400)
+    gc = storage_gc.StorageGC(index, storyboards)
+
+    report = gc.run(dry_run=True)
+    sample = [f["path"] for f in report["orphans"]["sample"]]
+    assert sample == ["/history/" + resolve("results/old.jpg")]
+    assert report["deleted"] == 0 and exists(old)
+
+    report = gc.run(dry_run=False)
+    assert report["deleted"] == 1
+    assert not exists(old)
+    # 未被引用但还在宽限期内
+    assert exists(recent)
+
+
+def test_storyboard_references_are_kept(history):
+    index, storyboards = history
+    flat = image("results", "flat-url.jpg")
+    nested = image("inputs", "nested.jpg")
+    orphan = image("results", "orphan.jpg")
+    # 故事板中保存的是迁移前的平铺 URL，引用可以出现在任意字段中
+    (storyboards / "sb.json").write_text(
+        json.dumps(
+            {
+                "cover": flat,
+                "panels": [
+                    {"images": [f"{nested}?v=1", "https://cdn.example.com/x.jpg"]}
+                ],
+            }
+        ),
+        encoding="utf-8",
+    )
+
+    report = storage_gc.StorageGC(index, storyboards).run(dry_run=False)
+
+    assert report["deleted"] == 1
+    assert exists(flat) and exists(nested)
+    assert not exists(orphan)
@@ -0,0 +1,137 @@
+"""GitBatchUploader 测试：以本地裸仓库作为远端"""
+
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from uploader import GitBatchUploader, UploadError
+
+
+def git(cwd, *args):
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def clone(remote, path):
+    git(path.parent, "clone", "-q", str(remote), path.name)
+    git(path, "config", "user.email", "test@example.com")
+    git(path, "config", "user.name", "test")
+    git(path, "checkout", "-q", "-B", "main")
+    return path
+
+
+@pytest.fixture
+def repos(tmp_path):
+    """(裸远端, 上传器使用的工作仓库)，远端已有一个初始提交"""
+    remote = tmp_path / "remote.git"
+    git(tmp_path, "init", "-q", "--bare", "-b", "main", str(remote))
+    seed = clone(remote, tmp_path / "seed")
+    (seed / "README.md").write_text("seed\n")
+    git(seed, "add", "README.md")
+    git(seed, "commit", "-q", "-m", "init")
+    git(seed, "push", "-q", "origin", "main")
+    return remote, clone(remote, tmp_path / "work")
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(10):
+        path = tmp_path / f"img{i}.jpg"
+        path.write_bytes(b"\xff\xd8\xff" + bytes([i]) * 100)
+        paths.append(path)
+    return paths
+
+
+def test_concurrent_uploads_are_pushed_in_one_commit(repos, images):
+    remote, work = repos
+    uploader = GitBatchUploader(work, window=0.5)
+
+    with ThreadPoolExecutor(max_workers=len(images)) as pool:
+        rel_paths = list(pool.map(lambda p: uploader.upload(str(p)), images))
+
+    assert len(set(rel_paths)) == len(images)
+    assert git(remote, "rev-list", "--count", "main") == "2"
+    pushed = git(remote, "ls-tree", "-r", "--name-only", "main").splitlines()
+    assert set(rel_paths) <= set(pushed)
+
+
+def test_push_rebases_onto_new_remote_commits(repos, images, tmp_path):
+    remote, work = repos
+    other = clone(remote, tmp_path / "other")
+    (other / "other.txt").write_text("other\n")
+    git(other, "add", "other.txt")
+    git(other, "commit", "-q", "-m", "other")
+    git(other, "push", "-q", "origin", "main")
+
+    rel_path = GitBatchUploader(work, window=0).upload(str(images[0]))
+
+    pushed = git(remote, "ls-tree", "-r", "--name-only", "main").splitlines()
+    assert rel_path in pushed and "other.txt" in pushed
+
+
+def test_failed_rebase_is_aborted_and_writer_keeps_running(repos, images, tmp_path):
+    remote, work = repos
+    # 本地与远端修改同一文件，pull --rebase 必然冲突
+    other = clone(remote, tmp_path / "other")
+    (other / "README.md").write_text("remote\n")
+    git(other, "commit", "-q", "-am", "remote change")
+    git(other, "push", "-q", "origin", "main")
+    (work / "README.md").write_text("local\n")
+    git(work, "commit", "-q", "-am", "local change")
+
+    uploader = GitBatchUploader(work, window=0)
+    with pytest.raises(UploadError):
+        uploader.upload(str(images[0]))
+    assert not (work / ".git" / "rebase-merge").exists()
+    assert not (work / ".git" / "rebase-apply").exists()
+
+    # 本地仓库已恢复到远端分支，同一个写线程可以直接处理下一批
+    assert git(work, "rev-parse", "HEAD") == git(remote, "rev-parse", "main")
+    rel_path = uploader.upload(str(images[1]))
+    assert rel_path in git(remote, "ls-tree", "-r", "--name-only", "main")
+
+
+def test_rejected_push_does_not_leave_a_local_commit(repos, images):
+    remote, work = repos
+    # 远端拒绝推送（如保护分支、钩子检查失败），pull --rebase 之后仍被拒绝
+    hook = remote / "hooks" / "pre-receive"
+    hook.write_text('#!/bin/sh\ntest ! -e "$GIT_DIR/reject"\n')
+    hook.chmod(0o755)
+    (remote / "reject").touch()
+
+    uploader = GitBatchUploader(work, window=0)
+    with pytest.raises(UploadError):
+        uploader.upload(str(images[0]))
+    assert git(work, "rev-parse", "HEAD") == git(remote, "rev-parse", "main")
+    assert git(work, "status", "--porcelain") == ""
+
+    (remote / "reject").unlink()
+    rel_path = uploader.upload(str(images[1]))
+    pushed = git(remote, "ls-tree", "-r", "--name-only", "main").splitlines()
+    assert pushed == ["README.md", rel_path]
+
+
+def test_unexpected_error_fails_the_batch_without_killing_writer(
+    repos, images, monkeypatch
+):
+    remote, work = repos
+    uploader = GitBatchUploader(work, window=0)
+    real_git = uploader._git
+    calls = threading.local()
+
+    def flaky_git(*args, **kwargs):
+        if args[0] == "commit" and not getattr(calls, "failed", False):
+            calls.failed = True
+            raise OSError("disk full")
+        return real_git(*args, **kwargs)
+
+    monkeypatch.setattr(uploader, "_git", flaky_git)
+    with pytest.raises(UploadError, match="disk full"):
+        uploader.upload(str(images[0]))
+
+    rel_path = uploader.upload(str(images[1]))
+    assert rel_path in git(remote, "ls-tree", "-r", "--name-only", "main")
@@ -0,0 +1,191 @@
+"""
+缩略图。
+
+history/inputs、history/results 下的原图在保存时同步生成多个尺寸的缩略图，
+存放在 history/thumbs/<尺寸>/ 下并保持相同的子路径，例如：
+
+    /history/results/abc.jpg  →  /history/thumbs/256/results/abc.jpg
+
+分片布局（见 history_layout）下缩略图同样放在分片目录中；按旧的平铺 URL 请求时
+原图和缩略图都通过 history_layout.resolve() 找到实际位置。
+
+解码时使用 Pillow 的 JPEG draft 模式，按缩略图尺寸直接以 1/2、1/4、1/8
+比例解码，大图不会在内存中完整展开。
+
+已有图片的缩略图可以后台回填：
+
+    python thumbnails.py backfill
+"""
+
+import os
+import sys
+import threading
+from pathlib import Path
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from history_layout import candidates, resolve
+
+load_dotenv()
+
+HISTORY_DIR = Path("history")
+THUMB_DIR = HISTORY_DIR / "thumbs"
+# 缩略图尺寸（最长边像素），如 "256,768"
+THUMBNAIL_SIZES = sorted(
+    int(size) for size in os.getenv("THUMBNAIL_SIZES", "256,768").split(",") if size
+)
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "85"))
+
+# 只为这些子目录下的图片生成缩略图
+SOURCE_SUBDIRS = ("inputs", "results")
+# 缩略图与原图同名，格式跟随扩展名（上传图片可能按 UPLOAD_OUTPUT_FORMAT 保存为 WebP / PNG）
+SOURCE_SUFFIXES = {".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP", ".png": "PNG"}
+
+_backfill_lock = threading.Lock()
+_backfill_state = {"running": False, "created": 0, "scanned": 0, "errors": 0}
+
+
+def _source_subpath(image_path: str):
+    """'/history/results/x.jpg' 或 'history/results/x.jpg' → 'results/x.jpg'，不在支持范围内返回 None"""
+    rel = image_path.replace("\\", "/").lstrip("/")
+    prefix = HISTORY_DIR.as_posix() + "/"
+    if not rel.startswith(prefix):
+        return None
+    sub = rel[len(prefix) :]
+    parts = sub.split("/")
+    if parts[0] not in SOURCE_SUBDIRS or ".." in parts:
+        return None
+    return sub
+
+
+def thumbnail_url(image_path: str, size: int):
+    """原图的本地路径（如 /history/results/x.jpg）→ 对应缩略图 URL；不支持的路径返回 None"""
+    sub = _source_subpath(image_path)
+    if sub is None:
+        return None
+    return f"/{THUMB_DIR.as_posix()}/{size}/{sub}"
+
+
+def thumbnail_urls(image_paths) -> dict:
+    """批量生成缩略图 URL：{"256": [...], "768": [...]}，不支持的路径原样返回"""
+    return {
+        str(size): [thumbnail_url(path, size) or path for path in image_paths]
+        for size in THUMBNAIL_SIZES
+    }
+
+
+def make_thumbnails(image_path: str) -> int:
+    """为一张原图生成所有尺寸的缩略图（已存在的跳过），返回新生成的数量"""
+    sub = _source_subpath(image_path)
+    if sub is None:
+        return 0
+    sub = resolve(sub) or sub  # 平铺路径的原图可能已迁移到分片目录
+    source = HISTORY_DIR / sub
+    targets = [
+        (size, THUMB_DIR / str(size) / sub)
+        for size in sorted(THUMBNAIL_SIZES, reverse=True)
+        if not resolve(f"{THUMB_DIR.name}/{size}/{sub}")
+    ]
+    if not targets:
+        return 0
+
+    with Image.open(source) as img:
+        # draft 只对 JPEG 生效：按最大缩略图尺寸降采样解码
+        largest = targets[0][0]
+        img.draft("RGB", (largest, largest))
+        img = img.convert("RGB")
+
+        # 从大到小依次缩放，每次复用上一级结果
+        for size, target in targets:
+            img.thumbnail((size, size), Image.LANCZOS)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix(f".{os.getpid()}.{threading.get_ident()}.part")
+            img.save(
+                tmp,
+                SOURCE_SUFFIXES.get(target.suffix.lower(), "JPEG"),
+                quality=THUMBNAIL_QUALITY,
+            )
+            tmp.replace(target)
+    return len(targets)
+
+
+def make_thumbnails_safe(image_path: str):
+    """保存原图后调用：生成失败只记录日志，不影响主流程"""
+    try:
+        make_thumbnails(image_path)
+    except Exception as e:
+        print(f"[Thumbnail Error] {image_path} -> {e}")
+
+
+def remove_thumbnails(image_path: str):
+    """删除原图对应的所有缩略图"""
+    sub = _source_subpath(image_path)
+    if sub is None:
+        return
+    for size in THUMBNAIL_SIZES:
+        # 平铺和分片位置都可能有（迁移前后各生成过一次）
+        for candidate in candidates(f"{THUMB_DIR.name}/{size}/{sub}"):
+            (HISTORY_DIR / candidate).unlink(missing_ok=True)
+
+
+def resolve_thumbnail(thumb_subpath: str):
+    """
+    懒生成：请求 thumbs/<尺寸>/<子路径> 但文件不存在时，若原图存在则立即生成。
+    返回是否可以提供该缩略图。
+    """
+    size, _, sub = thumb_subpath.partition("/")
+    if not size.isdigit() or int(size) not in THUMBNAIL_SIZES:
+        return False
+    thumb = f"{THUMB_DIR.name}/{size}/{sub}"
+    if resolve(thumb):
+        return True
+    source = resolve(sub)
+    if _source_subpath(f"{HISTORY_DIR.as_posix()}/{sub}") is None or not source:
+        return False
+    make_thumbnails_safe(f"{HISTORY_DIR.as_posix()}/{source}")
+    return resolve(thumb) is not None
+
+
+def backfill_thumbnails() -> dict:
+    """为所有已有图片补齐缩略图，返回统计"""
+    for subdir in SOURCE_SUBDIRS:
+        for path in (HISTORY_DIR / subdir).rglob("*"):
+            if path.suffix.lower() not in SOURCE_SUFFIXES:
+                continue
+            _backfill_state["scanned"] += 1
+            try:
+                _backfill_state["created"] += make_thumbnails(path.as_posix())
+            except Exception as e:
+                _backfill_state["errors"] += 1
+                print(f"[Thumbnail Error] {path} -> {e}")
+    return dict(_backfill_state)
+
+
+def start_backfill() -> bool:
+    """在后台线程中回填缩略图；已有回填在运行时返回 False"""
+    with _backfill_lock:
+        if _backfill_state["running"]:
+            return False
+        _backfill_state.update(running=True, created=0, scanned=0, errors=0)
+
+    def run():
+        try:
+            stats = backfill_thumbnails()
+            print(f"[Thumbnail] 回填完成: {stats}")
+        finally:
+            _backfill_state["running"] = False
+
+    threading.Thread(target=run, name="thumb-backfill", daemon=True).start()
+    return True
+
+
+def backfill_status() -> dict:
+    return dict(_backfill_state, sizes=THUMBNAIL_SIZES)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print("用法: python thumbnails.py backfill")
+        sys.exit(1)
+    print(f"[Thumbnail] 回填完成: {backfill_thumbnails()}")
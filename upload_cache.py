@@ -0,0 +1,144 @@
+"""
+上传缓存：按文件内容哈希记录已上传的外部 URL。
+
+同一张参考图经常被反复上传（/quick-upload、/upload-images），
+命中缓存时 upload_file 直接返回之前的 URL，不产生任何网络请求。
+
+配置（.env）：
+    UPLOAD_CACHE_ENABLED   是否启用，默认 1
+    UPLOAD_CACHE_PATH      SQLite 文件路径，默认 history/upload_cache.sqlite3
+    UPLOAD_CACHE_TTL       缓存有效期（秒），0 表示永不过期，默认 0
+    UPLOAD_CACHE_VALIDATE  命中时是否先 HEAD 检查 URL 仍可访问，默认 0
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+UPLOAD_CACHE_ENABLED = os.getenv("UPLOAD_CACHE_ENABLED", "1") == "1"
+UPLOAD_CACHE_PATH = os.getenv("UPLOAD_CACHE_PATH", "history/upload_cache.sqlite3")
+UPLOAD_CACHE_TTL = int(os.getenv("UPLOAD_CACHE_TTL", "0"))
+UPLOAD_CACHE_VALIDATE = os.getenv("UPLOAD_CACHE_VALIDATE", "0") == "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    digest     TEXT NOT NULL,  -- 文件内容 sha256
+    backend    TEXT NOT NULL,  -- 上传后端，如 imgbb / github_jsdelivr
+    url        TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (digest, backend)
+);
+"""
+
+
+def file_digest(file_path: str) -> str:
+    """计算文件内容的 sha256（分块读取）"""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class UploadCache:
+    """内容哈希 → 外部 URL 的持久化缓存（线程安全，每个线程一个连接）"""
+
+    def __init__(
+        self,
+        db_path=UPLOAD_CACHE_PATH,
+        ttl=UPLOAD_CACHE_TTL,
+        validate=UPLOAD_CACHE_VALIDATE,
+    ):
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # 过期或校验失败而被丢弃的条目
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _is_valid(self, url: str) -> bool:
+        try:
+            resp = requests.head(url, timeout=5, allow_redirects=True)
+            return resp.status_code == 200
+        except Exception:
+            return False
+
+    def get(self, digest: str, backend: str):
+        """命中返回 URL，未命中（或已过期 / 校验失败）返回 None"""
+        row = (
+            self._conn()
+            .execute(
+                "SELECT url, created_at FROM uploads WHERE digest = ? AND backend = ?",
+                (digest, backend),
+            )
+            .fetchone()
+        )
+        if row is None:
+            self._count("misses")
+            return None
+
+        url, created_at = row
+        expired = self.ttl > 0 and time.time() - created_at > self.ttl
+        if expired or (self.validate and not self._is_valid(url)):
+            self.delete(digest, backend)
+            self._count("evictions")
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        return url
+
+    def put(self, digest: str, backend: str, url: str):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (digest, backend, url, created_at)"
+                " VALUES (?, ?, ?, ?)",
+                (digest, backend, url, time.time()),
+            )
+
+    def delete(self, digest: str, backend: str):
+        with self._conn() as conn:
+            conn.execute(
+                "DELETE FROM uploads WHERE digest = ? AND backend = ?",
+                (digest, backend),
+            )
+
+    def stats(self) -> dict:
+        entries = self._conn().execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "ttl": self.ttl,
+            "validate": self.validate,
+        }
@@ -0,0 +1,121 @@
+"""
+外部上传前的缩小（upload_file 使用）。
+
+history/inputs 中保存的始终是完整分辨率的原图；上传到 ImgBB / GitHub 的是按目标
+缩小后的副本。生成服务输出的分辨率由 size（1K / 2K / 4K）和 aspect_ratio 决定，
+参考图超出这个范围的像素不会被用到，只会增加上传时间、服务商拉取时间和第三方流量：
+
+- 目标框：size 对应的长边（1K=1024、2K=2048、4K=4096，且不超过 UPLOAD_MAX_EDGE），
+  按 aspect_ratio 算出宽高；缩小到刚好覆盖目标框（aspect_ratio 为 auto 或未提供时，
+  长边不超过目标长边）
+- 不放大；未提供 size 时只按 UPLOAD_MAX_EDGE 限制
+- 副本超过 UPLOAD_MAX_BYTES 时逐步降低 JPEG 质量，仍然超出再继续缩小
+- 原图本身已满足要求时不生成副本，直接上传原图
+
+注意：参考图按上传时选择的 size 缩小，之后改选更大的 size 不会重新上传。
+
+配置（.env）：
+    UPLOAD_RESIZE_ENABLED  是否启用，默认 1
+    UPLOAD_MAX_EDGE        上传副本的最长边上限（像素），默认 4096
+    UPLOAD_MAX_BYTES       上传副本的字节上限，0 表示不限制，默认 4194304（4 MB）
+    UPLOAD_RESIZE_QUALITY  副本的初始 JPEG 质量，默认 90
+"""
+
+import io
+import os
+import tempfile
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from metrics import STAGE_BYTES_IN, STAGE_BYTES_OUT, timed
+
+load_dotenv()
+
+UPLOAD_RESIZE_ENABLED = os.getenv("UPLOAD_RESIZE_ENABLED", "1") == "1"
+UPLOAD_MAX_EDGE = int(os.getenv("UPLOAD_MAX_EDGE", "4096"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(4 * 1024 * 1024)))
+UPLOAD_RESIZE_QUALITY = int(os.getenv("UPLOAD_RESIZE_QUALITY", "90"))
+
+SIZE_EDGES = {"1K": 1024, "2K": 2048, "4K": 4096}
+# 超出字节上限时质量最低降到这里，再不够就缩小尺寸
+MIN_QUALITY = 70
+
+
+def _target_box(size, aspect_ratio):
+    """(宽, 高, 是否按覆盖方式缩放)"""
+    edge = min(SIZE_EDGES.get(str(size).upper(), UPLOAD_MAX_EDGE), UPLOAD_MAX_EDGE)
+    try:
+        w, h = (float(x) for x in str(aspect_ratio).split(":"))
+        if w <= 0 or h <= 0:
+            raise ValueError
+    except ValueError:
+        return edge, edge, False
+    if w >= h:
+        return edge, edge * h / w, True
+    return edge * w / h, edge, True
+
+
+def plan_upload_copy(file_path, size=None, aspect_ratio=None):
+    """
+    只读取文件头，决定上传副本的尺寸。返回 (宽, 高)；不需要副本时返回 None。
+    """
+    if not UPLOAD_RESIZE_ENABLED:
+        return None
+    with Image.open(file_path) as img:
+        width, height = img.size
+    box_w, box_h, cover = _target_box(size, aspect_ratio)
+    if cover:
+        scale = max(box_w / width, box_h / height)
+    else:
+        scale = box_w / max(width, height)
+    scale = min(scale, UPLOAD_MAX_EDGE / max(width, height), 1.0)
+
+    if scale >= 1.0 and (
+        not UPLOAD_MAX_BYTES or os.path.getsize(file_path) <= UPLOAD_MAX_BYTES
+    ):
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode_within_budget(img) -> bytes:
+    quality = UPLOAD_RESIZE_QUALITY
+    while True:
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=quality)
+        if not UPLOAD_MAX_BYTES or buf.tell() <= UPLOAD_MAX_BYTES:
+            return buf.getvalue()
+        if quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - 10)
+            continue
+        # 质量已降到下限：尺寸缩小到 80% 后从初始质量重新开始
+        img = img.resize(
+            (max(1, round(img.width * 0.8)), max(1, round(img.height * 0.8))),
+            Image.LANCZOS,
+        )
+        quality = UPLOAD_RESIZE_QUALITY
+
+
+def make_upload_copy(file_path, target) -> str:
+    """按 plan_upload_copy() 的尺寸生成 JPEG 副本（临时文件），调用方负责删除"""
+    with timed("make_upload_copy"):
+        STAGE_BYTES_IN.inc("make_upload_copy", amount=os.path.getsize(file_path))
+        with Image.open(file_path) as img:
+            img.draft("RGB", target)  # JPEG 按 1/2、1/4、1/8 比例直接缩小解码
+            if img.mode in ("RGBA", "LA", "PA") or (
+                img.mode == "P" and "transparency" in img.info
+            ):
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.split()[-1])
+            else:
+                img = img.convert("RGB")
+            if img.size != tuple(target):
+                img = img.resize(target, Image.LANCZOS)
+            data = _encode_within_budget(img)
+
+        fd, copy_path = tempfile.mkstemp(prefix="upload-", suffix=".jpg")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        STAGE_BYTES_OUT.inc("make_upload_copy", amount=len(data))
+    return copy_path
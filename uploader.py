@@ -1,14 +1,22 @@
 # uploader.py
 import os
+import queue
 import shutil
 import subprocess
-import tempfile
+import threading
+import time
 import uuid
+from concurrent.futures import Future
 from pathlib import Path
 
 import requests
 from dotenv import load_dotenv
 
+from coordination import file_lock
+from metrics import STAGE_BYTES_OUT, UPLOAD_CACHE_LOOKUPS, timed
+from upload_cache import UPLOAD_CACHE_ENABLED, UploadCache, file_digest
+from upload_resize import make_upload_copy, plan_upload_copy
+
 load_dotenv()
 
 # 配置
@@ -19,35 +27,82 @@ GITHUB_USERNAME = os.getenv("GITHUB_USERNAME", "")
 GITHUB_REPO = os.getenv("GITHUB_REPO", "")
 GITHUB_BRANCH = os.getenv("GITHUB_BRANCH", "main")
 LOCAL_REPO_PATH = os.getenv("LOCAL_REPO_PATH", "")  # 本地 Git 仓库路径（绝对或相对）
+GITHUB_REMOTE = os.getenv("GITHUB_REMOTE", "origin")
+# 批量提交：窗口内（秒）到达的图片合并为一次 commit + push，单批最多 GITHUB_BATCH_MAX 张
+GITHUB_BATCH_WINDOW = float(os.getenv("GITHUB_BATCH_WINDOW", "0.2"))
+GITHUB_BATCH_MAX = int(os.getenv("GITHUB_BATCH_MAX", "50"))
+# 单个 git 命令的超时（秒），网络卡住时整批失败而不是让调用方一直等待
+GITHUB_GIT_TIMEOUT = float(os.getenv("GITHUB_GIT_TIMEOUT", "120"))
 
 # ImgBB 配置
 IMGBB_API_KEY = os.getenv("IMGBB_API_KEY")
+IMGBB_UPLOAD_URL = os.getenv("IMGBB_UPLOAD_URL", "https://api.imgbb.com/1/upload")
+
+
+# 按内容哈希缓存已上传的 URL，相同图片不再重复上传
+upload_cache = UploadCache() if UPLOAD_CACHE_ENABLED else None
 
 
 class UploadError(Exception):
     pass
 
 
-def upload_file(file_path: str, filename: str = None) -> str:
+def upload_file(
+    file_path: str, filename: str = None, size: str = None, aspect_ratio: str = None
+) -> str:
     """
     通用上传入口
-    :param file_path: 本地文件路径（必须是 JPG）
+    :param file_path: 本地文件路径（完整分辨率的原图，本身不会被修改）
     :param filename: 可选，用于 GitHub 模式生成路径
+    :param size: 可选，生成分辨率（1K / 2K / 4K），上传按它缩小的副本（见 upload_resize）
+    :param aspect_ratio: 可选，生成长宽比，与 size 一起决定副本尺寸
     :return: 外网可访问的 URL
     """
-    if UPLOAD_BACKEND == "github_jsdelivr":
-        return _upload_to_github_jsdelivr(file_path, filename)
-    elif UPLOAD_BACKEND == "imgbb":
-        return _upload_to_imgbb(file_path)
-    else:
+    if UPLOAD_BACKEND not in ("github_jsdelivr", "imgbb"):
         raise UploadError(f"Unsupported UPLOAD_BACKEND: {UPLOAD_BACKEND}")
 
+    target = plan_upload_copy(file_path, size, aspect_ratio)
+
+    digest = None
+    if upload_cache is not None:
+        # 同一张原图的不同尺寸副本分别缓存
+        digest = file_digest(file_path)
+        if target is not None:
+            digest = f"{digest}:{target[0]}x{target[1]}"
+        cached_url = upload_cache.get(digest, UPLOAD_BACKEND)
+        UPLOAD_CACHE_LOOKUPS.inc("hit" if cached_url else "miss")
+        if cached_url:
+            return cached_url
+
+    upload_path = make_upload_copy(file_path, target) if target else file_path
+    try:
+        with timed("upload_file", UPLOAD_BACKEND):
+            if UPLOAD_BACKEND == "github_jsdelivr":
+                url = _upload_to_github_jsdelivr(upload_path, filename)
+            else:
+                url = _upload_to_imgbb(upload_path)
+        STAGE_BYTES_OUT.inc("upload_file", amount=os.path.getsize(upload_path))
+    finally:
+        if upload_path != file_path:
+            os.remove(upload_path)
+
+    if digest is not None:
+        upload_cache.put(digest, UPLOAD_BACKEND, url)
+    return url
+
+
+def get_upload_cache_stats() -> dict:
+    """上传缓存的命中/未命中统计"""
+    if upload_cache is None:
+        return {"enabled": False}
+    return upload_cache.stats()
+
 
 def _upload_to_imgbb(file_path: str) -> str:
     """上传到 ImgBB，返回 CDN URL"""
     with open(file_path, "rb") as f:
         resp = requests.post(
-            "https://api.imgbb.com/1/upload",
+            IMGBB_UPLOAD_URL,
             data={"key": IMGBB_API_KEY},
             files={"image": f},
         )
@@ -56,8 +111,142 @@ def _upload_to_imgbb(file_path: str) -> str:
     return resp.json()["data"]["url"]
 
 
+class GitBatchUploader:
+    """
+    GitHub 后端的批量提交器：单个写线程负责一个本地仓库，
+    把并发调用者提交的文件在一个短窗口内（或达到数量上限时）
+    合并为一次 git add / commit / push，推送成功后统一返回。
+    多 worker 部署时各进程的写线程通过文件锁轮流提交，避免提交到别人暂存的文件。
+    """
+
+    def __init__(
+        self,
+        repo_path,
+        remote="origin",
+        branch="main",
+        subdir="images",
+        window=0.2,
+        max_batch=50,
+        timeout=120,
+    ):
+        self.repo_path = Path(repo_path).resolve()
+        self.remote = remote
+        self.branch = branch
+        self.subdir = subdir
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def upload(self, file_path: str) -> str:
+        """复制文件到仓库并等待所在批次推送完成，返回仓库内相对路径（如 images/xxx.jpg）"""
+        # 生成唯一文件名（避免覆盖 & CDN 缓存问题）
+        unique_name = f"{uuid.uuid4().hex}{Path(file_path).suffix or '.jpg'}"
+        target = self.repo_path / self.subdir / unique_name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(file_path, target)
+
+        rel_path = f"{self.subdir}/{unique_name}"
+        future = Future()
+        self._ensure_writer()
+        self._queue.put((rel_path, future))
+        return future.result()
+
+    def _ensure_writer(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._writer_loop, name="git-uploader", daemon=True
+                )
+                self._thread.start()
+
+    def _writer_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _git(self, *args, check=True):
+        subprocess.run(
+            ["git", *args],
+            cwd=self.repo_path,
+            check=check,
+            stdout=subprocess.DEVNULL,
+            timeout=self.timeout,
+        )
+
+    def _flush(self, batch):
+        paths = [rel_path for rel_path, _ in batch]
+        try:
+            with file_lock(self.repo_path / ".git" / "batch-uploader.lock"):
+                try:
+                    self._push_batch(paths)
+                except Exception:
+                    self._discard_batch(paths)
+                    raise
+        except Exception as e:
+            # 任何异常（git 失败、超时、文件锁出错…）都只让这一批失败，写线程继续运行
+            error = UploadError(f"Git push failed: {e}")
+            for _, future in batch:
+                future.set_exception(error)
+            return
+
+        print(f"[GitUploader] 已推送 {len(paths)} 张图片")
+        for rel_path, future in batch:
+            future.set_result(rel_path)
+
+    def _push_batch(self, paths):
+        self._git("add", "--", *paths)
+        self._git("commit", "-q", "-m", f"Add {len(paths)} image(s) via uploader")
+        try:
+            self._git("push", "-q", self.remote, self.branch)
+        except subprocess.CalledProcessError:
+            # 远端有新提交时先 rebase 再推一次
+            self._git("pull", "-q", "--rebase", self.remote, self.branch)
+            self._git("push", "-q", self.remote, self.branch)
+
+    def _discard_batch(self, paths):
+        """
+        推送失败后把本地仓库恢复到远端分支的状态：中止未完成的 rebase，丢弃未推送的
+        提交和这一批的文件。否则留下的提交会让之后每一批的推送都被拒绝。
+        """
+        self._git("rebase", "--abort", check=False)  # 没有进行中的 rebase 时忽略
+        self._git("reset", "-q", "--hard", f"{self.remote}/{self.branch}", check=False)
+        for rel_path in paths:
+            (self.repo_path / rel_path).unlink(missing_ok=True)
+
+
+_git_uploader = None
+_git_uploader_lock = threading.Lock()
+
+
+def _get_git_uploader(repo_path: Path) -> GitBatchUploader:
+    global _git_uploader
+    with _git_uploader_lock:
+        if _git_uploader is None:
+            _git_uploader = GitBatchUploader(
+                repo_path,
+                remote=GITHUB_REMOTE,
+                branch=GITHUB_BRANCH,
+                window=GITHUB_BATCH_WINDOW,
+                max_batch=GITHUB_BATCH_MAX,
+                timeout=GITHUB_GIT_TIMEOUT,
+            )
+        return _git_uploader
+
+
 def _upload_to_github_jsdelivr(file_path: str, original_filename: str = "") -> str:
-    """上传到本地 Git 仓库 + 推送，返回 jsDelivr URL"""
+    """上传到本地 Git 仓库 + 推送（与并发请求合并为一次提交），返回 jsDelivr URL"""
     if not all([GITHUB_USERNAME, GITHUB_REPO, LOCAL_REPO_PATH]):
         raise UploadError("Missing GitHub config for jsDelivr backend")
 
@@ -65,33 +254,8 @@ def _upload_to_github_jsdelivr(file_path: str, original_filename: str = "") -> s
     if not repo_path.exists():
         raise UploadError(f"LOCAL_REPO_PATH not found: {repo_path}")
 
-    # 生成唯一文件名（避免覆盖 & CDN 缓存问题）
-    ext = ".jpg"
-    unique_name = f"{uuid.uuid4().hex}{ext}"
-    remote_subdir = "images"
-    remote_path = repo_path / remote_subdir / unique_name
-
-    # 确保目录存在
-    remote_path.parent.mkdir(parents=True, exist_ok=True)
-
-    # 复制文件
-    shutil.copy2(file_path, remote_path)
-
-    # Git 操作
-    try:
-        subprocess.run(["git", "add", str(remote_path)], cwd=repo_path, check=True)
-        subprocess.run(
-            ["git", "commit", "-m", f"Add image via uploader: {unique_name}"],
-            cwd=repo_path,
-            check=True,
-        )
-        subprocess.run(
-            ["git", "push", "origin", GITHUB_BRANCH], cwd=repo_path, check=True
-        )
-    except subprocess.CalledProcessError as e:
-        raise UploadError(f"Git push failed: {e}")
+    jsdelivr_path = _get_git_uploader(repo_path).upload(file_path)
 
     # 构造 jsDelivr URL（注意路径分隔符）
-    jsdelivr_path = f"{remote_subdir}/{unique_name}".replace("\\", "/")
     url = f"https://cdn.jsdelivr.net/gh/{GITHUB_USERNAME}/{GITHUB_REPO}@{GITHUB_BRANCH}/{jsdelivr_path}"
     return url